@@ -1,33 +1,45 @@
+import json
 import logging
 from datetime import timedelta
 
 from fastapi import APIRouter, HTTPException, Depends, Request, Form
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi import Response
+from fastapi.responses import (
+    JSONResponse, HTMLResponse, RedirectResponse, StreamingResponse
+)
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 import aioredis
 import secrets
 
-from app.db.init_db import get_db
+from app.db.init_db import get_db, get_read_db
 from app.db.models import User
+from app.bot.sessions import RedisSessionStore
 from app.services.auth import AuthService
+from app.services.answer_cache import AnswerCacheService
+from app.services.ask_jobs import AskJobService
+from app.services.ask_service import AskService
+from app.services.conversation import ConversationService
+from app.services.password_hasher import PasswordHasher
 from app.services.openai_service import OpenAIService
-from app.services.message_limit import MessageLimitService
 from app.services.token_service import TokenService
-from app.schemas.user import RegisterUser, Question
+from app.schemas.user import (
+    AskJob, RegisterUser, Question, ResetConversation
+)
 from app.schemas.token import Token
-from app.core.status_codes import StatusMessages
+from app.core.status_codes import StatusMessages, get_chat_error_text
+from app.core import metrics
 from app.core.config import settings
 
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
-daily_message_limit = settings.DAILY_MESSAGE_LIMIT
-logging.basicConfig(level=logging.INFO)
+metrics.track_redis_pool("api", redis_client)
 logger = logging.getLogger(__name__)
 
 
@@ -35,6 +47,44 @@ def generate_bot_token(user_id: int) -> str:
     return secrets.token_urlsafe(32)
 
 
+def ndjson_line(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+async def stream_answer(
+    user_id: int,
+    question: str,
+    tokens_needed: int,
+    reserved: int,
+    format_error=None,
+    conversation: str = None,
+    history: list = None
+):
+    events = AskService.stream_events(
+        redis_client, user_id, question, tokens_needed, reserved,
+        format_error=format_error,
+        conversation=conversation,
+        history=history
+    )
+    try:
+        async for event in events:
+            yield ndjson_line(event)
+    finally:
+        await events.aclose()
+
+
+def streaming_response(generator, headers: dict = None) -> StreamingResponse:
+    return StreamingResponse(
+        generator,
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            **(headers or {})
+        }
+    )
+
+
 @router.get("/", response_class=HTMLResponse)
 async def read_root(request: Request, db: AsyncSession = Depends(get_db)):
     try:
@@ -43,7 +93,7 @@ async def read_root(request: Request, db: AsyncSession = Depends(get_db)):
             "request": request,
             "current_user": current_user,
             "telegram_bot_url": settings.TELEGRAM_BOT_URL,
-            "tokens_remaining": current_user.tokens
+            "tokens_remaining": await TokenService.get_balance(current_user)
         }
 
         if current_user:
@@ -73,7 +123,7 @@ async def chat_page(request: Request, db: AsyncSession = Depends(get_db)):
             "chat.html",
             {"request": request,
              "current_user": current_user,
-             "tokens_remaining": current_user.tokens}
+             "tokens_remaining": await TokenService.get_balance(current_user)}
         )
     except HTTPException:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -83,6 +133,7 @@ async def chat_page(request: Request, db: AsyncSession = Depends(get_db)):
 async def chat(
     message: dict,
     request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db)
 ):
     try:
@@ -94,57 +145,61 @@ async def chat(
         )
 
     user_id = current_user.id
-
-    if len(message['message']) > 1000:
-        return {
-            "response": "Максимальная длина сообщения - 1000 символов.",
-            "error": True
-        }
-
+    conversation = ConversationService.make_key(user_id)
     try:
-        await MessageLimitService.check_and_increment_question_count(
-            redis_client,
-            user_id
+        prepared = await AskService.prepare(
+            redis_client, current_user, message['message'], db, conversation
         )
-    except HTTPException:
-        limit_message = StatusMessages.get_message_limit_text(
-            daily_message_limit
+    except HTTPException as e:
+        response.headers.update(e.headers or {})
+        # Тексты ошибок 400 (длина вопроса, баланс) уже для пользователя
+        text = e.detail if e.status_code == 400 else (
+            get_chat_error_text(e.status_code)
+        )
+        return {"response": text, "error": True}
+    response.headers.update(prepared.rate_limit.headers())
+    tokens_needed, reserved = prepared.tokens_needed, prepared.reserved
+    # Соединение с базой не держим на время запроса к OpenAI
+    await db.close()
+
+    if message.get('stream'):
+        return streaming_response(
+            stream_answer(
+                user_id, message['message'], tokens_needed, reserved,
+                format_error=get_chat_error_text,
+                conversation=conversation,
+                history=prepared.history
+            ),
+            headers=prepared.rate_limit.headers()
         )
-        return {"response": limit_message, "error": True}
-
-    tokens_needed = TokenService.count_tokens(message['message'])
-    if not await TokenService.deduct_tokens(user_id, tokens_needed, db):
-        return {"response": "Недостаточно токенов.", "error": True}
 
     try:
-        response_text = await OpenAIService.ask_question(message['message'])
-        tokens_used = TokenService.count_tokens(response_text)
-        if not await TokenService.deduct_tokens(user_id, tokens_used, db):
+        try:
+            answer, cached = await AnswerCacheService.ask_question(
+                redis_client, message['message'], user_id, prepared.history
+            )
+        except Exception:
+            await TokenService.refund_tokens(user_id, reserved, db)
+            raise
+
+        balance, _ = await AskService.settle_answer(
+            db, user_id, reserved, tokens_needed, answer, cached
+        )
+        if balance is None:
             return {
                 "response": "Недостаточно токенов для получения ответа.",
                 "error": True
             }
-
-        current_user.tokens -= (tokens_needed + tokens_used)
-        await db.commit()
+        await AskService.remember_turn(
+            redis_client, conversation, message['message'], answer
+        )
 
         return {
-            "response": response_text,
-            "tokens_remaining": current_user.tokens
+            "response": answer.text,
+            "tokens_remaining": balance
         }
     except HTTPException as e:
-        if e.status_code == 401:
-            return {"response": StatusMessages.SESSION_EXPIRED, "error": True}
-        elif e.status_code == 422:
-            return {"response": StatusMessages.VALIDATION_ERROR, "error": True}
-        elif e.status_code == 451:
-            return {"response": StatusMessages.get_message_limit_text(daily_message_limit), "error": True}
-        elif e.status_code == 403:
-            return {"response": StatusMessages.FORBIDDEN, "error": True}
-        elif e.status_code == 500:
-            return {"response": StatusMessages.SERVER_ERROR, "error": True}
-        else:
-            return {"response": StatusMessages.UNEXPECTED_ERROR.format(status=e.status_code), "error": True}
+        return {"response": get_chat_error_text(e.status_code), "error": True}
 
     except Exception as e:
         logger.error(f"Неожиданная ошибка: {str(e)}")
@@ -210,7 +265,7 @@ async def register_user_form(
             content={"error": "Email уже зарегистрирован"}, status_code=400
         )
 
-    hashed_password = AuthService.pwd_context.hash(password)
+    hashed_password = await PasswordHasher.hash(password)
     new_user = User(email=email, hashed_password=hashed_password)
     db.add(new_user)
     try:
@@ -251,7 +306,7 @@ async def register_user(
                 detail="Email уже зарегистрирован"
             )
 
-        hashed_password = AuthService.pwd_context.hash(register_user.password)
+        hashed_password = await PasswordHasher.hash(register_user.password)
         new_user = User(
             email=register_user.email,
             hashed_password=hashed_password,
@@ -265,6 +320,8 @@ async def register_user(
             "password": "********",
             "message": "Пользователь успешно зарегистрирован"
         }
+    except HTTPException:
+        raise
     except IntegrityError:
         await db.rollback()
         raise HTTPException(
@@ -290,7 +347,7 @@ async def logout(request: Request):
 @router.get("/health")
 async def health_check(db: AsyncSession = Depends(get_db)):
     try:
-        await db.execute("SELECT 1")
+        await db.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         logger.error(f"Проверка состояния не удалась: {str(e)}")
@@ -299,6 +356,20 @@ async def health_check(db: AsyncSession = Depends(get_db)):
         }
 
 
+@router.get("/health/openai")
+async def openai_status():
+    # Текущий лимит одновременных запросов, очередь и предохранители
+    return OpenAIService.status()
+
+
+@router.get("/metrics")
+async def metrics_endpoint():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -343,7 +414,9 @@ async def refresh_token(request: Request, db: AsyncSession = Depends(get_db)):
 
 
 @router.post("/verify_token")
-async def verify_token(token_data: dict, db: AsyncSession = Depends(get_db)):
+async def verify_token(
+    token_data: dict, db: AsyncSession = Depends(get_read_db)
+):
     token = token_data.get("token")
     if not token:
         raise HTTPException(
@@ -376,52 +449,142 @@ async def verify_token(token_data: dict, db: AsyncSession = Depends(get_db)):
 async def ask(
     question: Question,
     request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db)
 ):
-    logger.info(f"Получен запрос на /ask: {question.question}")
     try:
         current_user = await AuthService.get_current_user(request, db)
-        logger.info(f"Пользователь аутентифицирован: {current_user.email}")
     except HTTPException as e:
         logger.error(f"Ошибка аутентификации: {str(e)}")
         raise e
     user_id = current_user.id
+    # Текст вопроса и email в лог не попадают
+    logger.info("Получен запрос на /ask", extra={
+        "user_id": user_id,
+        "question_chars": len(question.question),
+        "stream": question.stream,
+    })
+
+    conversation = ConversationService.make_key(user_id, question.user_id)
+    prepared = await AskService.prepare(
+        redis_client, current_user, question.question, db, conversation
+    )
+    response.headers.update(prepared.rate_limit.headers())
+    await db.close()
+
+    if question.stream:
+        return streaming_response(
+            stream_answer(
+                user_id, question.question,
+                prepared.tokens_needed, prepared.reserved,
+                conversation=conversation,
+                history=prepared.history
+            ),
+            headers=prepared.rate_limit.headers()
+        )
 
-    if len(question.question) > 1000:
+    try:
+        answer, cached = await AnswerCacheService.ask_question(
+            redis_client, question.question, user_id, prepared.history
+        )
+    except Exception:
+        await TokenService.refund_tokens(user_id, prepared.reserved, db)
+        raise
+
+    balance, tokens_used = await AskService.settle_answer(
+        db, user_id, prepared.reserved, prepared.tokens_needed,
+        answer, cached
+    )
+    if balance is None:
         raise HTTPException(
             status_code=400,
-            detail="Максимальная длина вопроса - 1000 символов."
+            detail="Недостаточно токенов для получения ответа."
         )
+    await AskService.remember_turn(
+        redis_client, conversation, question.question, answer
+    )
+    return {
+        "response": answer.text,
+        "tokens_used": tokens_used,
+        "tokens_remaining": balance
+    }
 
-    try:
-        await MessageLimitService.check_and_increment_question_count(
-            redis_client, user_id
+
+@router.post("/jobs", status_code=202)
+async def submit_job(
+    job: AskJob,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db)
+):
+    if not settings.ASK_JOBS_ENABLED:
+        raise HTTPException(status_code=404, detail="Режим заданий отключен")
+    current_user = await AuthService.get_current_user(request, db)
+    user_id = current_user.id
+
+    if job.push and not await RedisSessionStore.is_bound(
+        redis_client, job.user_id, current_user.email
+    ):
+        # Ответ уходит только в чат, где бот выполнил вход этого
+        # пользователя, иначе любой мог бы писать в чужие чаты
+        raise HTTPException(
+            status_code=403,
+            detail="Чат не привязан к этому пользователю"
         )
-    except HTTPException as e:
-        raise e
 
-    tokens_needed = TokenService.count_tokens(question.question)
-    if not await TokenService.deduct_tokens(user_id, tokens_needed, db):
+    conversation = ConversationService.make_key(user_id, job.user_id)
+    prepared = await AskService.prepare(
+        redis_client, current_user, job.question, db, conversation
+    )
+    response.headers.update(prepared.rate_limit.headers())
+    try:
+        job_id = await AskJobService.submit(
+            user_id, job.question, prepared, conversation,
+            chat_id=job.user_id if job.push else None
+        )
+    except Exception as e:
+        logger.error(f"Ошибка постановки задания в очередь: {str(e)}")
+        await TokenService.refund_tokens(user_id, prepared.reserved, db)
         raise HTTPException(
-            status_code=400,
-            detail="Недостаточно токенов для отправки вопроса."
+            status_code=503,
+            detail=StatusMessages.SERVICE_UNAVAILABLE
         )
+    return {"job_id": job_id, "status": AskJobService.STATUS_QUEUED}
+
 
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    request: Request,
+    wait: float = 0,
+    db: AsyncSession = Depends(get_read_db)
+):
+    current_user = await AuthService.get_current_user(request, db)
+    await db.close()
+
+    timeout = min(max(wait, 0), settings.ASK_JOB_MAX_WAIT)
+    job = await AskJobService.wait(job_id, current_user.id, timeout)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return AskJobService.result(job_id, job)
+
+
+@router.post("/reset")
+async def reset_conversation(
+    reset: ResetConversation,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db)
+):
     try:
-        response_text = await OpenAIService.ask_question(question.question)
-        tokens_used = TokenService.count_tokens(response_text)
-        if not await TokenService.deduct_tokens(user_id, tokens_used, db):
-            raise HTTPException(
-                status_code=400,
-                detail="Недостаточно токенов для получения ответа."
-            )
-        return {
-            "response": response_text,
-            "tokens_used": tokens_needed + tokens_used,
-            "tokens_remaining": current_user.tokens
-        }
-    except HTTPException as e:
-        raise e
+        current_user = await AuthService.get_current_user(request, db)
+    except HTTPException:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    await ConversationService.reset(
+        redis_client,
+        ConversationService.make_key(current_user.id, reset.user_id)
+    )
+    return {"message": "История диалога очищена."}
 
 
 @router.get("/tokenbalance")
@@ -434,4 +597,6 @@ async def get_token_balance(
     except HTTPException:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    return {"tokens_remaining": current_user.tokens}
+    return {
+        "tokens_remaining": await TokenService.get_balance(current_user)
+    }
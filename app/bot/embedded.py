@@ -0,0 +1,252 @@
+import logging
+from datetime import timedelta
+from typing import Optional
+
+import aioredis
+from fastapi import HTTPException
+from telegram import Update
+from telegram.ext import Application, CallbackContext, ConversationHandler
+
+from app.bot.sessions import BotSession
+from app.bot.telegram_bot import (
+    BotHandlers, LOGIN_PASSWORD, build_application, handle_api_error,
+    reply_with_events, send_greeting, session_store
+)
+from app.core import metrics
+from app.core.config import settings
+from app.core.status_codes import StatusMessages, get_chat_error_text
+from app.db.init_db import AsyncSessionLocal, ReadSessionLocal
+from app.db.models import User
+from app.services.ask_service import AskService
+from app.services.auth import AuthService
+from app.services.conversation import ConversationService
+from app.services.token_service import TokenService
+
+logger = logging.getLogger(__name__)
+redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+metrics.track_redis_pool("embedded_bot", redis_client)
+
+
+def create_session(user) -> BotSession:
+    # Токен выдается, как и в /token, чтобы сессии были общими для режимов
+    access_token = AuthService.create_access_token(
+        data={"sub": user.email},
+        expires_delta=timedelta(
+            minutes=AuthService.ACCESS_TOKEN_EXPIRE_MINUTES
+        )
+    )
+    return BotSession(email=user.email, token=access_token)
+
+
+def get_error_text(e: HTTPException) -> str:
+    if e.status_code == 400:
+        return e.detail
+    return get_chat_error_text(e.status_code)
+
+
+async def get_session_user(update: Update):
+    chat_id = update.message.chat_id
+    user_session = await session_store.get(chat_id)
+    if user_session is None:
+        await update.message.reply_text(StatusMessages.LOGIN_REQUIRED)
+        return None
+
+    async with AsyncSessionLocal() as db:
+        user = await AuthService.get_user_snapshot(user_session.email, db)
+    if user is None:
+        await update.message.reply_text(StatusMessages.SESSION_EXPIRED)
+        await session_store.delete(chat_id)
+    return user
+
+
+async def handle_auth_token(update: Update, context: CallbackContext) -> None:
+    auth_token = context.args[0] if context.args else None
+    if not auth_token:
+        await update.message.reply_text(
+            "Пожалуйста, используйте ссылку "
+            "с сайта для автоматической авторизации."
+        )
+        return
+
+    try:
+        user = None
+        user_id = await redis_client.get(f"bot_token:{auth_token}")
+        if user_id:
+            async with ReadSessionLocal() as db:
+                user = await db.get(User, int(user_id))
+        if user is None:
+            await update.message.reply_text(
+                "Неверный или устаревший токен. "
+                "Пожалуйста, войдите через сайт."
+            )
+            return
+
+        await session_store.set(update.message.chat_id, create_session(user))
+        await update.message.reply_text(
+            "Вы успешно авторизованы. "
+            "Теперь вы можете задавать вопросы."
+        )
+    except Exception as e:
+        await handle_api_error(update, str(e))
+
+
+async def start(update: Update, context: CallbackContext) -> None:
+    if context.args:
+        await handle_auth_token(update, context)
+    else:
+        await send_greeting(update)
+
+
+async def get_login_password(update: Update, context: CallbackContext) -> int:
+    email = context.chat_data.get("login_email")
+    if email is None:
+        await update.message.reply_text(
+            "Пожалуйста, начните вход заново командой /login."
+        )
+        return ConversationHandler.END
+    password = update.message.text
+
+    if len(password) < 6:
+        await update.message.reply_text(
+            "Пароль должен содержать минимум 6 символов."
+        )
+        return LOGIN_PASSWORD
+
+    context.chat_data.pop("login_email", None)
+    try:
+        async with AsyncSessionLocal() as db:
+            user = await AuthService.authenticate_user(db, email, password)
+        if not user:
+            await handle_api_error(update, "Неверный email или пароль")
+            return ConversationHandler.END
+
+        await session_store.set(update.message.chat_id, create_session(user))
+        await update.message.reply_text(
+            "Успешный вход. Теперь вы можете задавать вопросы."
+        )
+    except HTTPException as e:
+        await handle_api_error(update, e.detail)
+    except Exception as e:
+        await handle_api_error(update, str(e))
+    return ConversationHandler.END
+
+
+async def answer_question(update: Update, context: CallbackContext) -> None:
+    question_text = update.message.text
+    if len(question_text) > 2000:
+        await update.message.reply_text(
+            "Максимальная длина сообщения - 2000 символов."
+        )
+        return
+
+    try:
+        user = await get_session_user(update)
+        if user is None:
+            return
+        logger.info("Получен вопрос", extra={
+            "chat_id": update.message.chat_id,
+            "user_id": user.id,
+            "question_chars": len(question_text),
+        })
+
+        conversation = ConversationService.make_key(
+            user.id, update.message.chat_id
+        )
+        async with AsyncSessionLocal() as db:
+            prepared = await AskService.prepare(
+                redis_client, user, question_text, db, conversation
+            )
+    except HTTPException as e:
+        await update.message.reply_text(get_error_text(e))
+        return
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
+        return
+
+    events = AskService.stream_events(
+        redis_client, user.id, question_text,
+        prepared.tokens_needed, prepared.reserved,
+        conversation=conversation,
+        history=prepared.history
+    )
+    try:
+        await reply_with_events(update, events)
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
+    finally:
+        await events.aclose()
+
+
+async def get_token_balance(update: Update, context: CallbackContext) -> None:
+    try:
+        user = await get_session_user(update)
+        if user is None:
+            return
+        tokens_remaining = await TokenService.get_balance(user)
+        await update.message.reply_text(f"Остаток токенов: {tokens_remaining}")
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
+
+
+async def reset_conversation(
+    update: Update,
+    context: CallbackContext
+) -> None:
+    try:
+        user = await get_session_user(update)
+        if user is None:
+            return
+        await ConversationService.reset(
+            redis_client,
+            ConversationService.make_key(user.id, update.message.chat_id)
+        )
+        await update.message.reply_text(StatusMessages.CONVERSATION_RESET)
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
+
+
+EMBEDDED_HANDLERS = BotHandlers(
+    start=start,
+    get_login_password=get_login_password,
+    answer_question=answer_question,
+    get_token_balance=get_token_balance,
+    reset_conversation=reset_conversation
+)
+
+
+class EmbeddedBot:
+    # Бот работает в процессе API и вызывает сервисы напрямую, без HTTP,
+    # сериализации и повторной проверки JWT на каждое сообщение
+    _application: Optional[Application] = None
+
+    @classmethod
+    async def start(cls):
+        if cls._application is not None:
+            return
+        application = build_application(EMBEDDED_HANDLERS)
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling()
+        cls._application = application
+        logger.info("Бот запущен в процессе API.")
+
+    @classmethod
+    async def stop(cls):
+        if cls._application is None:
+            return
+        await cls._application.updater.stop()
+        await cls._application.stop()
+        await cls._application.shutdown()
+        cls._application = None
@@ -0,0 +1,50 @@
+from typing import Optional
+
+from telegram import Bot
+
+from app.bot.streaming import TELEGRAM_MESSAGE_LIMIT
+from app.core.config import settings
+from app.core.status_codes import get_chat_error_text
+
+
+def format_job_result(result: dict) -> str:
+    if "error" in result:
+        if result["status_code"] == 400:
+            return result["error"]
+        return get_chat_error_text(result["status_code"])
+    return (
+        f"{result['response']}\n\n"
+        f"Использовано токенов: {result['tokens_used']}\n"
+        f"Остаток токенов: {result['tokens_remaining']}"
+    )
+
+
+class JobResultPusher:
+    # Ответы заданий отправляются в чат прямо из воркера API
+    _bot: Optional[Bot] = None
+
+    @classmethod
+    async def get_bot(cls) -> Bot:
+        if cls._bot is None:
+            bot = Bot(
+                settings.TELEGRAM_TOKEN,
+                base_url=settings.BOT_TELEGRAM_API_URL
+            )
+            await bot.initialize()
+            cls._bot = bot
+        return cls._bot
+
+    @classmethod
+    async def send(cls, chat_id: str, result: dict):
+        bot = await cls.get_bot()
+        text = format_job_result(result)
+        for start in range(0, len(text), TELEGRAM_MESSAGE_LIMIT):
+            await bot.send_message(
+                chat_id, text[start:start + TELEGRAM_MESSAGE_LIMIT]
+            )
+
+    @classmethod
+    async def close(cls):
+        if cls._bot is not None:
+            await cls._bot.shutdown()
+        cls._bot = None
@@ -0,0 +1,153 @@
+import abc
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import aioredis
+from jose import JWTError, jwt
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BotSession(NamedTuple):
+    email: str
+    token: str
+
+
+def session_ttl(token: str) -> int:
+    # Сессия живет столько же, сколько выданный API токен
+    try:
+        expires_at = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        expires_at = None
+    if expires_at is None:
+        return settings.BOT_SESSION_TTL
+    return int(expires_at - time.time())
+
+
+class SessionStore(abc.ABC):
+    @abc.abstractmethod
+    async def get(self, chat_id: int) -> Optional[BotSession]:
+        pass
+
+    @abc.abstractmethod
+    async def set(self, chat_id: int, session: BotSession):
+        pass
+
+    @abc.abstractmethod
+    async def delete(self, chat_id: int):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self):
+        self._sessions = {}
+
+    async def get(self, chat_id: int) -> Optional[BotSession]:
+        entry = self._sessions.get(chat_id)
+        if entry is None:
+            return None
+        session, expires_at = entry
+        if expires_at <= time.time():
+            self._sessions.pop(chat_id, None)
+            return None
+        return session
+
+    async def set(self, chat_id: int, session: BotSession):
+        ttl = session_ttl(session.token)
+        if ttl <= 0:
+            await self.delete(chat_id)
+            return
+        now = time.time()
+        if len(self._sessions) >= settings.BOT_SESSION_LOCAL_MAX_ENTRIES:
+            self._sessions = {
+                key: entry for key, entry in self._sessions.items()
+                if entry[1] > now
+            }
+        self._sessions[chat_id] = (session, now + ttl)
+
+    async def delete(self, chat_id: int):
+        self._sessions.pop(chat_id, None)
+
+
+class RedisSessionStore(SessionStore):
+    KEY_PREFIX = "bot_session:"
+
+    def __init__(
+        self,
+        redis_url: str,
+        local_ttl: float,
+        local_max_entries: int
+    ):
+        self._redis = aioredis.from_url(redis_url, decode_responses=True)
+        metrics.track_redis_pool("bot_sessions", self._redis)
+        self._local_ttl = local_ttl
+        self._local_max_entries = local_max_entries
+        self._local = OrderedDict()
+
+    def _key(self, chat_id: int) -> str:
+        return f"{self.KEY_PREFIX}{chat_id}"
+
+    @classmethod
+    async def is_bound(cls, redis_client, chat_id, email: str) -> bool:
+        # Проверка на стороне API: бот выполнил вход этого пользователя
+        # в этом чате
+        raw = await redis_client.get(f"{cls.KEY_PREFIX}{chat_id}")
+        return raw is not None and json.loads(raw)["e"] == email
+
+    def _local_set(self, chat_id: int, session: BotSession):
+        if self._local_ttl <= 0:
+            return
+        self._local[chat_id] = (session, time.monotonic() + self._local_ttl)
+        self._local.move_to_end(chat_id)
+        while len(self._local) > self._local_max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, chat_id: int) -> Optional[BotSession]:
+        entry = self._local.get(chat_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self._local.move_to_end(chat_id)
+            return entry[0]
+
+        raw = await self._redis.get(self._key(chat_id))
+        if raw is None:
+            self._local.pop(chat_id, None)
+            return None
+        data = json.loads(raw)
+        session = BotSession(email=data["e"], token=data["t"])
+        self._local_set(chat_id, session)
+        return session
+
+    async def set(self, chat_id: int, session: BotSession):
+        ttl = session_ttl(session.token)
+        if ttl <= 0:
+            await self.delete(chat_id)
+            return
+        await self._redis.set(
+            self._key(chat_id),
+            json.dumps(
+                {"e": session.email, "t": session.token},
+                separators=(",", ":")
+            ),
+            ex=ttl
+        )
+        self._local_set(chat_id, session)
+
+    async def delete(self, chat_id: int):
+        await self._redis.delete(self._key(chat_id))
+        self._local.pop(chat_id, None)
+
+
+def create_session_store() -> SessionStore:
+    if settings.BOT_SESSION_BACKEND == "memory":
+        return MemorySessionStore()
+    return RedisSessionStore(
+        settings.REDIS_URL,
+        local_ttl=settings.BOT_SESSION_LOCAL_TTL,
+        local_max_entries=settings.BOT_SESSION_LOCAL_MAX_ENTRIES
+    )
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import timedelta
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+MAX_EDIT_ATTEMPTS = 3
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# Ответ дописывается правками сообщения не чаще одного раза в edit_interval
+# секунд, чтобы не упираться в лимиты Telegram на правки в одном чате
+class StreamingReply:
+    def __init__(self, message: Message, edit_interval: float):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.text = ""
+        self._sent_text = message.text or ""
+        self._next_edit_at = 0.0
+
+    @classmethod
+    async def start(
+        cls, message: Message, placeholder: str, edit_interval: float
+    ):
+        sent = await message.reply_text(placeholder)
+        return cls(sent, edit_interval)
+
+    async def append(self, delta: str):
+        self.text += delta
+        if len(self.text) > TELEGRAM_MESSAGE_LIMIT:
+            head = self.text[:TELEGRAM_MESSAGE_LIMIT]
+            self.text = self.text[TELEGRAM_MESSAGE_LIMIT:]
+            await self._edit(head, force=True)
+            await self._wait_for_slot()
+            self.message = await self.message.chat.send_message(self.text)
+            self._sent_text = self.text
+            self._schedule_next_edit()
+        else:
+            await self._edit(self.text)
+
+    async def show_status(self, status: str):
+        # Статус виден только до первой части ответа
+        if not self.text:
+            await self._edit(status)
+
+    async def finish(self, footer: str = ""):
+        text = f"{self.text}{footer}" if self.text else footer.strip()
+        if len(text) > TELEGRAM_MESSAGE_LIMIT:
+            await self._edit(self.text, force=True)
+            await self._wait_for_slot()
+            await self.message.chat.send_message(footer.strip())
+        else:
+            await self._edit(text, force=True)
+
+    async def _wait_for_slot(self):
+        delay = self._next_edit_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _schedule_next_edit(self, delay: float = None):
+        self._next_edit_at = asyncio.get_running_loop().time() + (
+            self.edit_interval if delay is None else delay
+        )
+
+    async def _edit(self, text: str, force: bool = False):
+        if not text or text == self._sent_text:
+            return
+        if not force and (
+            asyncio.get_running_loop().time() < self._next_edit_at
+        ):
+            return
+
+        for _ in range(MAX_EDIT_ATTEMPTS):
+            if force:
+                await self._wait_for_slot()
+            try:
+                await self.message.edit_text(text)
+                self._sent_text = text
+                self._schedule_next_edit()
+                return
+            except RetryAfter as e:
+                self._schedule_next_edit(retry_after_seconds(e))
+                if not force:
+                    return
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                self._sent_text = text
+                return
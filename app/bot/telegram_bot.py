@@ -1,15 +1,20 @@
+import asyncio
+import json
 import logging
+from typing import Any, Callable, NamedTuple
 import aiohttp
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler
 from telegram.ext import ConversationHandler, CallbackContext, filters
+from telegram.ext import Application
+from app.bot.sessions import BotSession, create_session_store
+from app.bot.streaming import StreamingReply
+from app.bot.updates import ChatOrderedUpdateProcessor
+from app.core import logs, metrics, tracing
 from app.core.status_codes import StatusMessages
 from app.core.config import settings
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levellevel)s - %(message)s',
-    level=logging.INFO
-)
+logs.setup()
 logger = logging.getLogger(__name__)
 telegram_token = settings.TELEGRAM_TOKEN
 api_url = settings.API_URL
@@ -21,7 +26,44 @@ if not api_url:
     raise ValueError("API_URL должен быть предоставлен")
 
 LOGIN_EMAIL, LOGIN_PASSWORD = range(2)
-user_sessions = {}
+session_store = create_session_store()
+
+
+def create_api_session() -> aiohttp.ClientSession:
+    if settings.BOT_API_UNIX_SOCKET:
+        connector = aiohttp.UnixConnector(
+            path=settings.BOT_API_UNIX_SOCKET,
+            limit=settings.BOT_API_CONNECTOR_LIMIT,
+            keepalive_timeout=settings.BOT_API_KEEPALIVE_TIMEOUT
+        )
+    else:
+        connector = aiohttp.TCPConnector(
+            limit=settings.BOT_API_CONNECTOR_LIMIT,
+            use_dns_cache=True,
+            ttl_dns_cache=settings.BOT_API_DNS_CACHE_TTL,
+            keepalive_timeout=settings.BOT_API_KEEPALIVE_TIMEOUT
+        )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=10),
+        trace_configs=[
+            metrics.api_trace_config(), *tracing.api_trace_configs()
+        ]
+    )
+
+
+def get_api_session(context: CallbackContext) -> aiohttp.ClientSession:
+    return context.bot_data["api_session"]
+
+
+async def open_api_session(application: Application) -> None:
+    application.bot_data["api_session"] = create_api_session()
+
+
+async def close_api_session(application: Application) -> None:
+    session = application.bot_data.pop("api_session", None)
+    if session is not None:
+        await session.close()
 
 
 async def handle_auth_token(update: Update, context: CallbackContext) -> None:
@@ -33,42 +75,46 @@ async def handle_auth_token(update: Update, context: CallbackContext) -> None:
         )
         return
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{api_url}/verify_token",
-                json={"token": auth_token}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    user_sessions[update.message.chat_id] = {
-                        "token": data["access_token"],
-                        "email": data["email"],
-                        "message_count": 0
-                    }
-                    await update.message.reply_text(
-                        "Вы успешно авторизованы. "
-                        "Теперь вы можете задавать вопросы."
-                    )
-                else:
-                    await update.message.reply_text(
-                        "Неверный или устаревший токен. "
-                        "Пожалуйста, войдите через сайт."
-                    )
-        except Exception as e:
-            await handle_api_error(update, str(e))
+    session = get_api_session(context)
+    try:
+        async with session.post(
+            f"{api_url}/verify_token",
+            json={"token": auth_token}
+        ) as response:
+            if response.status == 200:
+                data = await response.json()
+                await session_store.set(
+                    update.message.chat_id,
+                    BotSession(email=data["email"], token=data["access_token"])
+                )
+                await update.message.reply_text(
+                    "Вы успешно авторизованы. "
+                    "Теперь вы можете задавать вопросы."
+                )
+            else:
+                await update.message.reply_text(
+                    "Неверный или устаревший токен. "
+                    "Пожалуйста, войдите через сайт."
+                )
+    except Exception as e:
+        await handle_api_error(update, str(e))
 
 
 async def start(update: Update, context: CallbackContext) -> None:
     if context.args:
         await handle_auth_token(update, context)
     else:
-        await update.message.reply_text(
-            "Привет! Я бот для ответов на ваши вопросы. "
-            "Используйте команду /login для входа, "
-            "/logout для выхода из системы "
-            "и /tokenbalance для проверки остатка токенов."
-        )
+        await send_greeting(update)
+
+
+async def send_greeting(update: Update) -> None:
+    await update.message.reply_text(
+        "Привет! Я бот для ответов на ваши вопросы. "
+        "Используйте команду /login для входа, "
+        "/logout для выхода из системы, "
+        "/reset для начала нового диалога "
+        "и /tokenbalance для проверки остатка токенов."
+    )
 
 
 async def handle_api_error(update: Update, error_message: str):
@@ -85,21 +131,26 @@ async def login(update: Update, context: CallbackContext) -> int:
 
 async def logout(update: Update, context: CallbackContext) -> None:
     chat_id = update.message.chat_id
-    if chat_id in user_sessions:
-        user_sessions.pop(chat_id, None)
+    if await session_store.get(chat_id) is not None:
+        await session_store.delete(chat_id)
         await update.message.reply_text("Вы успешно вышли из системы.")
     else:
         await update.message.reply_text("Вы не были авторизованы.")
 
 
 async def get_login_email(update: Update, context: CallbackContext) -> int:
-    user_sessions[update.message.chat_id] = {"email": update.message.text}
+    context.chat_data["login_email"] = update.message.text
     await update.message.reply_text("Теперь введите ваш пароль:")
     return LOGIN_PASSWORD
 
 
 async def get_login_password(update: Update, context: CallbackContext) -> int:
-    user_data = user_sessions[update.message.chat_id]
+    email = context.chat_data.get("login_email")
+    if email is None:
+        await update.message.reply_text(
+            "Пожалуйста, начните вход заново командой /login."
+        )
+        return ConversationHandler.END
     password = update.message.text
 
     if len(password) < 6:
@@ -108,38 +159,40 @@ async def get_login_password(update: Update, context: CallbackContext) -> int:
         )
         return LOGIN_PASSWORD
 
-    user_data["password"] = password
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{api_url}/token",
-                data={
-                    "username": user_data["email"],
-                    "password": user_data["password"],
-                },
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    user_sessions[update.message.chat_id]["token"] = (
-                        data["access_token"]
-                    )
-                    user_sessions[update.message.chat_id]["message_count"] = 0
-                    await update.message.reply_text(
-                        "Успешный вход. Теперь вы можете задавать вопросы."
-                    )
-                else:
-                    error_data = await response.json()
-                    await handle_api_error(
-                        update, error_data.get("detail", "Неизвестная ошибка")
-                    )
-        except Exception as e:
-            await handle_api_error(update, str(e))
+    # Пароль сразу уходит в API и нигде не сохраняется
+    context.chat_data.pop("login_email", None)
+    session = get_api_session(context)
+    try:
+        async with session.post(
+            f"{api_url}/token",
+            data={
+                "username": email,
+                "password": password,
+            },
+        ) as response:
+            if response.status == 200:
+                data = await response.json()
+                await session_store.set(
+                    update.message.chat_id,
+                    BotSession(email=email, token=data["access_token"])
+                )
+                await update.message.reply_text(
+                    "Успешный вход. Теперь вы можете задавать вопросы."
+                )
+            else:
+                error_data = await response.json()
+                await handle_api_error(
+                    update, error_data.get("detail", "Неизвестная ошибка")
+                )
+    except Exception as e:
+        await handle_api_error(update, str(e))
     return ConversationHandler.END
 
 
 async def answer_question(update: Update, context: CallbackContext) -> None:
     chat_id = update.message.chat_id
-    if chat_id not in user_sessions or "token" not in user_sessions[chat_id]:
+    user_session = await session_store.get(chat_id)
+    if user_session is None:
         await update.message.reply_text(StatusMessages.LOGIN_REQUIRED)
         return
 
@@ -150,125 +203,253 @@ async def answer_question(update: Update, context: CallbackContext) -> None:
         )
         return
 
-    logger.info(f"Получен вопрос от chat_id {chat_id}: {question_text}")
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            headers = {
-                "Authorization": f"Bearer {user_sessions[chat_id]['token']}"
+    logger.info("Получен вопрос", extra={
+        "chat_id": chat_id,
+        "question_chars": len(question_text),
+    })
+
+    session = get_api_session(context)
+    try:
+        headers = {
+            "Authorization": f"Bearer {user_session.token}"
+        }
+        if settings.BOT_ASK_JOBS:
+            # Ответ отправит воркер API, когда задание будет выполнено
+            url = f"{api_url}/jobs"
+            payload = {
+                "user_id": str(chat_id),
+                "question": question_text,
+                "push": True
             }
-            logger.info(
-                "Отправка запроса на /ask с данными: "
-                "{'user_id': str(chat_id), 'question': question_text}"
-            )
-            async with session.post(
-                f"{api_url}/ask",
-                headers=headers,
-                json={"user_id": str(chat_id), "question": question_text},
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    reply_message = (
-                        f"{data.get('response')}\n\n"
-                        f"Использовано токенов: {data.get('tokens_used')}\n"
-                        f"Остаток токенов: {data.get('tokens_remaining')}"
-                    )
-                    await update.message.reply_text(reply_message)
-                elif response.status == 400:
-                    error_data = await response.json()
-                    await update.message.reply_text(error_data.get("detail", "Недостаточно токенов."))
-                elif response.status == 401:
-                    await update.message.reply_text(StatusMessages.SESSION_EXPIRED)
-                    user_sessions.pop(chat_id, None)
-                elif response.status == 422:
-                    error_data = await response.json()
-                    logger.error(f"Ошибка валидации: {error_data}")
-                    await update.message.reply_text(StatusMessages.VALIDATION_ERROR)
-                elif response.status == 451:
-                    error_message = StatusMessages.get_message_limit_text(daily_message_limit)
-                    await update.message.reply_text(error_message)
-                elif response.status == 403:
-                    await update.message.reply_text(StatusMessages.FORBIDDEN)
-                elif response.status == 500:
-                    await update.message.reply_text(StatusMessages.SERVER_ERROR)
-                else:
-                    await update.message.reply_text(
-                        StatusMessages.UNEXPECTED_ERROR.format(status=response.status)
-                    )
-
-        except aiohttp.ClientResponseError as e:
-            logger.error(f"Ошибка запроса API: {e.status} - {e.message}")
-            await update.message.reply_text(f"Ошибка запроса API: {e.message}")
-
-        except aiohttp.ClientConnectionError as e:
-            logger.error(f"Ошибка соединения: {str(e)}")
-            await update.message.reply_text(
-                "Ошибка соединения с сервером. Пожалуйста, попробуйте позже."
+        else:
+            url = f"{api_url}/ask"
+            payload = {
+                "user_id": str(chat_id),
+                "question": question_text,
+                "stream": True
+            }
+        async with session.post(
+            url,
+            headers=headers,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=10,
+                sock_read=settings.BOT_STREAM_READ_TIMEOUT
             )
+        ) as response:
+            if response.status == 200:
+                await stream_reply(update, response)
+            elif response.status == 202:
+                await update.message.reply_text(StatusMessages.JOB_ACCEPTED)
+            elif response.status == 400:
+                error_data = await response.json()
+                await update.message.reply_text(error_data.get("detail", "Недостаточно токенов."))
+            elif response.status == 401:
+                await update.message.reply_text(StatusMessages.SESSION_EXPIRED)
+                await session_store.delete(chat_id)
+            elif response.status == 422:
+                error_data = await response.json()
+                logger.error(f"Ошибка валидации: {error_data}")
+                await update.message.reply_text(StatusMessages.VALIDATION_ERROR)
+            elif response.status == 451:
+                error_message = StatusMessages.get_message_limit_text(daily_message_limit)
+                await update.message.reply_text(error_message)
+            elif response.status == 403:
+                await update.message.reply_text(StatusMessages.FORBIDDEN)
+            elif response.status == 429:
+                # Очередь вопросов этого пользователя переполнена
+                await update.message.reply_text(
+                    StatusMessages.TOO_MANY_REQUESTS
+                )
+            elif response.status == 503:
+                # Открыт предохранитель OpenAI или истекло ожидание в очереди
+                await update.message.reply_text(
+                    StatusMessages.SERVICE_UNAVAILABLE
+                )
+            elif response.status == 500:
+                await update.message.reply_text(StatusMessages.SERVER_ERROR)
+            else:
+                await update.message.reply_text(
+                    StatusMessages.UNEXPECTED_ERROR.format(status=response.status)
+                )
+
+    except aiohttp.ClientResponseError as e:
+        logger.error(f"Ошибка запроса API: {e.status} - {e.message}")
+        await update.message.reply_text(f"Ошибка запроса API: {e.message}")
+
+    except aiohttp.ClientConnectionError as e:
+        logger.error(f"Ошибка соединения: {str(e)}")
+        await update.message.reply_text(
+            "Ошибка соединения с сервером. Пожалуйста, попробуйте позже."
+        )
+
+    except asyncio.TimeoutError as e:
+        logger.error(f"Ошибка таймаута: {str(e)}")
+        await update.message.reply_text("Таймаут ответа сервера.")
+
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
+
+
+async def stream_reply(update: Update, response: aiohttp.ClientResponse):
+    async def read_events():
+        async for line in response.content:
+            if line.strip():
+                yield json.loads(line)
+
+    await reply_with_events(update, read_events())
 
-        except aiohttp.ClientTimeout as e:
-            logger.error(f"Ошибка таймаута: {str(e)}")
-            await update.message.reply_text("Таймаут ответа сервера.")
 
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка: {str(e)}")
-            await update.message.reply_text(
-                "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+async def reply_with_events(update: Update, events) -> None:
+    reply = await StreamingReply.start(
+        update.message, "…", settings.BOT_STREAM_EDIT_INTERVAL
+    )
+    async for event in events:
+        if "delta" in event:
+            await reply.append(event["delta"])
+        elif "queue_position" in event:
+            await reply.show_status(StatusMessages.QUEUE_POSITION.format(
+                position=event["queue_position"]
+            ))
+        elif "error" in event:
+            await reply.finish(f"\n\n{event['error']}")
+            return
+        elif event.get("done"):
+            await reply.finish(
+                f"\n\nИспользовано токенов: {event.get('tokens_used')}\n"
+                f"Остаток токенов: {event.get('tokens_remaining')}"
             )
+            return
+    await reply.finish()
 
 
 async def get_token_balance(update: Update, context: CallbackContext) -> None:
     chat_id = update.message.chat_id
-    if chat_id not in user_sessions or "token" not in user_sessions[chat_id]:
+    user_session = await session_store.get(chat_id)
+    if user_session is None:
         await update.message.reply_text(StatusMessages.LOGIN_REQUIRED)
         return
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            headers = {
-                "Authorization": f"Bearer {user_sessions[chat_id]['token']}"
-            }
-            async with session.get(
-                f"{api_url}/tokenbalance",
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    tokens_remaining = data.get("tokens_remaining")
-                    await update.message.reply_text(f"Остаток токенов: {tokens_remaining}")
-                elif response.status == 401:
-                    await update.message.reply_text(StatusMessages.SESSION_EXPIRED)
-                    user_sessions.pop(chat_id, None)
-                else:
-                    await update.message.reply_text(
-                        f"Неожиданная ошибка: HTTP {response.status}"
-                    )
-
-        except aiohttp.ClientResponseError as e:
-            logger.error(f"Ошибка запроса API: {e.status} - {e.message}")
-            await update.message.reply_text(f"Ошибка запроса API: {e.message}")
-
-        except aiohttp.ClientConnectionError as e:
-            logger.error(f"Ошибка соединения: {str(e)}")
-            await update.message.reply_text(
-                "Ошибка соединения с сервером. Пожалуйста, попробуйте позже."
-            )
+    session = get_api_session(context)
+    try:
+        headers = {
+            "Authorization": f"Bearer {user_session.token}"
+        }
+        async with session.get(
+            f"{api_url}/tokenbalance",
+            headers=headers
+        ) as response:
+            if response.status == 200:
+                data = await response.json()
+                tokens_remaining = data.get("tokens_remaining")
+                await update.message.reply_text(f"Остаток токенов: {tokens_remaining}")
+            elif response.status == 401:
+                await update.message.reply_text(StatusMessages.SESSION_EXPIRED)
+                await session_store.delete(chat_id)
+            else:
+                await update.message.reply_text(
+                    f"Неожиданная ошибка: HTTP {response.status}"
+                )
 
-        except aiohttp.ClientTimeout as e:
-            logger.error(f"Ошибка таймаута: {str(e)}")
-            await update.message.reply_text("Таймаут ответа сервера.")
+    except aiohttp.ClientResponseError as e:
+        logger.error(f"Ошибка запроса API: {e.status} - {e.message}")
+        await update.message.reply_text(f"Ошибка запроса API: {e.message}")
 
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка: {str(e)}")
-            await update.message.reply_text(
-                "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
-            )
+    except aiohttp.ClientConnectionError as e:
+        logger.error(f"Ошибка соединения: {str(e)}")
+        await update.message.reply_text(
+            "Ошибка соединения с сервером. Пожалуйста, попробуйте позже."
+        )
 
+    except asyncio.TimeoutError as e:
+        logger.error(f"Ошибка таймаута: {str(e)}")
+        await update.message.reply_text("Таймаут ответа сервера.")
+
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
 
-def main() -> None:
-    application = ApplicationBuilder().token(telegram_token).build()
+
+async def reset_conversation(
+    update: Update,
+    context: CallbackContext
+) -> None:
+    chat_id = update.message.chat_id
+    user_session = await session_store.get(chat_id)
+    if user_session is None:
+        await update.message.reply_text(StatusMessages.LOGIN_REQUIRED)
+        return
+
+    session = get_api_session(context)
+    try:
+        headers = {
+            "Authorization": f"Bearer {user_session.token}"
+        }
+        async with session.post(
+            f"{api_url}/reset",
+            headers=headers,
+            json={"user_id": str(chat_id)}
+        ) as response:
+            if response.status == 200:
+                await update.message.reply_text(
+                    StatusMessages.CONVERSATION_RESET
+                )
+            elif response.status == 401:
+                await update.message.reply_text(StatusMessages.SESSION_EXPIRED)
+                await session_store.delete(chat_id)
+            else:
+                await update.message.reply_text(
+                    f"Неожиданная ошибка: HTTP {response.status}"
+                )
+
+    except aiohttp.ClientConnectionError as e:
+        logger.error(f"Ошибка соединения: {str(e)}")
+        await update.message.reply_text(
+            "Ошибка соединения с сервером. Пожалуйста, попробуйте позже."
+        )
+
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка: {str(e)}")
+        await update.message.reply_text(
+            "Произошла неожиданная ошибка. Пожалуйста, попробуйте позже."
+        )
+
+
+class BotHandlers(NamedTuple):
+    start: Callable[..., Any]
+    get_login_password: Callable[..., Any]
+    answer_question: Callable[..., Any]
+    get_token_balance: Callable[..., Any]
+    reset_conversation: Callable[..., Any]
+
+
+API_HANDLERS = BotHandlers(
+    start=start,
+    get_login_password=get_login_password,
+    answer_question=answer_question,
+    get_token_balance=get_token_balance,
+    reset_conversation=reset_conversation
+)
+
+
+def build_application(handlers: BotHandlers = API_HANDLERS) -> Application:
+    application = (
+        ApplicationBuilder()
+        .token(telegram_token)
+        .base_url(settings.BOT_TELEGRAM_API_URL)
+        .concurrent_updates(
+            ChatOrderedUpdateProcessor(settings.BOT_CONCURRENT_UPDATES)
+        )
+        .post_init(open_api_session)
+        .post_shutdown(close_api_session)
+        .build()
+    )
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("login", login)],
@@ -282,22 +463,51 @@ def main() -> None:
             LOGIN_PASSWORD: [
                 MessageHandler(
                     filters.TEXT & ~filters.COMMAND,
-                    get_login_password
+                    handlers.get_login_password
                 )
             ],
         },
-        fallbacks=[CommandHandler("start", start)],
+        fallbacks=[CommandHandler("start", handlers.start)],
     )
 
     application.add_handler(conv_handler)
-    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("start", handlers.start))
     application.add_handler(CommandHandler("logout", logout))
-    application.add_handler(CommandHandler("tokenbalance", get_token_balance))
     application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, answer_question)
+        CommandHandler("tokenbalance", handlers.get_token_balance)
     )
+    application.add_handler(
+        CommandHandler("reset", handlers.reset_conversation)
+    )
+    application.add_handler(
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND, handlers.answer_question
+        )
+    )
+    return application
 
-    application.run_polling()
+
+def main() -> None:
+    if settings.BOT_MODE == "embedded":
+        raise ValueError(
+            "В режиме embedded бот запускается вместе с API (app.main)"
+        )
+    tracing.setup("telegram-bot")
+    if settings.BOT_METRICS_PORT:
+        # Во встроенном режиме метрики бота отдает /metrics API
+        from prometheus_client import start_http_server
+        start_http_server(settings.BOT_METRICS_PORT)
+    if settings.BOT_MODE == "webhook":
+        import uvicorn
+        uvicorn.run(
+            "app.bot.webhook:app",
+            host=settings.BOT_WEBHOOK_HOST,
+            port=settings.BOT_WEBHOOK_PORT,
+            # Логи uvicorn идут через общую очередь app.core.logs
+            log_config=None
+        )
+    else:
+        build_application().run_polling()
 
 
 if __name__ == '__main__':
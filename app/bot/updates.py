@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from app.core import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Обновления разных чатов обрабатываются параллельно, а обновления
+    # одного чата - строго по очереди. Очередь чата разбирает одна задача,
+    # поэтому активный чат занимает не больше одного слота из
+    # max_concurrent_updates, и долгий ответ в одном чате не задерживает
+    # остальные
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_queues: Dict[int, Deque[Awaitable[Any]]] = {}
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(
+        self,
+        update: object,
+        coroutine: Awaitable[Any]
+    ) -> None:
+        coroutine = tracing.trace_update(
+            update,
+            metrics.update_kind(update),
+            metrics.observe_update(update, coroutine)
+        )
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await coroutine
+            return
+
+        queue = self._chat_queues.get(chat_id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+
+        queue = self._chat_queues[chat_id] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue[0]
+                except Exception as e:
+                    logger.error(
+                        f"Ошибка обработки обновления чата {chat_id}: {str(e)}"
+                    )
+                queue.popleft()
+        finally:
+            del self._chat_queues[chat_id]
+            for pending in queue:
+                if asyncio.iscoroutine(pending):
+                    pending.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
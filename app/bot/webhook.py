@@ -0,0 +1,60 @@
+import logging
+import secrets
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from telegram import Update
+
+from app.bot.telegram_bot import (
+    build_application, close_api_session, open_api_session
+)
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+if not settings.BOT_WEBHOOK_SECRET:
+    raise ValueError("BOT_WEBHOOK_SECRET должен быть предоставлен")
+
+application = build_application()
+app = FastAPI()
+
+
+@app.on_event("startup")
+async def startup_event():
+    await application.initialize()
+    await open_api_session(application)
+    await application.start()
+    if settings.BOT_WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=settings.BOT_WEBHOOK_URL,
+            secret_token=settings.BOT_WEBHOOK_SECRET,
+            max_connections=settings.BOT_WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    logger.info("Бот принимает обновления через webhook.")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await application.stop()
+    await close_api_session(application)
+    await application.shutdown()
+
+
+@app.post(settings.BOT_WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    secret_token = request.headers.get(SECRET_TOKEN_HEADER, "")
+    if not secrets.compare_digest(
+        secret_token.encode(), settings.BOT_WEBHOOK_SECRET.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Неверный секретный токен")
+
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректное обновление")
+
+    # Обработка идет в фоне, Telegram получает ответ сразу
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return Response(status_code=200)
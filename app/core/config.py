@@ -11,6 +11,132 @@ class Settings(BaseSettings):
     REDIS_URL: str
     TELEGRAM_BOT_URL: str
 
+    DATABASE_READ_URLS: str = ""
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_READ_POOL_SIZE: int = 5
+    DB_READ_MAX_OVERFLOW: int = 10
+    DB_READ_POOL_PRE_PING: bool = True
+    DB_READ_STATEMENT_CACHE_SIZE: int = 100
+    DB_READ_STICKY_SECONDS: int = 10
+
+    OPENAI_MODEL: str = "gpt-3.5-turbo"
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 30.0
+    OPENAI_HTTP2: bool = True
+    OPENAI_MAX_CONCURRENCY: int = 50
+    OPENAI_AIMD_ENABLED: bool = True
+    OPENAI_AIMD_MIN_LIMIT: int = 1
+    OPENAI_AIMD_DECREASE: float = 0.5
+    OPENAI_AIMD_DECREASE_INTERVAL: float = 1.0
+    SCHEDULER_DEFAULT_WEIGHT: float = 1.0
+    SCHEDULER_USER_WEIGHTS: str = ""
+    SCHEDULER_MAX_QUEUED_PER_USER: int = 3
+    SCHEDULER_MAX_QUEUE_TIME: float = 30.0
+    SCHEDULER_POSITION_INTERVAL: float = 1.0
+    SCHEDULER_MAX_TRACKED_USERS: int = 10000
+    OPENAI_TIMEOUT: float = 60.0
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_BACKENDS: str = ""
+    OPENAI_MAX_ATTEMPTS: int = 3
+    OPENAI_BREAKER_FAILURES: int = 5
+    OPENAI_BREAKER_RESET_TIMEOUT: float = 30.0
+    OPENAI_RETRY_BASE_DELAY: float = 0.5
+    OPENAI_RETRY_MAX_DELAY: float = 10.0
+    OPENAI_HEDGE_ENABLED: bool = False
+    OPENAI_HEDGE_PERCENTILE: float = 0.95
+    OPENAI_HEDGE_INITIAL_DELAY: float = 3.0
+    OPENAI_HEDGE_MIN_DELAY: float = 0.2
+    OPENAI_LATENCY_WINDOW: int = 200
+    METRICS_ENABLED: bool = True
+    BOT_METRICS_PORT: int = 0
+    TRACING_ENABLED: bool = False
+    TRACING_EXPORTER: str = "file"
+    TRACING_FILE_PATH: str = "traces-{service}.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_SAMPLE_RATIO: float = 0.1
+    TRACING_SLOW_THRESHOLD: float = 2.0
+    TRACING_TAIL_MAX_TRACES: int = 10000
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_LEVELS: str = "httpx=WARNING"
+    LOG_SAMPLING: str = ""
+    LOG_REDACT_FIELDS: str = "question,text,password,token,access_token,email"
+    LOG_QUEUE_SIZE: int = 10000
+
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_TTL: int = 300
+    USER_CACHE_MAX_BALANCE_STALENESS: float = 5.0
+    USER_CACHE_LOCAL_MAX_ENTRIES: int = 10000
+
+    RATE_LIMIT_POLICY: str = "fixed_day"
+    RATE_LIMIT_WINDOW: int = 86400
+    RATE_LIMIT_BURST_PER_MINUTE: int = 5
+
+    TOKEN_ANSWER_RESERVE: int = 300
+    TOKENIZER_VOCAB_PATH: str = ""
+    TOKENIZER_ENCODING: str = "cl100k_base"
+    TOKENIZER_CACHE_SIZE: int = 4096
+    TOKEN_LEDGER_ENABLED: bool = False
+    TOKEN_LEDGER_FLUSH_INTERVAL: float = 1.0
+    TOKEN_LEDGER_FLUSH_BATCH: int = 500
+    TOKEN_LEDGER_CLAIM_IDLE_MS: int = 60000
+    TOKEN_LEDGER_BALANCE_TTL: int = 86400
+
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_TTL: int = 86400
+    ANSWER_CACHE_MAX_ENTRIES: int = 10000
+    ANSWER_CACHE_BILLING: str = "full"
+    ANSWER_CACHE_LOCK_TIMEOUT: int = 30
+    SIMILAR_CACHE_ENABLED: bool = False
+    SIMILAR_CACHE_THRESHOLD: float = 0.8
+    SIMILAR_CACHE_MAX_ENTRIES: int = 10000
+    SIMILAR_CACHE_NUM_PERM: int = 64
+    SIMILAR_CACHE_BANDS: int = 16
+    SIMILAR_CACHE_COMPACT_INTERVAL: float = 300
+
+    CONVERSATION_ENABLED: bool = False
+    CONVERSATION_CONTEXT_TOKENS: int = 2000
+    CONVERSATION_MAX_MESSAGES: int = 50
+    CONVERSATION_MESSAGE_OVERHEAD: int = 4
+    CONVERSATION_TTL: int = 86400
+
+    ASK_JOBS_ENABLED: bool = False
+    ASK_JOB_WORKERS: int = 8
+    ASK_JOB_TTL: int = 3600
+    ASK_JOB_MAX_WAIT: float = 30.0
+    ASK_JOB_POLL_INTERVAL: float = 0.25
+    ASK_JOB_CLAIM_IDLE_MS: int = 300000
+
+    BOT_STREAM_EDIT_INTERVAL: float = 1.0
+    BOT_STREAM_READ_TIMEOUT: float = 60.0
+    BOT_API_CONNECTOR_LIMIT: int = 100
+    BOT_API_DNS_CACHE_TTL: int = 300
+    BOT_API_KEEPALIVE_TIMEOUT: float = 30.0
+    BOT_API_UNIX_SOCKET: str = ""
+    BOT_TELEGRAM_API_URL: str = "https://api.telegram.org/bot"
+    BOT_CONCURRENT_UPDATES: int = 32
+    BOT_ASK_JOBS: bool = False
+    BOT_SESSION_BACKEND: str = "redis"
+    BOT_SESSION_TTL: int = 7200
+    BOT_SESSION_LOCAL_TTL: float = 5.0
+    BOT_SESSION_LOCAL_MAX_ENTRIES: int = 10000
+    BOT_MODE: str = "polling"
+    BOT_WEBHOOK_URL: str = ""
+    BOT_WEBHOOK_PATH: str = "/telegram/webhook"
+    BOT_WEBHOOK_SECRET: str = ""
+    BOT_WEBHOOK_HOST: str = "0.0.0.0"
+    BOT_WEBHOOK_PORT: int = 8443
+    BOT_WEBHOOK_MAX_CONNECTIONS: int = 40
+
     class Config:
         env_file = "../.env"
 
@@ -0,0 +1,234 @@
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import random
+import re
+import signal
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+from app.core import tracing
+from app.core.config import settings
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+SQL_LOGGER = "sqlalchemy.engine"
+# Логгеры uvicorn пишут в свои обработчики; их записи тоже идут в очередь
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Стандартные поля LogRecord; остальное - поля из extra
+RECORD_FIELDS = set(vars(
+    logging.LogRecord("", 0, "", 0, "", None, None)
+)) | {"message", "asctime", "taskName"}
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+SECRET_PATTERNS = (
+    re.compile(r"(?i)\bbearer\s+\S+"),
+    re.compile(r"\beyJ[\w-]+\.[\w-]+\.[\w-]+"),
+    # Токен бота, в том числе внутри адресов Bot API
+    re.compile(r"(?<!\d)\d{6,}:[\w-]{30,}"),
+)
+
+_listener: Optional[QueueListener] = None
+_handler: Optional["NonBlockingQueueHandler"] = None
+
+
+def parse_pairs(value: str) -> Dict[str, str]:
+    pairs = {}
+    for item in value.split(","):
+        name, _, setting = item.strip().partition("=")
+        if name and setting:
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+def mask_email(match) -> str:
+    digest = hashlib.sha256(match.group(0).lower().encode()).hexdigest()
+    # Один и тот же адрес дает одну метку, записи можно сопоставить
+    return f"<email:{digest[:10]}>"
+
+
+def redact(text: str) -> str:
+    text = EMAIL_PATTERN.sub(mask_email, text)
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub("<secret>", text)
+    return text
+
+
+class Redactor:
+    def __init__(self, fields: str):
+        self.fields = {
+            field.strip() for field in fields.split(",") if field.strip()
+        }
+
+    def extras(self, record: logging.LogRecord) -> dict:
+        extras = {}
+        for key, value in vars(record).items():
+            if key in RECORD_FIELDS or key.startswith("_"):
+                continue
+            if key in self.fields:
+                value = f"<redacted {len(str(value))} chars>"
+            elif isinstance(value, str):
+                value = redact(value)
+            extras[key] = value
+        return extras
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redactor: Redactor):
+        super().__init__()
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+            **self.redactor.extras(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redactor: Redactor):
+        super().__init__(TEXT_FORMAT)
+        self.redactor = redactor
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = redact(record.message)
+        extras = " ".join(
+            f"{key}={value}"
+            for key, value in self.redactor.extras(record).items()
+        )
+        text = super().formatMessage(record)
+        return f"{text} {extras}" if extras else text
+
+    def formatException(self, exc_info) -> str:
+        return redact(super().formatException(exc_info))
+
+
+class SamplingFilter(logging.Filter):
+    # Записи ниже WARNING пропускаются с долей из LOG_SAMPLING по самому
+    # длинному совпавшему префиксу имени логгера
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            prefixes = [
+                prefix for prefix in self.rates
+                if name == prefix or name.startswith(prefix + ".")
+            ]
+            rate = self.rates[max(prefixes, key=len)] if prefixes else 1.0
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # В потоке цикла событий остается только подстановка аргументов;
+    # форматирование, редактирование и запись идут в потоке QueueListener.
+    # При переполнении очереди запись отбрасывается, а не ждет
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        record.__dict__.update(tracing.log_context())
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def create_pipeline(
+    stream=None,
+    log_format: str = "json",
+    sampling: str = "",
+    redact_fields: str = "",
+    queue_size: int = 10000
+) -> Tuple[NonBlockingQueueHandler, QueueListener]:
+    redactor = Redactor(redact_fields)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(
+        JsonFormatter(redactor) if log_format == "json"
+        else TextFormatter(redactor)
+    )
+    handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    rates = {
+        name: float(rate) for name, rate in parse_pairs(sampling).items()
+    }
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+    return handler, QueueListener(handler.queue, output)
+
+
+def set_sql_echo(enabled: bool):
+    # Движки создаются без echo, и SQLAlchemy проверяет уровень логгера
+    # при каждом новом соединении, поэтому echo включается без перезапуска
+    logging.getLogger(SQL_LOGGER).setLevel(
+        logging.INFO if enabled else logging.WARNING
+    )
+
+
+def toggle_sql_echo(signum=None, frame=None):
+    enabled = logging.getLogger(SQL_LOGGER).isEnabledFor(logging.INFO)
+    set_sql_echo(not enabled)
+
+
+def setup():
+    global _listener, _handler
+    if _listener is not None:
+        return
+    _handler, _listener = create_pipeline(
+        log_format=settings.LOG_FORMAT,
+        sampling=settings.LOG_SAMPLING,
+        redact_fields=settings.LOG_REDACT_FIELDS,
+        queue_size=settings.LOG_QUEUE_SIZE
+    )
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name in UVICORN_LOGGERS:
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    for name, level in parse_pairs(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+    set_sql_echo(settings.DB_ECHO)
+    if (
+        hasattr(signal, "SIGUSR1")
+        and threading.current_thread() is threading.main_thread()
+    ):
+        # kill -USR1 <pid> включает и выключает вывод SQL-запросов
+        signal.signal(signal.SIGUSR1, toggle_sql_echo)
+    _listener.start()
+    # Остаток очереди дописывается при завершении процесса
+    atexit.register(_listener.stop)
+
+
+def stats() -> dict:
+    if _handler is None:
+        return {}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
@@ -0,0 +1,268 @@
+import re
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+import aiohttp
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from app.core import tracing
+
+# Границы гистограмм в секундах: от обращений к Redis до ответов OpenAI
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+ASK_STAGE_SECONDS = Histogram(
+    "ask_stage_duration_seconds",
+    "Длительность этапов обработки вопроса",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Запросы к API по маршрутам и кодам ответа",
+    ["method", "route", "status"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки запроса к API вместе с передачей тела ответа",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Запросы к API, обрабатываемые сейчас"
+)
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Токены из блока usage ответов OpenAI",
+    ["type"]
+)
+OPENAI_REQUESTS = Counter(
+    "openai_requests_total",
+    "Попытки запросов к бэкендам OpenAI по исходу",
+    ["backend", "outcome"]
+)
+OPENAI_REQUEST_SECONDS = Histogram(
+    "openai_request_duration_seconds",
+    "Время успешной попытки запроса к бэкенду OpenAI "
+    "(для потока - до первой части ответа)",
+    ["backend", "kind"], buckets=LATENCY_BUCKETS
+)
+ANSWER_CACHE_EVENTS = Counter(
+    "answer_cache_events_total",
+    "События кэша ответов: hits, misses, similar_hits, coalesced, "
+    "evictions, bypass",
+    ["event"]
+)
+USER_CACHE_LOOKUPS = Counter(
+    "user_cache_lookups_total",
+    "Поиск снимка пользователя в кэше: local, redis или miss",
+    ["result"]
+)
+RATE_LIMIT_CHECKS = Counter(
+    "rate_limit_checks_total",
+    "Проверки дневного лимита вопросов",
+    ["result"]
+)
+BOT_UPDATE_LAG_SECONDS = Histogram(
+    "bot_update_lag_seconds",
+    "Время от отправки сообщения в Telegram до начала его обработки",
+    buckets=LATENCY_BUCKETS
+)
+BOT_HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds",
+    "Время обработки обновления ботом",
+    ["kind"], buckets=LATENCY_BUCKETS
+)
+BOT_API_REQUEST_SECONDS = Histogram(
+    "bot_api_request_duration_seconds",
+    "Время запроса бота к API до получения заголовков ответа",
+    ["endpoint", "status"], buckets=LATENCY_BUCKETS
+)
+
+_engines: List[Tuple[str, object]] = []
+_redis_clients: List[Tuple[str, object]] = []
+_stats_sources: List[Tuple[str, Callable[[], dict], str]] = []
+
+
+@contextmanager
+def stage(name: str):
+    # Контекстный менеджер; декоратор prometheus_client не ждет корутины.
+    # Каждый этап - еще и спан трассы запроса
+    with tracing.span(name), ASK_STAGE_SECONDS.labels(name).time():
+        yield
+
+
+def track_engine(name: str, engine):
+    _engines.append((name, engine))
+
+
+def track_redis_pool(name: str, client):
+    _redis_clients.append((name, client))
+
+
+def track_stats(prefix: str, source: Callable[[], dict], label: str = ""):
+    # Числовые поля source() становятся метриками prefix_поле; если задан
+    # label, ключи верхнего уровня - значения этой метки
+    _stats_sources.append((prefix, source, label))
+
+
+def metric_name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(parts))
+
+
+class StateCollector:
+    def describe(self):
+        return []
+
+    def collect(self):
+        yield from self.collect_pools()
+        for prefix, source, label in _stats_sources:
+            families = {}
+            stats = source()
+            items = stats.items() if label else [(None, stats)]
+            for label_value, values in items:
+                self.flatten(families, prefix, label, label_value, values)
+            yield from families.values()
+
+    @staticmethod
+    def flatten(families, name, label, label_value, values):
+        for key, value in values.items():
+            full_name = metric_name(name, str(key))
+            if isinstance(value, dict):
+                StateCollector.flatten(
+                    families, full_name, label, label_value, value
+                )
+                continue
+            labels, label_values = [], []
+            if label:
+                labels.append(label)
+                label_values.append(str(label_value))
+            if isinstance(value, str):
+                # Строковое состояние - отдельный ряд со значением 1
+                labels.append("value")
+                label_values.append(value)
+                value = 1
+            elif not isinstance(value, (int, float)):
+                continue
+            family = families.get(full_name)
+            if family is None:
+                family = families[full_name] = GaugeMetricFamily(
+                    full_name, f"Поле {key} из {name}", labels=labels
+                )
+            family.add_metric(label_values, float(value))
+
+    @staticmethod
+    def collect_pools():
+        db = GaugeMetricFamily(
+            "db_pool_connections",
+            "Соединения пула SQLAlchemy: size, checked_out, idle, overflow",
+            labels=["engine", "state"]
+        )
+        for name, engine in _engines:
+            pool = engine.pool
+            if not hasattr(pool, "checkedout"):
+                continue
+            db.add_metric([name, "size"], pool.size())
+            db.add_metric([name, "checked_out"], pool.checkedout())
+            db.add_metric([name, "idle"], pool.checkedin())
+            db.add_metric([name, "overflow"], max(0, pool.overflow()))
+        yield db
+
+        redis = GaugeMetricFamily(
+            "redis_pool_connections",
+            "Соединения пула Redis: in_use, idle",
+            labels=["client", "state"]
+        )
+        for name, client in _redis_clients:
+            pool = client.connection_pool
+            redis.add_metric([name, "in_use"], len(
+                getattr(pool, "_in_use_connections", ())
+            ))
+            redis.add_metric([name, "idle"], len(
+                getattr(pool, "_available_connections", ())
+            ))
+        yield redis
+
+
+REGISTRY.register(StateCollector())
+
+
+def render() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    # ASGI-обертка, а не BaseHTTPMiddleware: время потокового ответа
+    # считается до отправки последней части тела
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            # Шаблон маршрута вместо пути, чтобы id не плодили ряды
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.labels(scope["method"], route, str(status)).inc()
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route).observe(
+                time.perf_counter() - started
+            )
+
+
+def update_kind(update) -> str:
+    message = getattr(update, "effective_message", None)
+    text = getattr(message, "text", None) or ""
+    if text.startswith("/"):
+        return text.split()[0].split("@")[0]
+    return "message" if message is not None else "other"
+
+
+async def observe_update(update, coroutine):
+    message = getattr(update, "effective_message", None)
+    if message is not None and message.date is not None:
+        BOT_UPDATE_LAG_SECONDS.observe(
+            max(0.0, time.time() - message.date.timestamp())
+        )
+    with BOT_HANDLER_SECONDS.labels(update_kind(update)).time():
+        return await coroutine
+
+
+def api_trace_config() -> aiohttp.TraceConfig:
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    def observe(context, url, status: str):
+        BOT_API_REQUEST_SECONDS.labels(url.path, status).observe(
+            time.perf_counter() - context.started
+        )
+
+    async def on_request_end(session, context, params):
+        observe(context, params.url, str(params.response.status))
+
+    async def on_request_exception(session, context, params):
+        observe(context, params.url, "error")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
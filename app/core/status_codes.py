@@ -1,9 +1,17 @@
+from app.core.config import settings
+
+
 class StatusMessages:
     LOGIN_REQUIRED = "Пожалуйста, войдите с помощью команды /login."
     SESSION_EXPIRED = "Ваша сессия истекла. Пожалуйста, войдите снова с помощью команды /login."
     VALIDATION_ERROR = "Ошибка 422: Неверный запрос. Пожалуйста, попробуйте снова или обратитесь в поддержку."
     MESSAGE_LIMIT_REACHED = "Ошибка 451: Достигнут дневной лимит сообщений."
     FORBIDDEN = "Ошибка 403: Запрещено. Ваш регион не поддерживается."
+    TOO_MANY_REQUESTS = "Ошибка 429: Слишком много запросов. Пожалуйста, дождитесь ответа на предыдущие вопросы."
+    SERVICE_UNAVAILABLE = "Ошибка 503: Сервер перегружен. Пожалуйста, попробуйте позже."
+    QUEUE_POSITION = "Ваш вопрос в очереди, позиция: {position}"
+    JOB_ACCEPTED = "Вопрос принят. Ответ придет отдельным сообщением."
+    CONVERSATION_RESET = "История диалога очищена. Можно начинать новый диалог."
     SERVER_ERROR = "Ошибка 500: Внутренняя ошибка сервера. Пожалуйста, попробуйте позже."
     UNEXPECTED_ERROR = "Неожиданная ошибка: HTTP {status}"
     UNAUTHORIZED = "Unauthorized"
@@ -16,3 +24,24 @@ class StatusMessages:
             return f"Ошибка 451: Достигнут дневной лимит в {limit} вопроса."
         else:
             return f"Ошибка 451: Достигнут дневной лимит в {limit} вопросов."
+
+
+def get_chat_error_text(status_code: int) -> str:
+    if status_code == 401:
+        return StatusMessages.SESSION_EXPIRED
+    elif status_code == 422:
+        return StatusMessages.VALIDATION_ERROR
+    elif status_code == 451:
+        return StatusMessages.get_message_limit_text(
+            settings.DAILY_MESSAGE_LIMIT
+        )
+    elif status_code == 403:
+        return StatusMessages.FORBIDDEN
+    elif status_code == 429:
+        return StatusMessages.TOO_MANY_REQUESTS
+    elif status_code == 503:
+        return StatusMessages.SERVICE_UNAVAILABLE
+    elif status_code == 500:
+        return StatusMessages.SERVER_ERROR
+    else:
+        return StatusMessages.UNEXPECTED_ERROR.format(status=status_code)
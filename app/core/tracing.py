@@ -0,0 +1,320 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+import aioredis
+from opentelemetry import propagate, trace
+from sqlalchemy import event
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor, ConsoleSpanExporter
+)
+from opentelemetry.sdk.trace.sampling import (
+    ALWAYS_ON, ParentBased, TraceIdRatioBased
+)
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from app.core.config import settings
+
+tracer = trace.get_tracer("app")
+_tail_sampler: Optional["TailSamplingProcessor"] = None
+_redis_instrumented = False
+
+
+class TailSamplingProcessor(SpanProcessor):
+    # Спаны копятся в памяти, пока не закончится локальный корень трассы
+    # (спан без родителя или с родителем из другого процесса). Трасса
+    # сохраняется, если корень дольше slow_threshold, в ней есть ошибка
+    # или ее trace_id попал в долю sample_ratio; решение по trace_id
+    # одинаково в боте и API, поэтому обычные трассы не теряют половину
+    def __init__(
+        self,
+        next_processor: SpanProcessor,
+        slow_threshold: float,
+        sample_ratio: float,
+        max_traces: int
+    ):
+        self._next = next_processor
+        self._slow_threshold_ns = int(slow_threshold * 1e9)
+        self._bound = TraceIdRatioBased.get_bound_for_rate(sample_ratio)
+        self._max_traces = max_traces
+        self._traces = OrderedDict()
+        # Решения по недавним трассам для спанов, закончившихся после корня
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "kept_slow": 0,
+            "kept_error": 0,
+            "kept_sampled": 0,
+            "dropped": 0,
+            "evicted": 0,
+        }
+
+    def _keep(self, trace_id: int, root, spans) -> bool:
+        if root.end_time - root.start_time >= self._slow_threshold_ns:
+            self._stats["kept_slow"] += 1
+        elif any(s.status.status_code == StatusCode.ERROR for s in spans):
+            self._stats["kept_error"] += 1
+        elif trace_id & TraceIdRatioBased.TRACE_ID_LIMIT < self._bound:
+            self._stats["kept_sampled"] += 1
+        else:
+            self._stats["dropped"] += 1
+            return False
+        return True
+
+    def on_end(self, span):
+        trace_id = span.context.trace_id
+        with self._lock:
+            if trace_id in self._decisions:
+                keep, spans = self._decisions[trace_id], [span]
+            else:
+                spans = self._traces.setdefault(trace_id, [])
+                spans.append(span)
+                if span.parent is not None and not span.parent.is_remote:
+                    while len(self._traces) > self._max_traces:
+                        self._traces.popitem(last=False)
+                        self._stats["evicted"] += 1
+                    return
+                del self._traces[trace_id]
+                keep = self._keep(trace_id, span, spans)
+                self._decisions[trace_id] = keep
+                while len(self._decisions) > self._max_traces:
+                    self._decisions.popitem(last=False)
+        if keep:
+            for kept in spans:
+                self._next.on_end(kept)
+
+    def shutdown(self):
+        self._next.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self._next.force_flush(timeout_millis)
+
+    def stats(self) -> dict:
+        return {**self._stats, "buffered": len(self._traces)}
+
+
+def create_exporter(service_name: str):
+    if settings.TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter
+        )
+        return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+    if settings.TRACING_EXPORTER != "file":
+        raise ValueError("TRACING_EXPORTER должен быть file или otlp")
+    # Одна строка JSON на спан; запись идет из фонового потока
+    # BatchSpanProcessor и не блокирует цикл событий
+    path = settings.TRACING_FILE_PATH.format(service=service_name)
+    return ConsoleSpanExporter(
+        service_name=service_name,
+        out=open(path, "a", encoding="utf-8"),
+        formatter=lambda span: span.to_json(indent=None) + "\n"
+    )
+
+
+def setup(service_name: str):
+    global _tail_sampler
+    if not settings.TRACING_ENABLED:
+        return
+    processor = BatchSpanProcessor(create_exporter(service_name))
+    if settings.TRACING_SLOW_THRESHOLD > 0:
+        sampler = ParentBased(ALWAYS_ON)
+        processor = _tail_sampler = TailSamplingProcessor(
+            processor,
+            settings.TRACING_SLOW_THRESHOLD,
+            settings.TRACING_SAMPLE_RATIO,
+            settings.TRACING_TAIL_MAX_TRACES
+        )
+    else:
+        sampler = ParentBased(
+            TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)
+        )
+    provider = TracerProvider(
+        sampler=sampler,
+        resource=Resource.create({"service.name": service_name})
+    )
+    provider.add_span_processor(processor)
+    trace.set_tracer_provider(provider)
+    instrument_redis()
+
+
+def stats() -> dict:
+    return _tail_sampler.stats() if _tail_sampler is not None else {}
+
+
+@contextmanager
+def span(
+    name: str,
+    attributes: Optional[dict] = None,
+    kind: SpanKind = SpanKind.INTERNAL,
+    context=None
+):
+    if not settings.TRACING_ENABLED:
+        yield trace.INVALID_SPAN
+        return
+    with tracer.start_as_current_span(
+        name, context=context, kind=kind, attributes=attributes,
+        record_exception=False, set_status_on_exception=False
+    ) as current:
+        try:
+            yield current
+        except asyncio.CancelledError:
+            # Проигравшая попытка хеджирования - не сбой
+            current.set_attribute("cancelled", True)
+            raise
+        except Exception as e:
+            # Ответы 4xx - ожидаемый исход запроса, а не ошибка
+            if getattr(e, "status_code", 500) >= 500:
+                current.record_exception(e)
+                current.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+
+
+async def traced(
+    name: str,
+    coroutine,
+    attributes: Optional[dict] = None,
+    kind: SpanKind = SpanKind.INTERNAL
+):
+    with span(name, attributes, kind):
+        return await coroutine
+
+
+def annotate(**attributes):
+    trace.get_current_span().set_attributes(attributes)
+
+
+def log_context() -> dict:
+    # Идентификаторы трассы в записях лога, чтобы найти запись по трассе
+    if not settings.TRACING_ENABLED:
+        return {}
+    context = trace.get_current_span().get_span_context()
+    if not context.is_valid:
+        return {}
+    return {
+        "trace_id": format(context.trace_id, "032x"),
+        "span_id": format(context.span_id, "016x"),
+    }
+
+
+def inject() -> dict:
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract(carrier: dict):
+    return propagate.extract(carrier)
+
+
+async def trace_update(update, kind: str, coroutine):
+    attributes = {"telegram.update_kind": kind}
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        attributes["telegram.chat_id"] = chat.id
+    with span(f"telegram {kind}", attributes, SpanKind.CONSUMER):
+        return await coroutine
+
+
+def instrument_app(app):
+    if not settings.TRACING_ENABLED:
+        return
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    FastAPIInstrumentor.instrument_app(
+        app,
+        excluded_urls="/health,/metrics,/static",
+        exclude_spans=["receive", "send"]
+    )
+
+
+def instrument_engines(engines: list):
+    # Спан на каждый запрос к БД по событиям движка: текст запроса
+    # без значений параметров, как и в echo
+    if not settings.TRACING_ENABLED:
+        return
+
+    def before_execute(conn, cursor, statement, parameters, context, many):
+        if not trace.get_current_span().is_recording():
+            return
+        context._trace_span = tracer.start_span(
+            f"db {statement.split(None, 1)[0].upper()}",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "db.system": conn.engine.dialect.name,
+                "db.statement": statement,
+            }
+        )
+
+    def after_execute(conn, cursor, statement, parameters, context, many):
+        current = getattr(context, "_trace_span", None)
+        if current is not None:
+            current.end()
+
+    def on_error(exception_context):
+        current = getattr(
+            exception_context.execution_context, "_trace_span", None
+        )
+        if current is not None:
+            current.record_exception(exception_context.original_exception)
+            current.set_status(Status(StatusCode.ERROR))
+            current.end()
+
+    for engine in engines:
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", before_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_execute)
+        event.listen(sync_engine, "handle_error", on_error)
+
+
+def api_trace_configs() -> list:
+    # Заголовок traceparent в запросах бота к API
+    if not settings.TRACING_ENABLED:
+        return []
+    from opentelemetry.instrumentation.aiohttp_client import (
+        create_trace_config
+    )
+    return [create_trace_config()]
+
+
+def instrument_redis():
+    # Готовая инструментация OpenTelemetry знает только пакет redis, а не
+    # aioredis. Команды вне трассы (фоновые циклы с XREADGROUP и сброс
+    # журнала токенов) спанов не создают
+    global _redis_instrumented
+    if _redis_instrumented:
+        return
+    _redis_instrumented = True
+    execute_command = aioredis.Redis.execute_command
+    execute_pipeline = aioredis.client.Pipeline.execute
+
+    async def traced_command(self, *args, **options):
+        if not trace.get_current_span().is_recording():
+            return await execute_command(self, *args, **options)
+        command = str(args[0])
+        with span(
+            f"redis {command}",
+            {"db.system": "redis", "db.operation": command},
+            SpanKind.CLIENT
+        ):
+            return await execute_command(self, *args, **options)
+
+    async def traced_pipeline(self, raise_on_error: bool = True):
+        if not trace.get_current_span().is_recording():
+            return await execute_pipeline(self, raise_on_error)
+        commands = [str(args[0]) for args, _ in self.command_stack]
+        with span(
+            "redis pipeline",
+            {
+                "db.system": "redis",
+                "db.operation": " ".join(commands),
+                "db.redis.commands": len(commands),
+            },
+            SpanKind.CLIENT
+        ):
+            return await execute_pipeline(self, raise_on_error)
+
+    aioredis.Redis.execute_command = traced_command
+    aioredis.client.Pipeline.execute = traced_pipeline
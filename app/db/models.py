@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
 from datetime import datetime, timezone
 
 Base = declarative_base()
@@ -15,3 +15,15 @@ class User(Base):
         default=lambda: datetime.now(timezone.utc)
     )
     tokens = Column(Integer, default=999)
+
+
+class TokenLedgerEntry(Base):
+    __tablename__ = "token_ledger"
+    id = Column(Integer, primary_key=True, index=True)
+    entry_id = Column(String, unique=True, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    delta = Column(Integer, nullable=False)
+    created_at = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc)
+    )
@@ -8,14 +8,24 @@ import aioredis
 import secrets
 
 from app.db.init_db import init_db
+from app.core import logs, metrics, tracing
 from app.core.config import settings
 from app.api.endpoints import router
+from app.services.adaptive_limit import AdaptiveLimit
+from app.services.ask_jobs import AskJobService
+from app.services.fair_scheduler import FairScheduler
+from app.services.openai_backends import BackendRouter
+from app.services.openai_service import OpenAIService
+from app.services.password_hasher import PasswordHasher
+from app.services.token_ledger import TokenLedgerService
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO)
+logs.setup()
 logger = logging.getLogger(__name__)
 daily_message_limit = settings.DAILY_MESSAGE_LIMIT
 app = FastAPI()
+tracing.setup("fastapi")
+tracing.instrument_app(app)
 
 # Настройка CORS
 app.add_middleware(
@@ -26,6 +36,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    # Состояние очереди, лимитов и пулов снимается в момент запроса /metrics
+    metrics.track_stats("fair_scheduler", FairScheduler.stats)
+    metrics.track_stats("openai_concurrency", AdaptiveLimit.stats)
+    metrics.track_stats(
+        "openai_backend", BackendRouter.stats, label="backend"
+    )
+    metrics.track_stats("password_hasher", PasswordHasher.stats)
+    metrics.track_stats("tracing", tracing.stats)
+    metrics.track_stats("logging", logs.stats)
+
 # Настройка статических файлов и шаблонов
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -37,9 +59,26 @@ redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    await TokenLedgerService.start()
+    await AskJobService.start()
+    if settings.BOT_MODE == "embedded":
+        from app.bot.embedded import EmbeddedBot
+        await EmbeddedBot.start()
     logger.info("Application startup complete.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if settings.BOT_MODE == "embedded":
+        from app.bot.embedded import EmbeddedBot
+        await EmbeddedBot.stop()
+    await AskJobService.stop()
+    await TokenLedgerService.stop()
+    await OpenAIService.close()
+    PasswordHasher.close()
+    logger.info("Application shutdown complete.")
+
+
 def generate_bot_token(user_id: int) -> str:
     return secrets.token_urlsafe(32)
 
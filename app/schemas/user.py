@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel, EmailStr
 
 
@@ -10,6 +12,17 @@ class RegisterUser(BaseModel):
 class Question(BaseModel):
     user_id: str
     question: str
+    stream: bool = False
+
+
+class AskJob(BaseModel):
+    user_id: str
+    question: str
+    push: bool = False
+
+
+class ResetConversation(BaseModel):
+    user_id: Optional[str] = None
 
 
 class UserResponse(BaseModel):
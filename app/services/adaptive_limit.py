@@ -0,0 +1,51 @@
+import time
+
+from app.core.config import settings
+
+
+class AdaptiveLimit:
+    # AIMD: каждый успешный ответ увеличивает лимит на 1/лимит, то есть
+    # примерно на единицу за «окно» одновременных запросов, а 429 или
+    # таймаут умножают его на OPENAI_AIMD_DECREASE. Уменьшение не чаще
+    # раза в OPENAI_AIMD_DECREASE_INTERVAL секунд, чтобы пачка отказов
+    # от одной перегрузки не обрушила лимит до минимума
+    _limit = float(settings.OPENAI_MAX_CONCURRENCY)
+    _last_decrease = 0.0
+    _stats = {"increases": 0, "decreases": 0}
+
+    @classmethod
+    def limit(cls) -> int:
+        if not settings.OPENAI_AIMD_ENABLED:
+            return settings.OPENAI_MAX_CONCURRENCY
+        return max(settings.OPENAI_AIMD_MIN_LIMIT, int(cls._limit))
+
+    @classmethod
+    def on_success(cls):
+        if cls._limit >= settings.OPENAI_MAX_CONCURRENCY:
+            return
+        cls._limit = min(
+            float(settings.OPENAI_MAX_CONCURRENCY),
+            cls._limit + 1 / cls._limit
+        )
+        cls._stats["increases"] += 1
+
+    @classmethod
+    def on_overload(cls):
+        now = time.monotonic()
+        if now - cls._last_decrease < settings.OPENAI_AIMD_DECREASE_INTERVAL:
+            return
+        cls._last_decrease = now
+        cls._limit = max(
+            float(settings.OPENAI_AIMD_MIN_LIMIT),
+            cls._limit * settings.OPENAI_AIMD_DECREASE
+        )
+        cls._stats["decreases"] += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "enabled": settings.OPENAI_AIMD_ENABLED,
+            "limit": cls.limit(),
+            "max_limit": settings.OPENAI_MAX_CONCURRENCY,
+            **cls._stats,
+        }
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import logging
+import secrets
+import time
+from typing import Optional
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.openai_backends import BackendRouter
+from app.services.openai_service import ChatAnswer, OpenAIService
+from app.services.similar_questions import SimilarQuestionService
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCacheService:
+    KEY_PREFIX = "answer_cache"
+    INDEX_KEY = "answer_cache:index"
+    STATS_KEY = "answer_cache:stats"
+    POLL_INTERVAL = 0.1
+
+    BILLING_FULL = "full"
+    BILLING_QUESTION_ONLY = "question"
+
+    _inflight = {}
+
+    # Снимает блокировку, только если она все еще принадлежит нам
+    RELEASE_LOCK_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        return " ".join(question.casefold().split())
+
+    @classmethod
+    def make_key(cls, question: str, model: str) -> str:
+        digest = hashlib.sha256(
+            cls.normalize(question).encode("utf-8")
+        ).hexdigest()
+        return f"{cls.KEY_PREFIX}:{model}:{digest}"
+
+    @classmethod
+    def billable_answer_tokens(cls, tokens: int, cached: bool) -> int:
+        policy = settings.ANSWER_CACHE_BILLING
+        if cached and policy == cls.BILLING_QUESTION_ONLY:
+            return 0
+        return tokens
+
+    @classmethod
+    async def _count(cls, redis_client, name: str, amount: int = 1):
+        metrics.ANSWER_CACHE_EVENTS.labels(name).inc(amount)
+        try:
+            await redis_client.hincrby(cls.STATS_KEY, name, amount)
+        except Exception as e:
+            logger.warning(f"Ошибка обновления счетчиков кэша: {str(e)}")
+
+    @classmethod
+    async def get(cls, redis_client, key: str):
+        try:
+            answer = await redis_client.get(key)
+            metrics.ANSWER_CACHE_EVENTS.labels(
+                "misses" if answer is None else "hits"
+            ).inc()
+            async with redis_client.pipeline(transaction=False) as pipe:
+                if answer is None:
+                    pipe.hincrby(cls.STATS_KEY, "misses", 1)
+                else:
+                    pipe.hincrby(cls.STATS_KEY, "hits", 1)
+                    pipe.zadd(cls.INDEX_KEY, {key: time.time()})
+                await pipe.execute()
+            return answer
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша ответов: {str(e)}")
+            return None
+
+    @classmethod
+    async def set(cls, redis_client, key: str, answer: str):
+        now = time.time()
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(key, answer, ex=settings.ANSWER_CACHE_TTL)
+                pipe.zadd(cls.INDEX_KEY, {key: now})
+                pipe.zremrangebyscore(
+                    cls.INDEX_KEY, 0, now - settings.ANSWER_CACHE_TTL
+                )
+                pipe.zcard(cls.INDEX_KEY)
+                *_, size = await pipe.execute()
+
+            overflow = size - settings.ANSWER_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                evicted = await redis_client.zpopmin(cls.INDEX_KEY, overflow)
+                if evicted:
+                    await redis_client.delete(*[k for k, _ in evicted])
+                    await cls._count(redis_client, "evictions", len(evicted))
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш ответов: {str(e)}")
+
+    @classmethod
+    async def get_stats(cls, redis_client) -> dict:
+        stats = await redis_client.hgetall(cls.STATS_KEY)
+        return {name: int(value) for name, value in stats.items()}
+
+    @staticmethod
+    def cache_model(history=None) -> Optional[str]:
+        # Модель, под которой ищется ответ. Если у бэкендов разные модели,
+        # заранее неизвестно, какая ответит, и кэш не используется
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        model = BackendRouter.shared_model()
+        # Ответ с учетом истории диалога зависит не только от вопроса
+        if history or model is None:
+            metrics.ANSWER_CACHE_EVENTS.labels("bypass").inc()
+            return None
+        return model
+
+    @classmethod
+    async def get_similar(cls, redis_client, question: str, model: str):
+        key = await SimilarQuestionService.find_key(question, model)
+        if key is None:
+            return None
+        try:
+            answer = await redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша ответов: {str(e)}")
+            return None
+        if answer is None:
+            await SimilarQuestionService.forget(key, model)
+            return None
+        await cls._count(redis_client, "similar_hits")
+        return answer
+
+    @classmethod
+    async def get_answer(cls, redis_client, question: str, model: str):
+        with metrics.stage("cache_lookup"):
+            answer = await cls.get(redis_client, cls.make_key(question, model))
+            if answer is None:
+                answer = await cls.get_similar(redis_client, question, model)
+        return answer
+
+    @classmethod
+    async def store_answer(
+        cls, redis_client, question: str, answer: str, model: str
+    ):
+        key = cls.make_key(question, model)
+        await cls.set(redis_client, key, answer)
+        await SimilarQuestionService.remember(key, question, model)
+
+    @classmethod
+    async def ask_question(
+        cls, redis_client, question: str, user_id=None, history=None
+    ):
+        model = cls.cache_model(history)
+        if model is None:
+            answer = await OpenAIService.ask_question(
+                question, user_id, history
+            )
+            return answer, False
+
+        key = cls.make_key(question, model)
+        with metrics.stage("cache_lookup"):
+            answer = await cls.get(redis_client, key)
+            if answer is None:
+                answer = await cls.get_similar(redis_client, question, model)
+        if answer is not None:
+            return ChatAnswer(answer), True
+
+        future = cls._inflight.get(key)
+        if future is not None:
+            try:
+                answer = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                return await cls.ask_question(
+                    redis_client, question, user_id
+                )
+            await cls._count(redis_client, "coalesced")
+            return ChatAnswer(answer), True
+
+        future = asyncio.get_running_loop().create_future()
+        cls._inflight[key] = future
+        try:
+            answer, cached = await cls._fetch(
+                redis_client, key, question, user_id, model
+            )
+            future.set_result(answer.text)
+            return answer, cached
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже отдано вызывающему, ожидающих может не быть
+            future.exception()
+            raise
+        finally:
+            cls._inflight.pop(key, None)
+
+    @classmethod
+    async def _fetch(
+        cls, redis_client, key: str, question: str, user_id, model: str
+    ):
+        lock_key = f"{key}:lock"
+        lock_token = secrets.token_hex(8)
+        try:
+            acquired = await redis_client.set(
+                lock_key, lock_token, nx=True,
+                ex=settings.ANSWER_CACHE_LOCK_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка блокировки кэша ответов: {str(e)}")
+            acquired = False
+
+        if not acquired:
+            answer = await cls._wait_for_answer(redis_client, key, lock_key)
+            if answer is not None:
+                await cls._count(redis_client, "coalesced")
+                return ChatAnswer(answer), True
+
+        try:
+            answer = await OpenAIService.ask_question(question, user_id)
+            if answer.model in (None, model):
+                await cls.set(redis_client, key, answer.text)
+                await SimilarQuestionService.remember(key, question, model)
+            return answer, False
+        finally:
+            if acquired:
+                try:
+                    await redis_client.eval(
+                        cls.RELEASE_LOCK_SCRIPT, 1, lock_key, lock_token
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"Ошибка снятия блокировки кэша: {str(e)}"
+                    )
+
+    @classmethod
+    async def _wait_for_answer(cls, redis_client, key: str, lock_key: str):
+        deadline = time.monotonic() + settings.ANSWER_CACHE_LOCK_TIMEOUT
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(cls.POLL_INTERVAL)
+                answer = await redis_client.get(key)
+                if answer is not None:
+                    return answer
+                if not await redis_client.exists(lock_key):
+                    return None
+        except Exception as e:
+            logger.warning(f"Ошибка ожидания кэша ответов: {str(e)}")
+        return None
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import List, Optional
+
+import aioredis
+from fastapi import HTTPException
+
+from app.core import metrics, tracing
+from app.core.config import settings
+from app.db.init_db import AsyncSessionLocal
+from app.services.answer_cache import AnswerCacheService
+from app.services.ask_service import AskService, PreparedQuestion
+from app.services.token_service import TokenService
+
+logger = logging.getLogger(__name__)
+
+
+class AskJobService:
+    # Вопрос обрабатывается воркером из очереди в Redis: запрос клиента
+    # сразу получает id задания и не держит соединений на время ответа
+    STREAM_KEY = "ask_jobs"
+    GROUP_NAME = "ask_workers"
+    JOB_KEY = "ask_job:{job_id}"
+    BLOCK_MS = 5000
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_ERROR = "error"
+    FINISHED = (STATUS_DONE, STATUS_ERROR)
+
+    consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+
+    _redis = None
+    _tasks: List[asyncio.Task] = []
+
+    @classmethod
+    def get_redis(cls):
+        if cls._redis is None:
+            cls._redis = aioredis.from_url(
+                settings.REDIS_URL, decode_responses=True
+            )
+            metrics.track_redis_pool("ask_jobs", cls._redis)
+        return cls._redis
+
+    @classmethod
+    def job_key(cls, job_id: str) -> str:
+        return cls.JOB_KEY.format(job_id=job_id)
+
+    @classmethod
+    async def submit(
+        cls,
+        user_id: int,
+        question: str,
+        prepared: PreparedQuestion,
+        conversation: Optional[str] = None,
+        chat_id: Optional[str] = None
+    ) -> str:
+        job_id = uuid.uuid4().hex
+        key = cls.job_key(job_id)
+        fields = {
+            "status": cls.STATUS_QUEUED,
+            "user_id": user_id,
+            "question": question,
+            "tokens_needed": prepared.tokens_needed,
+            "reserved": prepared.reserved,
+            "history": json.dumps(prepared.history, ensure_ascii=False),
+            "conversation": conversation or "",
+            "chat_id": chat_id or "",
+            # Контекст трассы запроса, чтобы воркер продолжил ее
+            **tracing.inject(),
+        }
+        async with cls.get_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, settings.ASK_JOB_TTL)
+            pipe.xadd(cls.STREAM_KEY, {"job_id": job_id})
+            await pipe.execute()
+        return job_id
+
+    @classmethod
+    def result(cls, job_id: str, job: dict) -> dict:
+        result = {"job_id": job_id, "status": job["status"]}
+        if job["status"] == cls.STATUS_DONE:
+            result["response"] = job["response"]
+            result["tokens_used"] = int(job["tokens_used"])
+            result["tokens_remaining"] = int(job["tokens_remaining"])
+        elif job["status"] == cls.STATUS_ERROR:
+            result["error"] = job["error"]
+            result["status_code"] = int(job["status_code"])
+        return result
+
+    @classmethod
+    async def get(cls, job_id: str, user_id: int) -> Optional[dict]:
+        job = await cls.get_redis().hgetall(cls.job_key(job_id))
+        if not job or int(job["user_id"]) != user_id:
+            return None
+        return job
+
+    @classmethod
+    async def wait(
+        cls,
+        job_id: str,
+        user_id: int,
+        timeout: float
+    ) -> Optional[dict]:
+        # Долгий опрос: ответ уходит, как только задание завершено
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            job = await cls.get(job_id, user_id)
+            if job is None or job["status"] in cls.FINISHED:
+                return job
+            if asyncio.get_running_loop().time() >= deadline:
+                return job
+            await asyncio.sleep(settings.ASK_JOB_POLL_INTERVAL)
+
+    @classmethod
+    async def _answer(cls, key: str, job: dict) -> dict:
+        redis_client = cls.get_redis()
+        user_id = int(job["user_id"])
+        reserved = int(job["reserved"])
+        question = job["question"]
+        try:
+            answer, cached = await AnswerCacheService.ask_question(
+                redis_client, question, user_id, json.loads(job["history"])
+            )
+        except Exception:
+            async with AsyncSessionLocal() as db:
+                await TokenService.refund_tokens(user_id, reserved, db)
+            raise
+
+        # Флаг ставится до списания: если воркер упадет после него, другой
+        # воркер не спишет токены за это задание второй раз
+        if not await redis_client.hsetnx(key, "settled", 1):
+            raise cls.already_settled()
+        async with AsyncSessionLocal() as db:
+            balance, tokens_used = await AskService.settle_answer(
+                db, user_id, reserved, int(job["tokens_needed"]),
+                answer, cached
+            )
+        if balance is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Недостаточно токенов для получения ответа."
+            )
+        await AskService.remember_turn(
+            redis_client, job["conversation"] or None, question, answer
+        )
+        return {
+            "status": cls.STATUS_DONE,
+            "response": answer.text,
+            "tokens_used": tokens_used,
+            "tokens_remaining": balance,
+        }
+
+    @staticmethod
+    def already_settled() -> HTTPException:
+        return HTTPException(
+            status_code=500,
+            detail="Задание прервано после списания токенов."
+        )
+
+    @classmethod
+    async def process(cls, job_id: str):
+        redis_client = cls.get_redis()
+        key = cls.job_key(job_id)
+        job = await redis_client.hgetall(key)
+        # Задание могло истечь или уже быть выполнено до сбоя воркера
+        if not job or job["status"] in cls.FINISHED:
+            return
+        with tracing.span(
+            "ask_job",
+            {"ask_job.id": job_id},
+            tracing.SpanKind.CONSUMER,
+            context=tracing.extract(job)
+        ):
+            await cls._run(key, job_id, job)
+
+    @classmethod
+    async def _run(cls, key: str, job_id: str, job: dict):
+        redis_client = cls.get_redis()
+        await redis_client.hset(key, "status", cls.STATUS_RUNNING)
+
+        try:
+            if job.get("settled"):
+                # Воркер упал после списания: ответ не запрашивается заново
+                raise cls.already_settled()
+            result = await cls._answer(key, job)
+        except HTTPException as e:
+            result = {
+                "status": cls.STATUS_ERROR,
+                "status_code": e.status_code,
+                "error": e.detail,
+            }
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задания {job_id}: {str(e)}")
+            result = {
+                "status": cls.STATUS_ERROR,
+                "status_code": 500,
+                "error": "Внутренняя ошибка сервера.",
+            }
+        # Забранное задание мог успеть завершить прежний воркер
+        if await redis_client.hget(key, "status") in cls.FINISHED:
+            return
+        await redis_client.hset(key, mapping=result)
+
+        chat_id = job["chat_id"]
+        if chat_id:
+            from app.bot.push import JobResultPusher
+            try:
+                await JobResultPusher.send(
+                    chat_id, cls.result(job_id, {**job, **result})
+                )
+            except Exception as e:
+                logger.error(
+                    f"Ошибка отправки ответа в чат {chat_id}: {str(e)}"
+                )
+
+    @classmethod
+    async def _ensure_group(cls):
+        try:
+            await cls.get_redis().xgroup_create(
+                cls.STREAM_KEY, cls.GROUP_NAME, id="0", mkstream=True
+            )
+        except aioredis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @classmethod
+    async def _claim_stale(cls, consumer: str):
+        # Задания упавшего воркера забираются после ASK_JOB_CLAIM_IDLE_MS
+        redis_client = cls.get_redis()
+        pending = await redis_client.xpending_range(
+            cls.STREAM_KEY, cls.GROUP_NAME, "-", "+", 1
+        )
+        min_idle_ms = settings.ASK_JOB_CLAIM_IDLE_MS
+        stale_ids = [
+            entry["message_id"] for entry in pending
+            if entry["time_since_delivered"] >= min_idle_ms
+        ]
+        if not stale_ids:
+            return []
+        claimed = await redis_client.xclaim(
+            cls.STREAM_KEY, cls.GROUP_NAME, consumer,
+            min_idle_ms, stale_ids
+        )
+        deleted = [message_id for message_id, fields in claimed if not fields]
+        if deleted:
+            await redis_client.xack(cls.STREAM_KEY, cls.GROUP_NAME, *deleted)
+        return [
+            (message_id, fields) for message_id, fields in claimed if fields
+        ]
+
+    @classmethod
+    async def work_once(cls, consumer: str) -> int:
+        redis_client = cls.get_redis()
+        messages = await cls._claim_stale(consumer)
+        if not messages:
+            response = await redis_client.xreadgroup(
+                cls.GROUP_NAME, consumer,
+                {cls.STREAM_KEY: ">"},
+                count=1,
+                block=cls.BLOCK_MS
+            )
+            messages = response[0][1] if response else []
+
+        for message_id, fields in messages:
+            await cls.process(fields["job_id"])
+            await redis_client.xack(cls.STREAM_KEY, cls.GROUP_NAME, message_id)
+            await redis_client.xdel(cls.STREAM_KEY, message_id)
+        return len(messages)
+
+    @classmethod
+    async def run(cls, consumer: str):
+        while True:
+            try:
+                await cls.work_once(consumer)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди заданий: {str(e)}")
+                await asyncio.sleep(1)
+
+    @classmethod
+    async def start(cls):
+        if not settings.ASK_JOBS_ENABLED or cls._tasks:
+            return
+        await cls._ensure_group()
+        cls._tasks = [
+            asyncio.create_task(cls.run(f"{cls.consumer_name}-{number}"))
+            for number in range(settings.ASK_JOB_WORKERS)
+        ]
+
+    @classmethod
+    async def stop(cls):
+        if not cls._tasks:
+            return
+        # Прерванные задания заберет другой воркер после ASK_JOB_CLAIM_IDLE_MS
+        for task in cls._tasks:
+            task.cancel()
+        await asyncio.gather(*cls._tasks, return_exceptions=True)
+        cls._tasks = []
+        from app.bot.push import JobResultPusher
+        await JobResultPusher.close()
@@ -0,0 +1,224 @@
+import logging
+from typing import List, NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import metrics
+from app.core.config import settings
+from app.db.init_db import AsyncSessionLocal
+from app.services.answer_cache import AnswerCacheService
+from app.services.conversation import ConversationHistory, ConversationService
+from app.services.message_limit import MessageLimitService, RateLimitResult
+from app.services.openai_service import ChatAnswer, OpenAIService
+from app.services.token_service import TokenService
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedQuestion(NamedTuple):
+    rate_limit: RateLimitResult
+    tokens_needed: int
+    reserved: int
+    history: List[dict] = []
+
+
+class AskService:
+    MAX_QUESTION_LENGTH = 1000
+
+    @staticmethod
+    async def load_history(
+        redis_client,
+        conversation: Optional[str],
+        question_tokens: int
+    ) -> ConversationHistory:
+        if conversation is None:
+            return ConversationHistory([], 0)
+        # История вместе с вопросом должна поместиться в бюджет контекста
+        with metrics.stage("history_load"):
+            return await ConversationService.get_history(
+                redis_client,
+                conversation,
+                settings.CONVERSATION_CONTEXT_TOKENS - (
+                    ConversationService.message_tokens(question_tokens)
+                )
+            )
+
+    @staticmethod
+    async def remember_turn(
+        redis_client,
+        conversation: Optional[str],
+        question: str,
+        answer: ChatAnswer
+    ):
+        if conversation is None:
+            return
+        answer_tokens = answer.completion_tokens
+        if answer_tokens is None:
+            answer_tokens = TokenService.count_tokens(answer.text)
+        with metrics.stage("history_save"):
+            await ConversationService.append_turn(
+                redis_client, conversation,
+                question, TokenService.count_tokens(question),
+                answer.text, answer_tokens
+            )
+
+    @classmethod
+    async def prepare(
+        cls,
+        redis_client,
+        user,
+        question: str,
+        db: AsyncSession,
+        conversation: Optional[str] = None
+    ) -> PreparedQuestion:
+        if len(question) > cls.MAX_QUESTION_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail="Максимальная длина вопроса - 1000 символов."
+            )
+
+        rate_limit = await MessageLimitService.check_and_increment_question_count(
+            redis_client, user.id
+        )
+
+        tokens_needed = TokenService.count_tokens(question)
+        history = await cls.load_history(
+            redis_client, conversation, tokens_needed
+        )
+        tokens_needed += history.tokens
+        reserved = TokenService.reservation_size(
+            tokens_needed, await TokenService.get_balance(user)
+        )
+        balance = await TokenService.reserve_tokens(user.id, reserved, db)
+        if balance is None and reserved > tokens_needed:
+            # Снимок баланса мог устареть из-за параллельных вопросов:
+            # резервируем только вопрос, ответ спишется при расчете
+            reserved = tokens_needed
+            balance = await TokenService.reserve_tokens(user.id, reserved, db)
+        if balance is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Недостаточно токенов для отправки вопроса."
+            )
+        return PreparedQuestion(
+            rate_limit, tokens_needed, reserved, history.messages
+        )
+
+    @staticmethod
+    async def settle_answer(
+        db: AsyncSession,
+        user_id: int,
+        reserved: int,
+        tokens_needed: int,
+        answer: ChatAnswer,
+        cached: bool
+    ):
+        # Для ответов OpenAI считаем по блоку usage, если он пришел
+        question_tokens = tokens_needed
+        answer_tokens = None
+        if not cached and answer.prompt_tokens is not None:
+            question_tokens = answer.prompt_tokens
+            answer_tokens = answer.completion_tokens
+        if answer_tokens is None:
+            answer_tokens = TokenService.count_tokens(answer.text)
+
+        tokens_used = question_tokens + (
+            AnswerCacheService.billable_answer_tokens(answer_tokens, cached)
+        )
+        balance = await TokenService.settle_tokens(
+            user_id, reserved, tokens_used, db
+        )
+        if balance is None:
+            # На ответ токенов не хватило - списываем только вопрос, но не
+            # больше резерва: такой расчет лишь возвращает токены
+            charged = min(question_tokens, reserved)
+            if await TokenService.settle_tokens(
+                user_id, reserved, charged, db
+            ) is None:
+                logger.error("Не удалось рассчитать резерв токенов", extra={
+                    "user_id": user_id,
+                    "reserved": reserved,
+                    "charged": charged,
+                })
+        return balance, tokens_used
+
+    @classmethod
+    async def stream_events(
+        cls,
+        redis_client,
+        user_id: int,
+        question: str,
+        tokens_needed: int,
+        reserved: int,
+        format_error=None,
+        conversation: Optional[str] = None,
+        history: Optional[List[dict]] = None
+    ):
+        chunks = []
+        usage = ChatAnswer("")
+        cached = False
+        try:
+            cached_answer = None
+            model = AnswerCacheService.cache_model(history)
+            if model is not None:
+                cached_answer = await AnswerCacheService.get_answer(
+                    redis_client, question, model
+                )
+            answered_model = None
+            if cached_answer is not None:
+                cached = True
+                chunks.append(cached_answer)
+                yield {"delta": cached_answer}
+            else:
+                async for chunk in OpenAIService.stream_question(
+                    question, user_id, history
+                ):
+                    if chunk.queue_position is not None:
+                        yield {"queue_position": chunk.queue_position}
+                    if chunk.prompt_tokens is not None:
+                        usage = chunk
+                    if chunk.model is not None:
+                        answered_model = chunk.model
+                    if chunk.text:
+                        chunks.append(chunk.text)
+                        yield {"delta": chunk.text}
+                # Ответ сохраняется под моделью бэкенда, который его дал
+                if model is not None and answered_model == model:
+                    await AnswerCacheService.store_answer(
+                        redis_client, question, "".join(chunks), model
+                    )
+        except HTTPException as e:
+            async with AsyncSessionLocal() as db:
+                await TokenService.refund_tokens(user_id, reserved, db)
+            detail = format_error(e.status_code) if format_error else e.detail
+            yield {"error": detail, "status": e.status_code}
+            return
+        except BaseException:
+            # Клиент отключился: списываем только уже отданную часть ответа
+            async with AsyncSessionLocal() as db:
+                await cls.settle_answer(
+                    db, user_id, reserved, tokens_needed,
+                    ChatAnswer("".join(chunks)), cached
+                )
+            raise
+
+        answer = usage._replace(text="".join(chunks))
+        # Сессия запроса уже закрыта к моменту окончания стрима
+        async with AsyncSessionLocal() as db:
+            balance, tokens_used = await cls.settle_answer(
+                db, user_id, reserved, tokens_needed, answer, cached
+            )
+        if balance is None:
+            yield {
+                "error": "Недостаточно токенов для получения ответа.",
+                "status": 400
+            }
+            return
+
+        await cls.remember_turn(redis_client, conversation, question, answer)
+        yield {
+            "done": True,
+            "tokens_used": tokens_used,
+            "tokens_remaining": balance
+        }
@@ -1,3 +1,4 @@
+import logging
 import os
 from datetime import datetime, timedelta
 from typing import Optional
@@ -5,12 +6,18 @@ from typing import Optional
 from fastapi import Depends, HTTPException, Request
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.core import metrics, tracing
 from app.db.models import User
-from app.db.init_db import get_db
+from app.db.init_db import get_db, has_read_replicas, ReadSessionLocal
+from app.services.db_routing import DbRoutingService
+from app.services.password_hasher import PasswordHasher
+from app.services.user_cache import UserCacheService
+
+logger = logging.getLogger(__name__)
 
 
 class AuthService:
@@ -18,7 +25,7 @@ class AuthService:
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = PasswordHasher.pwd_context
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
     @classmethod
@@ -46,15 +53,67 @@ class AuthService:
         email: str,
         password: str
     ):
-        result = await db.execute(select(User).filter(User.email == email))
-        user = result.scalar_one_or_none()
-        if not user or not cls.pwd_context.verify(
+        user = await cls.find_user(email, db)
+        if not user:
+            return False
+
+        valid, new_hash = await PasswordHasher.verify_and_update(
             password,
             user.hashed_password
-        ):
+        )
+        if not valid:
             return False
+        if new_hash is not None:
+            await cls.rehash_password(db, user, new_hash)
         return user
 
+    @staticmethod
+    async def rehash_password(db: AsyncSession, user: User, new_hash: str):
+        # Пароль не меняется, поэтому снимок пользователя в кэше остается
+        try:
+            await db.execute(
+                update(User)
+                .where(
+                    User.id == user.id,
+                    User.hashed_password == user.hashed_password
+                )
+                .values(hashed_password=new_hash)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.warning(f"Не удалось обновить хеш пароля: {str(e)}")
+
+    @staticmethod
+    async def find_user(email: str, db: AsyncSession) -> Optional[User]:
+        # Чтение идет в реплику; основная база отвечает, если пользователя
+        # там еще нет или его баланс только что изменился
+        if has_read_replicas():
+            async with ReadSessionLocal() as read_db:
+                result = await read_db.execute(
+                    select(User).filter(User.email == email)
+                )
+                user = result.scalar_one_or_none()
+            if user is not None and not await DbRoutingService.needs_primary(
+                user.id
+            ):
+                return user
+
+        result = await db.execute(select(User).filter(User.email == email))
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def get_user_snapshot(cls, email: str, db: AsyncSession):
+        snapshot = await UserCacheService.get(email)
+        if snapshot is not None:
+            return snapshot
+
+        user = await cls.find_user(email, db)
+        if user is None:
+            return None
+        return await UserCacheService.store(user)
+
     @classmethod
     async def get_current_user(cls, request: Request, db: AsyncSession):
         credentials_exception = HTTPException(
@@ -71,26 +130,28 @@ class AuthService:
             raise credentials_exception
 
         try:
-            token = (
-                token.split()[1]
-                if token.lower().startswith("bearer ")
-                else token
-            )
-            payload = jwt.decode(
-                token,
-                cls.SECRET_KEY,
-                algorithms=[cls.ALGORITHM]
-            )
+            with metrics.stage("jwt_decode"):
+                token = (
+                    token.split()[1]
+                    if token.lower().startswith("bearer ")
+                    else token
+                )
+                payload = jwt.decode(
+                    token,
+                    cls.SECRET_KEY,
+                    algorithms=[cls.ALGORITHM]
+                )
             email: str = payload.get("sub")
             if email is None:
                 raise credentials_exception
         except JWTError:
             raise credentials_exception
 
-        result = await db.execute(select(User).filter(User.email == email))
-        user = result.scalar_one_or_none()
+        with metrics.stage("user_lookup"):
+            user = await cls.get_user_snapshot(email, db)
         if user is None:
             raise credentials_exception
+        tracing.annotate(**{"enduser.id": user.id})
         return user
 
     @classmethod
@@ -115,8 +176,8 @@ class AuthService:
         except JWTError:
             raise credentials_exception
 
-        result = await db.execute(select(User).filter(User.email == email))
-        user = result.scalar_one_or_none()
+        user = await cls.get_user_snapshot(email, db)
         if user is None:
             raise credentials_exception
+        tracing.annotate(**{"enduser.id": user.id})
         return user
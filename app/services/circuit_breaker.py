@@ -0,0 +1,68 @@
+import time
+
+
+class CircuitBreaker:
+    # closed - запросы идут; open - после failure_threshold сбоев подряд
+    # запросы не отправляются reset_timeout секунд; half_open - пропускается
+    # одна пробная попытка, ее успех закрывает цепь, сбой снова открывает
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(
+            0.0, self.opened_at + self.reset_timeout - time.monotonic()
+        )
+
+    def available(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return self.retry_after() == 0.0
+        return not self._probing
+
+    def on_attempt(self):
+        if self.state == self.OPEN and self.retry_after() == 0.0:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def on_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        self._probing = False
+        if (
+            self.state == self.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state != self.OPEN:
+                self.opened_count += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def on_cancel(self):
+        # Отмененная пробная попытка ничего не сказала о бэкенде
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened_count,
+            "retry_after": round(self.retry_after(), 1),
+        }
@@ -0,0 +1,137 @@
+import json
+import logging
+from typing import List, NamedTuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ROLES = {"u": "user", "a": "assistant"}
+
+
+class ConversationHistory(NamedTuple):
+    messages: List[dict]
+    tokens: int
+
+
+class ConversationService:
+    KEY_PREFIX = "conversation:"
+    WEB_CONVERSATION = "web"
+
+    # KEYS[1] - список сообщений, KEYS[2] - сумма их токенов,
+    # ARGV - бюджет токенов, лимит сообщений, TTL, затем сообщения.
+    # Сообщение хранится как [роль, токены, текст]; старые сообщения
+    # удаляются по сохраненному числу токенов, без повторного подсчета
+    APPEND_SCRIPT = """
+    local budget = tonumber(ARGV[1])
+    local max_messages = tonumber(ARGV[2])
+    local ttl = tonumber(ARGV[3])
+    local total = 0
+    for i = 4, #ARGV do
+        local message = cjson.decode(ARGV[i])
+        redis.call('RPUSH', KEYS[1], ARGV[i])
+        total = redis.call('INCRBY', KEYS[2], message[2])
+    end
+    local length = redis.call('LLEN', KEYS[1])
+    local trimming = true
+    while length > 0 and trimming do
+        local message = cjson.decode(redis.call('LINDEX', KEYS[1], 0))
+        -- Диалог не должен начинаться с ответа без вопроса
+        trimming = total > budget or length > max_messages
+            or message[1] == 'a'
+        if trimming then
+            redis.call('LPOP', KEYS[1])
+            total = redis.call('DECRBY', KEYS[2], message[2])
+            length = length - 1
+        end
+    end
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+    return total
+    """
+
+    _append = None
+
+    @classmethod
+    def make_key(cls, user_id: int, conversation_id=None) -> str:
+        conversation_id = conversation_id or cls.WEB_CONVERSATION
+        return f"{cls.KEY_PREFIX}{user_id}:{conversation_id}"
+
+    @staticmethod
+    def message_tokens(text_tokens: int) -> int:
+        # Служебные токены, которые OpenAI добавляет к каждому сообщению
+        return text_tokens + settings.CONVERSATION_MESSAGE_OVERHEAD
+
+    @classmethod
+    async def get_history(
+        cls,
+        redis_client,
+        key: str,
+        budget: int
+    ) -> ConversationHistory:
+        if not settings.CONVERSATION_ENABLED or budget <= 0:
+            return ConversationHistory([], 0)
+        try:
+            raw_messages = await redis_client.lrange(key, 0, -1)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения истории диалога: {str(e)}")
+            return ConversationHistory([], 0)
+
+        # Берем последние сообщения, пока они помещаются в бюджет
+        entries = []
+        tokens = 0
+        for raw in reversed(raw_messages):
+            role, message_tokens, text = json.loads(raw)
+            if tokens + message_tokens > budget:
+                break
+            entries.append((role, message_tokens, text))
+            tokens += message_tokens
+        # История не должна начинаться с ответа без вопроса
+        if entries and entries[-1][0] == "a":
+            tokens -= entries.pop()[1]
+
+        messages = [
+            {"role": ROLES[role], "content": text}
+            for role, _, text in reversed(entries)
+        ]
+        return ConversationHistory(messages, tokens)
+
+    @classmethod
+    async def append_turn(
+        cls,
+        redis_client,
+        key: str,
+        question: str,
+        question_tokens: int,
+        answer: str,
+        answer_tokens: int
+    ):
+        if not settings.CONVERSATION_ENABLED or not answer:
+            return
+        if cls._append is None:
+            cls._append = redis_client.register_script(cls.APPEND_SCRIPT)
+
+        entries = [
+            ["u", cls.message_tokens(question_tokens), question],
+            ["a", cls.message_tokens(answer_tokens), answer],
+        ]
+        encoded = [
+            json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+            for entry in entries
+        ]
+        try:
+            await cls._append(
+                keys=[key, f"{key}:tokens"],
+                args=[
+                    settings.CONVERSATION_CONTEXT_TOKENS,
+                    settings.CONVERSATION_MAX_MESSAGES,
+                    settings.CONVERSATION_TTL,
+                ] + encoded,
+                client=redis_client
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка записи истории диалога: {str(e)}")
+
+    @classmethod
+    async def reset(cls, redis_client, key: str):
+        await redis_client.delete(key, f"{key}:tokens")
@@ -0,0 +1,65 @@
+import logging
+import time
+
+import aioredis
+
+from app.core import metrics
+from app.core.config import settings
+from app.db.init_db import has_read_replicas
+
+logger = logging.getLogger(__name__)
+
+
+class DbRoutingService:
+    # После изменения баланса чтения пользователя идут в основную базу,
+    # пока реплики не догонят запись
+    STICKY_KEY_PREFIX = "db_primary_until:"
+    LOCAL_MAX_ENTRIES = 10000
+
+    _redis = None
+    _local = {}
+
+    @classmethod
+    def get_redis(cls):
+        if cls._redis is None:
+            cls._redis = aioredis.from_url(
+                settings.REDIS_URL, decode_responses=True
+            )
+            metrics.track_redis_pool("db_routing", cls._redis)
+        return cls._redis
+
+    @classmethod
+    async def mark_written(cls, user_id: int):
+        if not has_read_replicas():
+            return
+        now = time.monotonic()
+        if len(cls._local) >= cls.LOCAL_MAX_ENTRIES:
+            cls._local = {
+                key: expires_at for key, expires_at in cls._local.items()
+                if expires_at > now
+            }
+        cls._local[user_id] = now + settings.DB_READ_STICKY_SECONDS
+        try:
+            await cls.get_redis().set(
+                cls.STICKY_KEY_PREFIX + str(user_id), 1,
+                ex=settings.DB_READ_STICKY_SECONDS
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка записи привязки к основной базе: {str(e)}")
+
+    @classmethod
+    async def needs_primary(cls, user_id: int) -> bool:
+        expires_at = cls._local.get(user_id)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                return True
+            del cls._local[user_id]
+        try:
+            return bool(
+                await cls.get_redis().exists(
+                    cls.STICKY_KEY_PREFIX + str(user_id)
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка чтения привязки к основной базе: {str(e)}")
+            return True
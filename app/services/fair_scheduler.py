@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.adaptive_limit import AdaptiveLimit
+
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(value: str) -> dict:
+    weights = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        key, weight = item.split(":")
+        weights[key.strip()] = float(weight)
+    return weights
+
+
+class Ticket:
+    def __init__(self, key: str, tag: float, seq: int):
+        self.key = key
+        self.tag = tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + settings.SCHEDULER_MAX_QUEUE_TIME
+        self.future = asyncio.get_running_loop().create_future()
+        self.released = False
+
+    @property
+    def granted(self) -> bool:
+        return self.future.done()
+
+    def position(self) -> int:
+        return FairScheduler.position(self)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        # True - слот получен, False - истек timeout, но не срок ожидания
+        remaining = self.deadline - time.monotonic()
+        if timeout is not None:
+            remaining = min(remaining, timeout)
+        if not self.granted and remaining > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.future), remaining)
+            except asyncio.TimeoutError:
+                pass
+        if self.granted:
+            return True
+        if time.monotonic() >= self.deadline:
+            FairScheduler.record_timeout()
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер перегружен. Пожалуйста, попробуйте позже.",
+                headers={"Retry-After": "5"}
+            )
+        return False
+
+
+class FairScheduler:
+    # Взвешенная справедливая очередь: каждому запросу назначается
+    # виртуальное время окончания max(V, последний тег пользователя) + 1/вес,
+    # освободившийся слот получает запрос с наименьшим тегом. Пользователь
+    # с весом 2 при конкуренции получает вдвое больше слотов, а поток
+    # запросов одного пользователя не вытесняет остальных
+    DEFAULT_KEY = "anonymous"
+
+    _weights = parse_weights(settings.SCHEDULER_USER_WEIGHTS)
+    _sequence = itertools.count()
+    _heap = []
+    _in_flight = 0
+    _virtual_time = 0.0
+    _last_tags = {}
+    _queued = defaultdict(int)
+    _stats = {
+        "granted": 0,
+        "rejected": 0,
+        "timed_out": 0,
+        "wait_seconds": 0.0,
+        "max_wait_seconds": 0.0,
+    }
+
+    @classmethod
+    def weight(cls, key: str) -> float:
+        return cls._weights.get(key, settings.SCHEDULER_DEFAULT_WEIGHT)
+
+    @classmethod
+    def enqueue(cls, key=None) -> Ticket:
+        key = str(key) if key is not None else cls.DEFAULT_KEY
+        if cls._queued[key] >= settings.SCHEDULER_MAX_QUEUED_PER_USER:
+            cls._stats["rejected"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много одновременных запросов. "
+                       "Дождитесь ответа на предыдущие вопросы."
+            )
+
+        tag = max(cls._virtual_time, cls._last_tags.get(key, 0.0)) + (
+            1 / cls.weight(key)
+        )
+        cls._last_tags[key] = tag
+        ticket = Ticket(key, tag, next(cls._sequence))
+        cls._queued[key] += 1
+        heapq.heappush(cls._heap, (tag, ticket.seq, ticket))
+        cls._dispatch()
+        return ticket
+
+    @classmethod
+    def _dispatch(cls):
+        # Число слотов задает AdaptiveLimit, оно сжимается при 429
+        while cls._heap and cls._in_flight < AdaptiveLimit.limit():
+            tag, _, ticket = heapq.heappop(cls._heap)
+            if ticket.released:
+                continue
+            cls._in_flight += 1
+            cls._virtual_time = max(cls._virtual_time, tag)
+            cls._dequeued(ticket)
+
+            waited = time.monotonic() - ticket.enqueued_at
+            metrics.ASK_STAGE_SECONDS.labels("queue_wait").observe(waited)
+            cls._stats["granted"] += 1
+            cls._stats["wait_seconds"] += waited
+            cls._stats["max_wait_seconds"] = max(
+                cls._stats["max_wait_seconds"], waited
+            )
+            ticket.future.set_result(True)
+
+        if len(cls._last_tags) > settings.SCHEDULER_MAX_TRACKED_USERS:
+            # Теги не больше V ничего не меняют, их можно забыть
+            cls._last_tags = {
+                key: tag for key, tag in cls._last_tags.items()
+                if tag > cls._virtual_time
+            }
+
+    @classmethod
+    def _dequeued(cls, ticket: Ticket):
+        cls._queued[ticket.key] -= 1
+        if cls._queued[ticket.key] <= 0:
+            del cls._queued[ticket.key]
+
+    @classmethod
+    def release(cls, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            cls._in_flight -= 1
+        else:
+            ticket.future.cancel()
+            cls._dequeued(ticket)
+        cls._dispatch()
+
+    @classmethod
+    def try_acquire_extra(cls) -> bool:
+        # Слот для дублирующего запроса: берется, только если он свободен
+        # и никто не ждет в очереди, и освобождается через release_extra
+        if cls._queued or cls._in_flight >= AdaptiveLimit.limit():
+            return False
+        cls._in_flight += 1
+        return True
+
+    @classmethod
+    def release_extra(cls):
+        cls._in_flight -= 1
+        cls._dispatch()
+
+    @classmethod
+    def position(cls, ticket: Ticket) -> int:
+        if ticket.granted:
+            return 0
+        return 1 + sum(
+            1 for tag, seq, other in cls._heap
+            if not other.released and (tag, seq) < (ticket.tag, ticket.seq)
+        )
+
+    @classmethod
+    def record_timeout(cls):
+        cls._stats["timed_out"] += 1
+
+    @classmethod
+    @asynccontextmanager
+    async def slot(cls, key=None):
+        ticket = cls.enqueue(key)
+        try:
+            await ticket.wait()
+            yield ticket
+        finally:
+            cls.release(ticket)
+
+    @classmethod
+    def stats(cls) -> dict:
+        granted = cls._stats["granted"]
+        return {
+            "capacity": AdaptiveLimit.limit(),
+            "in_flight": cls._in_flight,
+            "queued": sum(cls._queued.values()),
+            "granted": granted,
+            "rejected": cls._stats["rejected"],
+            "timed_out": cls._stats["timed_out"],
+            "wait_seconds_total": round(cls._stats["wait_seconds"], 3),
+            "avg_wait_ms": round(
+                cls._stats["wait_seconds"] * 1000 / granted, 2
+            ) if granted else 0.0,
+            "max_wait_ms": round(cls._stats["max_wait_seconds"] * 1000, 2),
+        }
@@ -1,11 +1,119 @@
 import os
+import secrets
+import time
 from datetime import datetime, timedelta
+from typing import NamedTuple
+
 from fastapi import HTTPException
 
+from app.core import metrics
+from app.core.config import settings
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: int
+
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_after),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.reset_after)
+        return headers
+
 
 class MessageLimitService:
     daily_message_limit = int(os.getenv('DAILY_MESSAGE_LIMIT', 3))
 
+    POLICY_FIXED_DAY = "fixed_day"
+    POLICY_SLIDING_WINDOW = "sliding_window"
+    POLICY_TOKEN_BUCKET = "token_bucket"
+    POLICY_BURST = "burst"
+
+    DAY = 86400
+    MINUTE = 60
+
+    # KEYS - счетчики окон, ARGV - пары (лимит, время жизни окна в секундах).
+    # Запрос проходит, только если не исчерпано ни одно из окон.
+    FIXED_WINDOWS_SCRIPT = """
+    local remaining, reset = -1, 0
+    for i, key in ipairs(KEYS) do
+        local limit = tonumber(ARGV[i * 2 - 1])
+        local count = tonumber(redis.call('GET', key) or '0')
+        local ttl = redis.call('TTL', key)
+        if ttl < 0 then ttl = tonumber(ARGV[i * 2]) end
+        if count >= limit then
+            return {0, 0, ttl}
+        end
+        local left = limit - count - 1
+        if remaining < 0 or left < remaining then
+            remaining, reset = left, ttl
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        if redis.call('INCR', key) == 1 then
+            redis.call('EXPIRE', key, ARGV[i * 2])
+        end
+    end
+    return {1, remaining, reset}
+    """
+
+    # KEYS[1] - отсортированное множество меток времени запросов,
+    # ARGV - лимит, окно в секундах, уникальный идентификатор запроса
+    SLIDING_WINDOW_SCRIPT = """
+    local now = redis.call('TIME')
+    local now_ms = tonumber(now[1]) * 1000
+        + math.floor(tonumber(now[2]) / 1000)
+    local limit = tonumber(ARGV[1])
+    local window_ms = tonumber(ARGV[2]) * 1000
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now_ms - window_ms)
+    local count = redis.call('ZCARD', KEYS[1])
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    local reset = tonumber(ARGV[2])
+    if oldest[2] then
+        reset = math.ceil((tonumber(oldest[2]) + window_ms - now_ms) / 1000)
+    end
+    if count >= limit then
+        return {0, 0, reset}
+    end
+    redis.call('ZADD', KEYS[1], now_ms, ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], window_ms)
+    return {1, limit - count - 1, reset}
+    """
+
+    # KEYS[1] - хэш с остатком токенов и временем последнего пополнения,
+    # ARGV - емкость ведра и время его полного пополнения в секундах
+    TOKEN_BUCKET_SCRIPT = """
+    local now = redis.call('TIME')
+    local now_s = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local capacity = tonumber(ARGV[1])
+    local rate = capacity / tonumber(ARGV[2])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now_s
+    tokens = math.min(capacity, tokens + (now_s - ts) * rate)
+    if tokens < 1 then
+        redis.call(
+            'HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now_s)
+        )
+        redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+        return {0, 0, math.ceil((1 - tokens) / rate)}
+    end
+    tokens = tokens - 1
+    redis.call(
+        'HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now_s)
+    )
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+    return {1, math.floor(tokens), math.ceil((capacity - tokens) / rate)}
+    """
+
+    _scripts = {}
+
     @classmethod
     def get_message_limit_text(cls, limit):
         if limit % 10 == 1 and limit % 100 != 11:
@@ -16,22 +124,84 @@ class MessageLimitService:
             return f"Лимит в {limit} вопросов на день."
 
     @classmethod
-    async def check_and_increment_question_count(cls, redis_client, user_id):
-        today = datetime.now().strftime('%Y-%m-%d')
-        key = f"{user_id}:{today}"
+    def _get_script(cls, redis_client, source: str):
+        script = cls._scripts.get((id(redis_client), source))
+        if script is None:
+            script = redis_client.register_script(source)
+            cls._scripts[(id(redis_client), source)] = script
+        return script
+
+    @classmethod
+    def _fixed_window_key(cls, user_id, window: int) -> str:
+        # Дневной счетчик, как и раньше, сбрасывается в полночь
+        # по местному времени сервера и хранится под прежним ключом
+        if window == cls.DAY:
+            return f"{user_id}:{datetime.now().strftime('%Y-%m-%d')}"
+        return f"rate:{user_id}:{window}:{int(time.time()) // window}"
 
-        question_count = await redis_client.get(key)
-        if question_count is None:
-            await redis_client.set(key, 0, ex=timedelta(days=1))
-            question_count = 0
+    @classmethod
+    def _fixed_window_ttl(cls, window: int) -> int:
+        if window == cls.DAY:
+            now = datetime.now()
+            midnight = now.replace(
+                hour=0, minute=0, second=0, microsecond=0
+            ) + timedelta(days=1)
+            return max(1, int((midnight - now).total_seconds()))
+        return window - int(time.time()) % window
+
+    @classmethod
+    async def _check_fixed_windows(cls, redis_client, user_id, windows):
+        keys, args = [], []
+        for limit, window in windows:
+            keys.append(cls._fixed_window_key(user_id, window))
+            args.extend([limit, cls._fixed_window_ttl(window)])
+        script = cls._get_script(redis_client, cls.FIXED_WINDOWS_SCRIPT)
+        return await script(keys=keys, args=args)
+
+    @classmethod
+    async def check_question_count(cls, redis_client, user_id):
+        policy = settings.RATE_LIMIT_POLICY
+        limit = cls.daily_message_limit
+
+        if policy == cls.POLICY_SLIDING_WINDOW:
+            script = cls._get_script(redis_client, cls.SLIDING_WINDOW_SCRIPT)
+            allowed, remaining, reset_after = await script(
+                keys=[f"rate:{user_id}:sliding"],
+                args=[limit, settings.RATE_LIMIT_WINDOW, secrets.token_hex(8)]
+            )
+        elif policy == cls.POLICY_TOKEN_BUCKET:
+            script = cls._get_script(redis_client, cls.TOKEN_BUCKET_SCRIPT)
+            allowed, remaining, reset_after = await script(
+                keys=[f"rate:{user_id}:bucket"],
+                args=[limit, settings.RATE_LIMIT_WINDOW]
+            )
+        elif policy == cls.POLICY_BURST:
+            allowed, remaining, reset_after = await cls._check_fixed_windows(
+                redis_client, user_id,
+                [(settings.RATE_LIMIT_BURST_PER_MINUTE, cls.MINUTE),
+                 (limit, cls.DAY)]
+            )
         else:
-            question_count = int(question_count)
+            allowed, remaining, reset_after = await cls._check_fixed_windows(
+                redis_client, user_id, [(limit, cls.DAY)]
+            )
+
+        return RateLimitResult(
+            bool(allowed), limit, int(remaining), int(reset_after)
+        )
 
-        if question_count >= cls.daily_message_limit:
+    @classmethod
+    async def check_and_increment_question_count(cls, redis_client, user_id):
+        with metrics.stage("rate_limit"):
+            result = await cls.check_question_count(redis_client, user_id)
+        metrics.RATE_LIMIT_CHECKS.labels(
+            "allowed" if result.allowed else "rejected"
+        ).inc()
+        if not result.allowed:
             limit_message = cls.get_message_limit_text(cls.daily_message_limit)
             raise HTTPException(
                 status_code=451,
-                detail=f"Ошибка 451: Превышен {limit_message}."
+                detail=f"Ошибка 451: Превышен {limit_message}.",
+                headers=result.headers()
             )
-
-        await redis_client.incr(key)
+        return result
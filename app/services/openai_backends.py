@@ -0,0 +1,311 @@
+import email.utils
+import json
+import math
+import random
+import time
+from collections import deque
+from typing import List, Optional
+
+import httpx
+from fastapi import HTTPException
+from openai import (
+    APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
+)
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.adaptive_limit import AdaptiveLimit
+from app.services.circuit_breaker import CircuitBreaker
+
+# Сколько замеров нужно, чтобы считать по ним процентиль задержки
+MIN_LATENCY_SAMPLES = 20
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def is_retryable(error: BaseException) -> bool:
+    # Перегрузка и сбои бэкенда - повод попробовать другой
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def is_overload(error: BaseException) -> bool:
+    # Сигнал сократить число одновременных запросов
+    if isinstance(error, APITimeoutError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code == 429
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    # 429 означает, что бэкенд жив, но просит сбавить темп
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(value)
+            return max(0.0, date.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LatencyWindow:
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = MIN_LATENCY_SAMPLES):
+        if not self.samples or len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def median(self) -> Optional[float]:
+        # Медиана не дает редким долгим ответам увести трафик с бэкенда
+        return self.percentile(0.5, min_samples=1)
+
+
+class Backend:
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        weight: float = 1.0,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None
+    ):
+        self.name = name
+        self.model = model
+        self.weight = weight
+        self.base_url = base_url
+        self.api_key = api_key
+        self.breaker = CircuitBreaker(
+            settings.OPENAI_BREAKER_FAILURES,
+            settings.OPENAI_BREAKER_RESET_TIMEOUT
+        )
+        self.latency = {}
+        self.stats = {"requests": 0, "errors": 0, "hedges": 0, "wins": 0}
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                http2=settings.OPENAI_HTTP2 and http2_available(),
+                limits=httpx.Limits(
+                    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=(
+                        settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS
+                    ),
+                    keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    settings.OPENAI_TIMEOUT,
+                    connect=settings.OPENAI_CONNECT_TIMEOUT
+                ),
+            )
+            # Повторы делает BackendRouter, уже на другом бэкенде
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0
+            )
+        return self._client
+
+    def window(self, kind: str) -> LatencyWindow:
+        if kind not in self.latency:
+            self.latency[kind] = LatencyWindow(settings.OPENAI_LATENCY_WINDOW)
+        return self.latency[kind]
+
+    def score(self, kind: str) -> float:
+        # Бэкенд без замеров считается быстрым, чтобы получить трафик
+        latency = self.window(kind).median() or 0.0
+        return self.weight / max(latency, settings.OPENAI_HEDGE_MIN_DELAY)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+
+
+def parse_backends(value: str, api_key: Optional[str]) -> List[Backend]:
+    if not value.strip():
+        return [Backend("default", settings.OPENAI_MODEL, api_key=api_key)]
+    return [
+        Backend(
+            name=item.get("name") or f"backend-{number}",
+            model=item.get("model") or settings.OPENAI_MODEL,
+            weight=float(item.get("weight", 1.0)),
+            base_url=item.get("base_url"),
+            api_key=item.get("api_key") or api_key,
+        )
+        for number, item in enumerate(json.loads(value))
+    ]
+
+
+class BackendRouter:
+    # Выбор бэкенда взвешенный, вероятность пропорциональна
+    # вес / медиана задержки; бэкенд с открытым предохранителем
+    # (OPENAI_BREAKER_FAILURES сбоев 5xx или соединения подряд)
+    # не выбирается, пока не пройдет пробный запрос
+    _backends: Optional[List[Backend]] = None
+
+    @classmethod
+    def backends(cls) -> List[Backend]:
+        if cls._backends is None:
+            cls._backends = parse_backends(
+                settings.OPENAI_BACKENDS, settings.OPENAI_API_KEY
+            )
+        return cls._backends
+
+    @classmethod
+    def unavailable_error(cls) -> Optional[HTTPException]:
+        backends = cls.backends()
+        if any(backend.breaker.available() for backend in backends):
+            return None
+        retry_after = min(b.breaker.retry_after() for b in backends)
+        return HTTPException(
+            status_code=503,
+            detail="Ошибка 503: Сервис OpenAI временно недоступен. "
+                   "Пожалуйста, попробуйте позже.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    @classmethod
+    def shared_model(cls) -> Optional[str]:
+        # Модель, общая для всех бэкендов; None, если модели разные и
+        # заранее неизвестно, какая из них ответит на вопрос
+        models = {backend.model for backend in cls.backends()}
+        return models.pop() if len(models) == 1 else None
+
+    @classmethod
+    def ensure_available(cls):
+        # Когда все предохранители открыты, запрос не занимает очередь
+        error = cls.unavailable_error()
+        if error is not None:
+            raise error
+
+    @classmethod
+    def choose(cls, kind: str, exclude=()) -> Backend:
+        available = [b for b in cls.backends() if b.breaker.available()]
+        if not available:
+            raise cls.unavailable_error()
+        candidates = [b for b in available if b not in exclude] or available
+        return cls._take(kind, candidates)
+
+    @classmethod
+    def choose_hedge(cls, kind: str, exclude=()) -> Optional[Backend]:
+        # Дублировать запрос на тот же бэкенд бессмысленно: это удваивает
+        # стоимость и нагрузку, не обходя медленный бэкенд
+        candidates = [
+            b for b in cls.backends()
+            if b.breaker.available() and b not in exclude
+        ]
+        if not candidates:
+            return None
+        return cls._take(kind, candidates)
+
+    @staticmethod
+    def _take(kind: str, candidates: List[Backend]) -> Backend:
+        backend = random.choices(
+            candidates, weights=[b.score(kind) for b in candidates]
+        )[0]
+        backend.breaker.on_attempt()
+        return backend
+
+    @classmethod
+    def hedge_delay(cls, kind: str, backend: Backend) -> float:
+        delay = backend.window(kind).percentile(
+            settings.OPENAI_HEDGE_PERCENTILE
+        )
+        if delay is None:
+            delay = settings.OPENAI_HEDGE_INITIAL_DELAY
+        return max(delay, settings.OPENAI_HEDGE_MIN_DELAY)
+
+    @staticmethod
+    def retry_delay(error: BaseException, retry: int) -> Optional[float]:
+        # Пауза перед повтором на том же бэкенде: Retry-After бэкенда или
+        # экспоненциальная с полным джиттером. None - повторять не стоит,
+        # бэкенд просит ждать дольше OPENAI_RETRY_MAX_DELAY
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            if retry_after > settings.OPENAI_RETRY_MAX_DELAY:
+                return None
+            return retry_after
+        return random.uniform(0, min(
+            settings.OPENAI_RETRY_MAX_DELAY,
+            settings.OPENAI_RETRY_BASE_DELAY * 2 ** retry
+        ))
+
+    @staticmethod
+    def record_success(backend: Backend, kind: str, seconds: float):
+        backend.window(kind).record(seconds)
+        backend.stats["wins"] += 1
+        metrics.OPENAI_REQUESTS.labels(backend.name, "success").inc()
+        metrics.OPENAI_REQUEST_SECONDS.labels(backend.name, kind).observe(
+            seconds
+        )
+        backend.breaker.on_success()
+        AdaptiveLimit.on_success()
+
+    @staticmethod
+    def record_failure(backend: Backend, error: BaseException):
+        backend.stats["errors"] += 1
+        metrics.OPENAI_REQUESTS.labels(backend.name, "error").inc()
+        if is_overload(error):
+            AdaptiveLimit.on_overload()
+        if is_backend_failure(error):
+            backend.breaker.on_failure()
+        else:
+            backend.breaker.on_cancel()
+
+    @staticmethod
+    def record_cancel(backend: Backend):
+        metrics.OPENAI_REQUESTS.labels(backend.name, "cancelled").inc()
+        backend.breaker.on_cancel()
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            backend.name: {
+                **backend.stats,
+                "model": backend.model,
+                "breaker": backend.breaker.stats(),
+                "latency_p50_ms": {
+                    kind: round(window.median() * 1000, 1)
+                    for kind, window in backend.latency.items()
+                    if window.samples
+                },
+            }
+            for backend in cls.backends()
+        }
+
+    @classmethod
+    async def close(cls):
+        for backend in cls._backends or []:
+            await backend.close()
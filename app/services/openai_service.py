@@ -1,43 +1,279 @@
-import os
-from openai import AsyncOpenAI, APIError
+import asyncio
+import math
+import time
+from typing import NamedTuple, Optional
+
+from openai import APIError
 from fastapi import HTTPException
 
+from app.core import metrics, tracing
+from app.core.config import settings
+from app.services.adaptive_limit import AdaptiveLimit
+from app.services.fair_scheduler import FairScheduler
+from app.services.openai_backends import (
+    BackendRouter, is_retryable, retry_after_seconds
+)
+
+
+class ChatAnswer(NamedTuple):
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    queue_position: Optional[int] = None
+    # Модель бэкенда, который дал ответ
+    model: Optional[str] = None
+
 
 class OpenAIService:
-    api_key = os.getenv('OPENAI_API_KEY')
+    @classmethod
+    async def close(cls):
+        await BackendRouter.close()
 
     @classmethod
-    async def ask_question(cls, question: str):
-        try:
-            client = AsyncOpenAI(api_key=cls.api_key)
-            chat_completion = await client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": question,
-                    }
-                ],
-                model="gpt-3.5-turbo",
-            )
-            return chat_completion.choices[0].message.content
-        except APIError as e:
+    def status(cls) -> dict:
+        return {
+            "concurrency": AdaptiveLimit.stats(),
+            "scheduler": FairScheduler.stats(),
+            "backends": BackendRouter.stats(),
+        }
+
+    @classmethod
+    def _handle_error(cls, e: Exception):
+        if isinstance(e, APIError):
             if e.code == 'rate_limit_exceeded':
-                raise HTTPException(
+                retry_after = retry_after_seconds(e)
+                return HTTPException(
                     status_code=429,
-                    detail="Превышен лимит запросов к API OpenAI."
+                    detail="Превышен лимит запросов к API OpenAI.",
+                    headers={
+                        "Retry-After": str(math.ceil(retry_after))
+                    } if retry_after is not None else None
                 )
             elif e.code == 'unsupported_country_region_territory':
-                raise HTTPException(
+                return HTTPException(
                     status_code=403,
                     detail="Ошибка 403: Ваш регион не поддерживается."
                 )
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Произошла ошибка при получении ответа: {str(e)}"
+        return HTTPException(
+            status_code=500,
+            detail=f"Произошла ошибка при получении ответа: {str(e)}"
+        )
+
+    @staticmethod
+    def build_messages(question: str, history=None) -> list:
+        return list(history or []) + [
+            {
+                "role": "user",
+                "content": question,
+            }
+        ]
+
+    @classmethod
+    async def _race(cls, kind: str, attempt, discard=None):
+        # Запрос уходит на выбранный бэкенд; если ответа нет дольше
+        # процентиля его задержки, параллельно запускается вторая попытка,
+        # и выигравший ответ отменяет остальные. Ошибки 5xx, 429 и обрывы
+        # соединения переводят запрос на следующий бэкенд, а повтор на том
+        # же бэкенде ждет паузу из BackendRouter.retry_delay. Дублирующая
+        # попытка идет только на другой бэкенд и занимает свой слот
+        # FairScheduler, поэтому не обходит лимит параллельности
+        attempts = {}
+        tried = []
+        hedged = not settings.OPENAI_HEDGE_ENABLED
+
+        def launch(backend=None, hedge=False):
+            backend = backend or BackendRouter.choose(kind, exclude=tried)
+            backend.stats["requests"] += 1
+            tried.append(backend)
+            task = asyncio.ensure_future(tracing.traced(
+                f"openai {kind}",
+                attempt(backend),
+                {
+                    "openai.backend": backend.name,
+                    "openai.model": backend.model,
+                    "openai.attempt": len(tried),
+                },
+                tracing.SpanKind.CLIENT
+            ))
+            attempts[task] = (backend, time.monotonic(), hedge)
+            return backend
+
+        def start_hedge():
+            if not FairScheduler.try_acquire_extra():
+                return
+            backend = BackendRouter.choose_hedge(kind, exclude=tried)
+            if backend is None:
+                FairScheduler.release_extra()
+                return
+            launch(backend, hedge=True).stats["hedges"] += 1
+
+        first = launch()
+        hedge_at = time.monotonic() + BackendRouter.hedge_delay(kind, first)
+        last_error = None
+        try:
+            while attempts:
+                timeout = None
+                if not hedged and len(tried) < settings.OPENAI_MAX_ATTEMPTS:
+                    timeout = max(hedge_at - time.monotonic(), 0)
+                done, _ = await asyncio.wait(
+                    attempts, timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
                 )
+                if not done:
+                    hedged = True
+                    start_hedge()
+                    continue
+
+                for task in done:
+                    backend, started_at, extra = attempts.pop(task)
+                    if extra:
+                        FairScheduler.release_extra()
+                    error = task.exception()
+                    if error is None:
+                        BackendRouter.record_success(
+                            backend, kind, time.monotonic() - started_at
+                        )
+                        return task.result()
+                    BackendRouter.record_failure(backend, error)
+                    last_error = error
+                    if not is_retryable(error):
+                        raise error
+
+                if not attempts and len(tried) < settings.OPENAI_MAX_ATTEMPTS:
+                    delay = BackendRouter.retry_delay(
+                        last_error, len(tried) - 1
+                    )
+                    if delay is None:
+                        raise last_error
+                    backend = BackendRouter.choose(kind, exclude=tried)
+                    if backend in tried:
+                        await asyncio.sleep(delay)
+                    launch(backend)
+                    hedge_at = time.monotonic() + (
+                        BackendRouter.hedge_delay(kind, backend)
+                    )
+            raise last_error
+        finally:
+            for task, (backend, _, extra) in attempts.items():
+                task.cancel()
+                BackendRouter.record_cancel(backend)
+                if extra:
+                    FairScheduler.release_extra()
+            results = await asyncio.gather(*attempts, return_exceptions=True)
+            if discard is not None:
+                # Проигравшая попытка могла успеть открыть поток
+                for result in results:
+                    if not isinstance(result, BaseException):
+                        await discard(result)
+
+    @classmethod
+    async def ask_question(
+        cls, question: str, user_id=None, history=None
+    ):
+        messages = cls.build_messages(question, history)
+
+        async def complete(backend):
+            completion = await backend.client.chat.completions.create(
+                messages=messages,
+                model=backend.model,
+            )
+            return backend.model, completion
+
+        try:
+            BackendRouter.ensure_available()
+            async with FairScheduler.slot(user_id):
+                with metrics.stage("upstream"):
+                    model, chat_completion = await cls._race(
+                        "complete", complete
+                    )
+            usage = chat_completion.usage
+            cls._record_usage(usage)
+            return ChatAnswer(
+                chat_completion.choices[0].message.content,
+                usage.prompt_tokens if usage else None,
+                usage.completion_tokens if usage else None,
+                model=model,
+            )
+        except HTTPException:
+            raise
         except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Произошла ошибка при получении ответа: {str(e)}"
+            raise cls._handle_error(e)
+
+    @staticmethod
+    def _record_usage(usage):
+        if usage:
+            metrics.OPENAI_TOKENS.labels("prompt").inc(usage.prompt_tokens)
+            metrics.OPENAI_TOKENS.labels("completion").inc(
+                usage.completion_tokens
+            )
+
+    @classmethod
+    def _chunk_answers(cls, chunk):
+        if chunk.usage:
+            cls._record_usage(chunk.usage)
+            yield ChatAnswer(
+                "",
+                chunk.usage.prompt_tokens,
+                chunk.usage.completion_tokens,
+            )
+        if chunk.choices:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield ChatAnswer(delta)
+
+    @classmethod
+    async def stream_question(
+        cls, question: str, user_id=None, history=None
+    ):
+        messages = cls.build_messages(question, history)
+
+        async def open_stream(backend):
+            # Попытка выигрывает, когда приходит первая часть ответа
+            stream = await backend.client.chat.completions.create(
+                messages=messages,
+                model=backend.model,
+                stream=True,
+                stream_options={"include_usage": True},
             )
+            try:
+                async for chunk in stream:
+                    return stream, chunk, backend.model
+            except BaseException:
+                await stream.close()
+                raise
+            return stream, None, backend.model
+
+        async def close_stream(opened):
+            await opened[0].close()
+
+        BackendRouter.ensure_available()
+        ticket = FairScheduler.enqueue(user_id)
+        try:
+            # Пока запрос ждет слота, клиенту отдается его место в очереди
+            while not await ticket.wait(settings.SCHEDULER_POSITION_INTERVAL):
+                yield ChatAnswer("", queue_position=ticket.position())
+
+            started = time.perf_counter()
+            with metrics.stage("upstream_first_chunk"):
+                stream, first_chunk, model = await cls._race(
+                    "stream", open_stream, discard=close_stream
+                )
+            yield ChatAnswer("", model=model)
+            try:
+                if first_chunk is not None:
+                    for answer in cls._chunk_answers(first_chunk):
+                        yield answer
+                async for chunk in stream:
+                    for answer in cls._chunk_answers(chunk):
+                        yield answer
+                metrics.ASK_STAGE_SECONDS.labels("upstream_stream").observe(
+                    time.perf_counter() - started
+                )
+            finally:
+                await stream.close()
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise cls._handle_error(e)
+        finally:
+            FairScheduler.release(ticket)
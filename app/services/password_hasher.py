@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasher:
+    # Хеши с другим числом раундов считаются устаревшими и
+    # пересчитываются при следующем входе пользователя
+    pwd_context = CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS
+    )
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _pending = 0
+    _stats = {
+        "completed": 0,
+        "rejected": 0,
+        "rehashed": 0,
+        "max_pending": 0,
+        "wait_seconds": 0.0,
+        "hash_seconds": 0.0,
+    }
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        # bcrypt отпускает GIL, поэтому пула потоков достаточно
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="password-hash"
+            )
+        return cls._executor
+
+    @classmethod
+    async def _run(cls, func, *args):
+        limit = (
+            settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE
+        )
+        if cls._pending >= limit:
+            cls._stats["rejected"] += 1
+            logger.warning(
+                f"Очередь хеширования паролей переполнена: {cls._pending}"
+            )
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер перегружен. Пожалуйста, попробуйте позже.",
+                headers={"Retry-After": "1"}
+            )
+
+        def timed_call(submitted_at: float):
+            started_at = time.perf_counter()
+            result = func(*args)
+            return result, started_at - submitted_at, (
+                time.perf_counter() - started_at
+            )
+
+        cls._pending += 1
+        cls._stats["max_pending"] = max(
+            cls._stats["max_pending"], cls._pending
+        )
+        try:
+            loop = asyncio.get_running_loop()
+            result, waited, elapsed = await loop.run_in_executor(
+                cls.get_executor(), timed_call, time.perf_counter()
+            )
+        finally:
+            cls._pending -= 1
+
+        cls._stats["completed"] += 1
+        cls._stats["wait_seconds"] += waited
+        cls._stats["hash_seconds"] += elapsed
+        return result
+
+    @classmethod
+    async def hash(cls, password: str) -> str:
+        return await cls._run(cls.pwd_context.hash, password)
+
+    @classmethod
+    async def verify_and_update(
+        cls,
+        password: str,
+        hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        valid, new_hash = await cls._run(
+            cls.pwd_context.verify_and_update, password, hashed_password
+        )
+        if new_hash is not None:
+            cls._stats["rehashed"] += 1
+        return valid, new_hash
+
+    @classmethod
+    def stats(cls) -> dict:
+        completed = cls._stats["completed"]
+        return {
+            "workers": settings.PASSWORD_HASH_WORKERS,
+            "pending": cls._pending,
+            "queued": max(0, cls._pending - settings.PASSWORD_HASH_WORKERS),
+            "completed": completed,
+            "rejected": cls._stats["rejected"],
+            "rehashed": cls._stats["rehashed"],
+            "max_pending": cls._stats["max_pending"],
+            "avg_wait_ms": round(
+                cls._stats["wait_seconds"] * 1000 / completed, 2
+            ) if completed else 0.0,
+            "avg_hash_ms": round(
+                cls._stats["hash_seconds"] * 1000 / completed, 2
+            ) if completed else 0.0,
+        }
+
+    @classmethod
+    def close(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
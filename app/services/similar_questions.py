@@ -0,0 +1,216 @@
+import asyncio
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+WORD_PATTERN = re.compile(r"\w+")
+NEGATIONS = {"не", "ни", "нет", "not", "no"}
+
+
+class MinHashIndex:
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 3,
+        max_entries: int = 10000,
+        ttl: float = 86400,
+        compact_interval: float = 300,
+        seed: int = 1
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands без остатка")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.compact_interval = compact_interval
+
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randint(1, MERSENNE_PRIME - 1),
+             rng.randint(0, MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+        self._entries = OrderedDict()
+        self._buckets = [{} for _ in range(bands)]
+        self._last_compaction = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def shingles(self, text: str) -> set:
+        normalized = " ".join(text.casefold().split())
+        size = self.shingle_size
+        if len(normalized) <= size:
+            return {normalized}
+        return {
+            normalized[i:i + size]
+            for i in range(len(normalized) - size + 1)
+        }
+
+    @staticmethod
+    def guard(text: str) -> Tuple[Tuple[str, ...], ...]:
+        # Триграммы почти не различают "2 часа" и "20 часов" или "работает"
+        # и "не работает", поэтому числа и отрицания с отрицаемым словом
+        # должны совпасть точно
+        words = WORD_PATTERN.findall(text.casefold())
+        numbers = tuple(word for word in words if word.isdigit())
+        negations = tuple(
+            " ".join(words[i:i + 2])
+            for i, word in enumerate(words) if word in NEGATIONS
+        )
+        return numbers, negations
+
+    def fingerprint(self, text: str) -> tuple:
+        return self.signature(text), self.guard(text)
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = [
+            zlib.crc32(shingle.encode("utf-8"))
+            for shingle in self.shingles(text)
+        ]
+        return tuple(
+            min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_chunks(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, signature[start:start + self.rows]
+
+    def add(self, key: str, text: str):
+        if key in self._entries:
+            self.remove(key)
+        signature, guard = self.fingerprint(text)
+        self._entries[key] = (
+            signature, guard, time.monotonic() + self.ttl
+        )
+        for band, chunk in self._band_chunks(signature):
+            self._buckets[band].setdefault(chunk, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+        self._maybe_compact()
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band, chunk in self._band_chunks(entry[0]):
+            bucket = self._buckets[band].get(chunk)
+            if bucket is None:
+                continue
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band][chunk]
+
+    def query(
+        self, text: str, threshold: float
+    ) -> Tuple[Optional[str], float]:
+        signature, guard = self.fingerprint(text)
+        candidates = set()
+        for band, chunk in self._band_chunks(signature):
+            candidates.update(self._buckets[band].get(chunk, ()))
+
+        now = time.monotonic()
+        best_key, best_similarity = None, 0.0
+        for key in candidates:
+            entry_signature, entry_guard, expires_at = self._entries[key]
+            if expires_at <= now or entry_guard != guard:
+                continue
+            matches = sum(
+                a == b for a, b in zip(signature, entry_signature)
+            )
+            similarity = matches / self.num_perm
+            if similarity > best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_key is None or best_similarity < threshold:
+            return None, best_similarity
+        self._entries.move_to_end(best_key)
+        return best_key, best_similarity
+
+    def _maybe_compact(self):
+        if time.monotonic() - self._last_compaction >= self.compact_interval:
+            self.compact()
+
+    def compact(self):
+        now = time.monotonic()
+        expired = [
+            key for key, (*_, expires_at) in self._entries.items()
+            if expires_at <= now
+        ]
+        for key in expired:
+            self.remove(key)
+        # Словари Python не уменьшаются при удалении, пересобираем корзины
+        self._buckets = [dict(bucket) for bucket in self._buckets]
+        self._last_compaction = now
+        return len(expired)
+
+
+class SimilarQuestionService:
+    # Ключи кэша содержат модель, и индекс у каждой модели свой, чтобы
+    # похожий вопрос не получил ответ другой модели
+    _indexes: Dict[str, MinHashIndex] = {}
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def get_index(cls, model: str) -> MinHashIndex:
+        index = cls._indexes.get(model)
+        if index is None:
+            index = cls._indexes[model] = MinHashIndex(
+                num_perm=settings.SIMILAR_CACHE_NUM_PERM,
+                bands=settings.SIMILAR_CACHE_BANDS,
+                max_entries=settings.SIMILAR_CACHE_MAX_ENTRIES,
+                ttl=settings.ANSWER_CACHE_TTL,
+                compact_interval=settings.SIMILAR_CACHE_COMPACT_INTERVAL
+            )
+        return index
+
+    @classmethod
+    async def _run(cls, function, *args):
+        # Подпись MinHash считается в чистом Python: на вопросе в 1000
+        # символов это десятки миллисекунд. Поиск и добавление целиком
+        # идут в одном потоке, поэтому индекс меняется только в нем, а
+        # цикл событий ждет GIL не дольше интервала переключения потоков
+        # (5 мс), а не все время подсчета
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="similar-questions"
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            cls._executor, function, *args
+        )
+
+    @classmethod
+    async def find_key(cls, question: str, model: str) -> Optional[str]:
+        if not settings.SIMILAR_CACHE_ENABLED:
+            return None
+        key, _ = await cls._run(
+            cls.get_index(model).query,
+            question, settings.SIMILAR_CACHE_THRESHOLD
+        )
+        return key
+
+    @classmethod
+    async def remember(cls, key: str, question: str, model: str):
+        if settings.SIMILAR_CACHE_ENABLED:
+            await cls._run(cls.get_index(model).add, key, question)
+
+    @classmethod
+    async def forget(cls, key: str, model: str):
+        index = cls._indexes.get(model)
+        if index is not None:
+            await cls._run(index.remove, key)
@@ -0,0 +1,478 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+import aioredis
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import TokenLedgerEntry, User
+
+logger = logging.getLogger(__name__)
+
+
+class TokenLedgerService:
+    STREAM_KEY = "token_ledger"
+    GROUP_NAME = "token_ledger_flusher"
+    BALANCE_KEY_PREFIX = "token_balance:"
+    # Сумма изменений каждого пользователя, которые еще лежат в потоке
+    PENDING_KEY = "token_ledger:pending"
+    # Записи удаленных пользователей, которые нельзя записать в базу
+    DEAD_STREAM_KEY = "token_ledger:dead"
+
+    STATUS_NOT_LOADED = 0
+    STATUS_INSUFFICIENT = 1
+    STATUS_APPLIED = 2
+
+    # KEYS[1] - баланс пользователя, KEYS[2] - поток журнала, KEYS[3] -
+    # суммы необработанных изменений, ARGV - изменение баланса,
+    # id пользователя, id записи журнала, время жизни баланса
+    APPLY_DELTA_SCRIPT = """
+    local balance = redis.call('GET', KEYS[1])
+    if not balance then
+        return {0}
+    end
+    local delta = tonumber(ARGV[1])
+    local new_balance = tonumber(balance) + delta
+    if new_balance < 0 then
+        return {1}
+    end
+    if delta ~= 0 then
+        redis.call('SET', KEYS[1], new_balance, 'EX', ARGV[4])
+        redis.call(
+            'XADD', KEYS[2], '*',
+            'entry_id', ARGV[3], 'user_id', ARGV[2], 'delta', ARGV[1],
+            'pending', 1
+        )
+        redis.call('HINCRBY', KEYS[3], ARGV[2], delta)
+    end
+    return {2, new_balance}
+    """
+
+    # KEYS[1] - поток журнала, KEYS[2] - суммы необработанных изменений,
+    # ARGV[1] - группа, далее четверки: id записи, id пользователя,
+    # изменение, учтена ли запись в суммах. Запись вычитается из суммы
+    # только тем, кто удалил ее из потока
+    ACKNOWLEDGE_SCRIPT = """
+    for i = 2, #ARGV, 4 do
+        redis.call('XACK', KEYS[1], ARGV[1], ARGV[i])
+        if redis.call('XDEL', KEYS[1], ARGV[i]) == 1
+            and ARGV[i + 3] == '1' then
+            local left = redis.call(
+                'HINCRBY', KEYS[2], ARGV[i + 1], -tonumber(ARGV[i + 2])
+            )
+            if left == 0 then
+                redis.call('HDEL', KEYS[2], ARGV[i + 1])
+            end
+        end
+    end
+    """
+
+    # KEYS[1] - суммы необработанных изменений, ARGV[1] - префикс ключей
+    # баланса, далее пары: id пользователя, баланс в базе. Баланс
+    # пользователя без необработанных изменений должен совпадать с базой;
+    # возвращается расхождение по каждой паре
+    RECONCILE_SCRIPT = """
+    local drifts = {}
+    for i = 2, #ARGV, 2 do
+        local drift = 0
+        local key = ARGV[1] .. ARGV[i]
+        if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 0 then
+            local balance = redis.call('GET', key)
+            if balance and tonumber(balance) ~= tonumber(ARGV[i + 1]) then
+                drift = tonumber(ARGV[i + 1]) - tonumber(balance)
+                redis.call('SET', key, ARGV[i + 1], 'KEEPTTL')
+            end
+        end
+        drifts[#drifts + 1] = drift
+    end
+    return drifts
+    """
+
+    consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+
+    _redis = None
+    _script = None
+    _acknowledge_script = None
+    _reconcile_script = None
+    _task: Optional[asyncio.Task] = None
+    _pending_invalidations = set()
+
+    @classmethod
+    def get_redis(cls):
+        if cls._redis is None:
+            cls._redis = aioredis.from_url(
+                settings.REDIS_URL, decode_responses=True
+            )
+            metrics.track_redis_pool("token_ledger", cls._redis)
+            cls._script = cls._redis.register_script(cls.APPLY_DELTA_SCRIPT)
+            cls._acknowledge_script = cls._redis.register_script(
+                cls.ACKNOWLEDGE_SCRIPT
+            )
+            cls._reconcile_script = cls._redis.register_script(
+                cls.RECONCILE_SCRIPT
+            )
+        return cls._redis
+
+    @classmethod
+    def balance_key(cls, user_id: int) -> str:
+        return f"{cls.BALANCE_KEY_PREFIX}{user_id}"
+
+    @classmethod
+    async def _load_balance(cls, user_id: int, db: AsyncSession) -> bool:
+        # Блокировка строки не дает записать журнал, пока читаются баланс
+        # и записанные записи. Записи из потока, которых еще нет в базе,
+        # добавляются к балансу; записанные, но еще не подтвержденные
+        # уже входят в users.tokens и второй раз не считаются
+        result = await db.execute(
+            select(User.tokens).where(User.id == user_id).with_for_update()
+        )
+        tokens = result.scalar_one_or_none()
+        if tokens is None:
+            await db.commit()
+            return False
+        redis_client = cls.get_redis()
+        unsaved = {
+            fields["entry_id"]: int(fields["delta"])
+            for _, fields in await redis_client.xrange(cls.STREAM_KEY)
+            if fields.get("user_id") == str(user_id)
+        }
+        if unsaved:
+            saved = await db.execute(
+                select(TokenLedgerEntry.entry_id)
+                .where(TokenLedgerEntry.entry_id.in_(list(unsaved)))
+            )
+            for entry_id in saved.scalars():
+                del unsaved[entry_id]
+        await redis_client.set(
+            cls.balance_key(user_id), tokens + sum(unsaved.values()),
+            nx=True, ex=settings.TOKEN_LEDGER_BALANCE_TTL
+        )
+        await db.commit()
+        return True
+
+    @classmethod
+    async def apply_delta(
+        cls,
+        user_id: int,
+        delta: int,
+        db: AsyncSession
+    ) -> Optional[int]:
+        cls.get_redis()
+        keys = [cls.balance_key(user_id), cls.STREAM_KEY, cls.PENDING_KEY]
+        args = [
+            delta, user_id, uuid.uuid4().hex,
+            settings.TOKEN_LEDGER_BALANCE_TTL
+        ]
+
+        result = await cls._script(keys=keys, args=args)
+        if result[0] == cls.STATUS_NOT_LOADED:
+            if not await cls._load_balance(user_id, db):
+                return None
+            result = await cls._script(keys=keys, args=args)
+
+        if result[0] != cls.STATUS_APPLIED:
+            return None
+        return int(result[1])
+
+    @classmethod
+    async def get_balance(cls, user_id: int) -> Optional[int]:
+        balance = await cls.get_redis().get(cls.balance_key(user_id))
+        return int(balance) if balance is not None else None
+
+    @classmethod
+    async def invalidate(cls, *user_ids: int):
+        # Для записей users.tokens в обход журнала (пополнение баланса):
+        # следующее списание загрузит баланс из базы заново
+        if not settings.TOKEN_LEDGER_ENABLED or not user_ids:
+            return
+        try:
+            await cls.get_redis().delete(
+                *(cls.balance_key(user_id) for user_id in user_ids)
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка сброса баланса в Redis: {str(e)}")
+
+    @classmethod
+    def schedule_invalidate(cls, user_ids):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(cls.invalidate(*user_ids))
+        cls._pending_invalidations.add(task)
+        task.add_done_callback(cls._pending_invalidations.discard)
+
+    @classmethod
+    async def reconcile(cls, user_ids) -> int:
+        if not user_ids:
+            return 0
+        cls.get_redis()
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                # Блокировка строк не дает другому процессу записать
+                # журнал между чтением баланса из базы и сверкой
+                result = await db.execute(
+                    select(User.id, User.tokens)
+                    .where(User.id.in_(sorted(user_ids)))
+                    .order_by(User.id)
+                    .with_for_update()
+                )
+                balances = result.all()
+                if not balances:
+                    return 0
+                drifts = await cls._reconcile_script(
+                    keys=[cls.PENDING_KEY],
+                    args=[cls.BALANCE_KEY_PREFIX, *(
+                        value for row in balances for value in row
+                    )]
+                )
+        fixed = 0
+        for (user_id, _), drift in zip(balances, drifts):
+            if drift:
+                fixed += 1
+                logger.warning("Баланс в Redis расходился с базой", extra={
+                    "user_id": user_id,
+                    "drift": drift,
+                })
+        return fixed
+
+    @classmethod
+    async def _ensure_group(cls):
+        try:
+            await cls.get_redis().xgroup_create(
+                cls.STREAM_KEY, cls.GROUP_NAME, id="0", mkstream=True
+            )
+        except aioredis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def _entry_time(message_id: str) -> datetime:
+        milliseconds = int(message_id.split("-")[0])
+        return datetime.fromtimestamp(milliseconds / 1000, timezone.utc)
+
+    @classmethod
+    async def write_entries(cls, messages) -> int:
+        rows = [
+            {
+                "entry_id": fields["entry_id"],
+                "user_id": int(fields["user_id"]),
+                "delta": int(fields["delta"]),
+                "created_at": cls._entry_time(message_id),
+            }
+            for message_id, fields in messages
+        ]
+        if not rows:
+            return 0
+
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                # Блокировка строк держит пользователей до конца
+                # транзакции, чтобы их не удалили между проверкой и
+                # вставкой
+                result = await db.execute(
+                    select(User.id)
+                    .where(User.id.in_(sorted({
+                        row["user_id"] for row in rows
+                    })))
+                    .order_by(User.id)
+                    .with_for_update()
+                )
+                existing = set(result.scalars())
+                dead = [row for row in rows if row["user_id"] not in existing]
+                if dead:
+                    await cls._dead_letter(dead)
+                    rows = [row for row in rows if row["user_id"] in existing]
+                if not rows:
+                    return 0
+
+                # Уже записанные записи пропускаются, поэтому повторная
+                # обработка после сбоя не меняет баланс второй раз
+                result = await db.execute(
+                    insert(TokenLedgerEntry)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=["entry_id"])
+                    .returning(
+                        TokenLedgerEntry.user_id, TokenLedgerEntry.delta
+                    )
+                )
+                totals = defaultdict(int)
+                for user_id, delta in result:
+                    totals[user_id] += delta
+
+                for user_id in sorted(totals):
+                    await db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(tokens=User.tokens + totals[user_id])
+                        .execution_options(synchronize_session=False)
+                    )
+        return len(totals)
+
+    @classmethod
+    async def _dead_letter(cls, rows):
+        # Запись с удаленным пользователем нарушила бы внешний ключ и
+        # навсегда блокировала бы пачку, поэтому она откладывается
+        # в отдельный поток и подтверждается вместе с остальными
+        redis_client = cls.get_redis()
+        for row in rows:
+            await redis_client.xadd(cls.DEAD_STREAM_KEY, {
+                "entry_id": row["entry_id"],
+                "user_id": row["user_id"],
+                "delta": row["delta"],
+                "reason": "user_not_found",
+            })
+        logger.warning("Отложены записи журнала удаленных пользователей",
+                       extra={
+                           "user_ids": sorted({
+                               row["user_id"] for row in rows
+                           }),
+                           "entries": len(rows),
+                       })
+
+    @classmethod
+    async def _acknowledge(cls, messages):
+        if not messages:
+            return
+        cls.get_redis()
+        args = [cls.GROUP_NAME]
+        for message_id, fields in messages:
+            args.extend([
+                message_id, fields["user_id"], fields["delta"],
+                fields.get("pending", "0")
+            ])
+        await cls._acknowledge_script(
+            keys=[cls.STREAM_KEY, cls.PENDING_KEY], args=args
+        )
+
+    @classmethod
+    async def _flush(cls, messages):
+        await cls.write_entries(messages)
+        await cls._acknowledge(messages)
+        await cls.reconcile({
+            int(fields["user_id"]) for _, fields in messages
+        })
+
+    @classmethod
+    async def _claim_stale(cls, min_idle_ms: int):
+        redis_client = cls.get_redis()
+        pending = await redis_client.xpending_range(
+            cls.STREAM_KEY, cls.GROUP_NAME, "-", "+",
+            settings.TOKEN_LEDGER_FLUSH_BATCH
+        )
+        stale_ids = [
+            entry["message_id"] for entry in pending
+            if entry["time_since_delivered"] >= min_idle_ms
+        ]
+        if not stale_ids:
+            return []
+        claimed = await redis_client.xclaim(
+            cls.STREAM_KEY, cls.GROUP_NAME, cls.consumer_name,
+            min_idle_ms, stale_ids
+        )
+        # Удаленные из потока записи подтверждаем, чтобы не забирать их снова
+        deleted = [message_id for message_id, fields in claimed if not fields]
+        if deleted:
+            await redis_client.xack(cls.STREAM_KEY, cls.GROUP_NAME, *deleted)
+        return [
+            (message_id, fields) for message_id, fields in claimed if fields
+        ]
+
+    @classmethod
+    async def flush_once(cls, block_ms: Optional[int] = None) -> int:
+        messages = await cls._claim_stale(settings.TOKEN_LEDGER_CLAIM_IDLE_MS)
+        if not messages:
+            response = await cls.get_redis().xreadgroup(
+                cls.GROUP_NAME, cls.consumer_name,
+                {cls.STREAM_KEY: ">"},
+                count=settings.TOKEN_LEDGER_FLUSH_BATCH,
+                block=block_ms
+            )
+            messages = response[0][1] if response else []
+
+        await cls._flush(messages)
+        return len(messages)
+
+    @classmethod
+    async def recover(cls) -> int:
+        await cls._ensure_group()
+        recovered = 0
+        while True:
+            messages = await cls._claim_stale(0)
+            if not messages:
+                break
+            await cls._flush(messages)
+            recovered += len(messages)
+        if recovered:
+            logger.info(f"Восстановлено записей журнала токенов: {recovered}")
+        return recovered
+
+    @classmethod
+    async def run(cls):
+        block_ms = int(settings.TOKEN_LEDGER_FLUSH_INTERVAL * 1000)
+        while True:
+            try:
+                await cls.flush_once(block_ms=block_ms)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала токенов: {str(e)}")
+                await asyncio.sleep(settings.TOKEN_LEDGER_FLUSH_INTERVAL)
+
+    @classmethod
+    async def start(cls):
+        if not settings.TOKEN_LEDGER_ENABLED or cls._task is not None:
+            return
+        await cls.recover()
+        cls._task = asyncio.create_task(cls.run())
+
+    @classmethod
+    async def stop(cls):
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        try:
+            await cls._task
+        except asyncio.CancelledError:
+            pass
+        cls._task = None
+        while await cls.flush_once():
+            pass
+
+
+# Изменение users.tokens через ORM в обход журнала сбрасывает баланс в Redis
+@event.listens_for(Session, "after_flush")
+def collect_changed_balances(session, flush_context):
+    changed = session.info.setdefault("token_ledger_invalidate", set())
+    for obj in session.dirty:
+        if (
+            isinstance(obj, User)
+            and inspect(obj).attrs.tokens.history.has_changes()
+        ):
+            changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_balances(session):
+    changed = session.info.pop("token_ledger_invalidate", None)
+    if changed and settings.TOKEN_LEDGER_ENABLED:
+        TokenLedgerService.schedule_invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_balances(session):
+    session.info.pop("token_ledger_invalidate", None)
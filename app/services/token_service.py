@@ -1,10 +1,20 @@
+from typing import List, Optional
+
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import metrics
+from app.core.config import settings
 from app.db.models import User
+from app.services.db_routing import DbRoutingService
+from app.services.token_ledger import TokenLedgerService
+from app.services.tokenizer import Tokenizer
+from app.services.user_cache import UserCacheService
 
 
 class TokenService:
     @staticmethod
-    def count_tokens(message: str) -> int:
+    def estimate_tokens(message: str) -> int:
         words = message.split()
         num_words = len(words)
         num_chars = len(message)
@@ -12,13 +22,82 @@ class TokenService:
         return tokens
 
     @staticmethod
-    async def deduct_tokens(
+    def count_tokens(message: str) -> int:
+        if Tokenizer.available():
+            return Tokenizer.count(message)
+        return TokenService.estimate_tokens(message)
+
+    @staticmethod
+    def count_tokens_batch(messages: List[str]) -> List[int]:
+        if Tokenizer.available():
+            return Tokenizer.count_batch(messages)
+        return [TokenService.estimate_tokens(m) for m in messages]
+
+    @staticmethod
+    def reservation_size(tokens_needed: int, balance: int) -> int:
+        return max(
+            tokens_needed,
+            min(tokens_needed + settings.TOKEN_ANSWER_RESERVE, balance)
+        )
+
+    @staticmethod
+    async def get_balance(user) -> int:
+        if settings.TOKEN_LEDGER_ENABLED:
+            balance = await TokenLedgerService.get_balance(user.id)
+            if balance is not None:
+                return balance
+        return user.tokens
+
+    @staticmethod
+    async def _apply_delta(
         user_id: int,
-        tokens: int, db: AsyncSession
-    ) -> bool:
-        user = await db.get(User, user_id)
-        if user and user.tokens >= tokens:
-            user.tokens -= tokens
+        delta: int,
+        db: AsyncSession
+    ) -> Optional[int]:
+        if settings.TOKEN_LEDGER_ENABLED:
+            balance = await TokenLedgerService.apply_delta(user_id, delta, db)
+        else:
+            result = await db.execute(
+                update(User)
+                .where(User.id == user_id, User.tokens + delta >= 0)
+                .values(tokens=User.tokens + delta)
+                .returning(User.tokens)
+                .execution_options(synchronize_session=False)
+            )
+            balance = result.scalar_one_or_none()
             await db.commit()
-            return True
-        return False
+
+        if balance is not None:
+            await DbRoutingService.mark_written(user_id)
+            await UserCacheService.update_balance(user_id, balance)
+        return balance
+
+    @staticmethod
+    async def reserve_tokens(
+        user_id: int,
+        tokens: int,
+        db: AsyncSession
+    ) -> Optional[int]:
+        with metrics.stage("token_reserve"):
+            return await TokenService._apply_delta(user_id, -tokens, db)
+
+    @staticmethod
+    async def settle_tokens(
+        user_id: int,
+        reserved: int,
+        used: int,
+        db: AsyncSession
+    ) -> Optional[int]:
+        with metrics.stage("token_settle"):
+            return await TokenService._apply_delta(
+                user_id, reserved - used, db
+            )
+
+    @staticmethod
+    async def refund_tokens(
+        user_id: int,
+        reserved: int,
+        db: AsyncSession
+    ) -> Optional[int]:
+        with metrics.stage("token_refund"):
+            return await TokenService._apply_delta(user_id, reserved, db)
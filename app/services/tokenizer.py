@@ -0,0 +1,127 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.core.config import settings
+
+try:
+    import tiktoken
+    from tiktoken.load import load_tiktoken_bpe
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Регулярные выражения предразбиения и служебные токены из tiktoken_ext,
+# чтобы собирать кодировку из локального файла словаря без загрузки из сети
+ENCODINGS = {
+    "cl100k_base": {
+        "pat_str": (
+            r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|"""
+            r"""\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|"""
+            r"""\s+(?!\S)|\s"""
+        ),
+        "special_tokens": {"<|endoftext|>": 100257},
+    },
+    "o200k_base": {
+        "pat_str": "|".join([
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*"""
+            r"""[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+"""
+            r"""[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""\p{N}{1,3}""",
+            r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+            r"""\s*[\r\n]+""",
+            r"""\s+(?!\S)""",
+            r"""\s+""",
+        ]),
+        "special_tokens": {
+            "<|endoftext|>": 199999, "<|endofprompt|>": 200018
+        },
+    },
+}
+
+
+class Tokenizer:
+    _encoding = None
+    _loaded = False
+    _load_lock = threading.Lock()
+
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def get_encoding(cls):
+        if not cls._loaded:
+            with cls._load_lock:
+                if not cls._loaded:
+                    cls._encoding = cls._load_encoding()
+                    cls._loaded = True
+        return cls._encoding
+
+    @classmethod
+    def _load_encoding(cls):
+        if tiktoken is None or not settings.TOKENIZER_VOCAB_PATH:
+            return None
+
+        spec = ENCODINGS.get(settings.TOKENIZER_ENCODING)
+        if spec is None:
+            logger.warning(
+                f"Неизвестная кодировка: {settings.TOKENIZER_ENCODING}"
+            )
+            return None
+
+        try:
+            mergeable_ranks = load_tiktoken_bpe(settings.TOKENIZER_VOCAB_PATH)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось загрузить словарь BPE: {str(e)}")
+            return None
+
+        return tiktoken.Encoding(
+            name=settings.TOKENIZER_ENCODING,
+            pat_str=spec["pat_str"],
+            mergeable_ranks=mergeable_ranks,
+            special_tokens=spec["special_tokens"],
+        )
+
+    @classmethod
+    def available(cls) -> bool:
+        return cls.get_encoding() is not None
+
+    @classmethod
+    def _cache_get(cls, text: str) -> Optional[int]:
+        with cls._cache_lock:
+            count = cls._cache.get(text)
+            if count is not None:
+                cls._cache.move_to_end(text)
+            return count
+
+    @classmethod
+    def _cache_set(cls, text: str, count: int):
+        with cls._cache_lock:
+            cls._cache[text] = count
+            cls._cache.move_to_end(text)
+            while len(cls._cache) > settings.TOKENIZER_CACHE_SIZE:
+                cls._cache.popitem(last=False)
+
+    @classmethod
+    def count(cls, text: str) -> int:
+        count = cls._cache_get(text)
+        if count is None:
+            count = len(cls.get_encoding().encode_ordinary(text))
+            cls._cache_set(text, count)
+        return count
+
+    @classmethod
+    def count_batch(cls, texts: List[str]) -> List[int]:
+        counts = [cls._cache_get(text) for text in texts]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            encoded = cls.get_encoding().encode_ordinary_batch(
+                [texts[i] for i in missing]
+            )
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                cls._cache_set(texts[i], counts[i])
+        return counts
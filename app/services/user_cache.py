@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import aioredis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.db.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class UserSnapshot(NamedTuple):
+    id: int
+    email: str
+    tokens: int
+
+
+class UserCacheService:
+    SNAPSHOT_KEY_PREFIX = "user_snapshot:"
+    ID_KEY_PREFIX = "user_snapshot_id:"
+
+    # KEYS[1] - ссылка id -> email, ARGV - новый баланс, префикс снимков
+    UPDATE_BALANCE_SCRIPT = """
+    local email = redis.call('GET', KEYS[1])
+    if not email then
+        return 0
+    end
+    local key = ARGV[2] .. email
+    local raw = redis.call('GET', key)
+    if not raw then
+        return 0
+    end
+    local snapshot = cjson.decode(raw)
+    snapshot['tokens'] = tonumber(ARGV[1])
+    redis.call('SET', key, cjson.encode(snapshot), 'KEEPTTL')
+    return 1
+    """
+
+    _redis = None
+    _update_balance = None
+    _local = OrderedDict()
+    _local_ids = {}
+    _pending = set()
+
+    @classmethod
+    def get_redis(cls):
+        if cls._redis is None:
+            cls._redis = aioredis.from_url(
+                settings.REDIS_URL, decode_responses=True
+            )
+            metrics.track_redis_pool("user_cache", cls._redis)
+            cls._update_balance = cls._redis.register_script(
+                cls.UPDATE_BALANCE_SCRIPT
+            )
+        return cls._redis
+
+    @classmethod
+    def _local_get(cls, email: str) -> Optional[UserSnapshot]:
+        entry = cls._local.get(email)
+        if entry is None:
+            return None
+        snapshot, expires_at = entry
+        if expires_at <= time.monotonic():
+            cls._local_pop(email)
+            return None
+        cls._local.move_to_end(email)
+        return snapshot
+
+    @classmethod
+    def _local_set(cls, snapshot: UserSnapshot):
+        expires_at = (
+            time.monotonic() + settings.USER_CACHE_MAX_BALANCE_STALENESS
+        )
+        cls._local[snapshot.email] = (snapshot, expires_at)
+        cls._local.move_to_end(snapshot.email)
+        cls._local_ids[snapshot.id] = snapshot.email
+        while len(cls._local) > settings.USER_CACHE_LOCAL_MAX_ENTRIES:
+            cls._local_pop(next(iter(cls._local)))
+
+    @classmethod
+    def _local_pop(cls, email: str):
+        entry = cls._local.pop(email, None)
+        if entry is not None:
+            cls._local_ids.pop(entry[0].id, None)
+
+    @classmethod
+    async def get(cls, email: str) -> Optional[UserSnapshot]:
+        if not settings.USER_CACHE_ENABLED:
+            return None
+        snapshot = cls._local_get(email)
+        if snapshot is not None:
+            metrics.USER_CACHE_LOOKUPS.labels("local").inc()
+            return snapshot
+
+        try:
+            raw = await cls.get_redis().get(cls.SNAPSHOT_KEY_PREFIX + email)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша пользователей: {str(e)}")
+            return None
+        metrics.USER_CACHE_LOOKUPS.labels(
+            "miss" if raw is None else "redis"
+        ).inc()
+        if raw is None:
+            return None
+        snapshot = UserSnapshot(**json.loads(raw))
+        cls._local_set(snapshot)
+        return snapshot
+
+    @classmethod
+    async def store(cls, user: User) -> UserSnapshot:
+        snapshot = UserSnapshot(user.id, user.email, user.tokens)
+        if not settings.USER_CACHE_ENABLED:
+            return snapshot
+        cls._local_set(snapshot)
+        try:
+            async with cls.get_redis().pipeline(transaction=False) as pipe:
+                pipe.set(
+                    cls.SNAPSHOT_KEY_PREFIX + snapshot.email,
+                    json.dumps(snapshot._asdict()),
+                    ex=settings.USER_CACHE_TTL
+                )
+                pipe.set(
+                    cls.ID_KEY_PREFIX + str(snapshot.id),
+                    snapshot.email,
+                    ex=settings.USER_CACHE_TTL
+                )
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш пользователей: {str(e)}")
+        return snapshot
+
+    @classmethod
+    async def update_balance(cls, user_id: int, balance: int):
+        if not settings.USER_CACHE_ENABLED:
+            return
+        email = cls._local_ids.get(user_id)
+        if email is not None:
+            entry = cls._local.get(email)
+            if entry is not None:
+                cls._local[email] = (
+                    entry[0]._replace(tokens=balance), entry[1]
+                )
+        try:
+            cls.get_redis()
+            await cls._update_balance(
+                keys=[cls.ID_KEY_PREFIX + str(user_id)],
+                args=[balance, cls.SNAPSHOT_KEY_PREFIX]
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка обновления кэша пользователей: {str(e)}")
+
+    @classmethod
+    def invalidate_local(cls, email: str):
+        cls._local_pop(email)
+
+    @classmethod
+    def schedule_invalidate(cls, email: str, user_id: int):
+        cls.invalidate_local(email)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(cls.invalidate(email, user_id))
+        cls._pending.add(task)
+        task.add_done_callback(cls._pending.discard)
+
+    @classmethod
+    async def invalidate(cls, email: str, user_id: Optional[int] = None):
+        cls.invalidate_local(email)
+        keys = [cls.SNAPSHOT_KEY_PREFIX + email]
+        if user_id is not None:
+            keys.append(cls.ID_KEY_PREFIX + str(user_id))
+        try:
+            await cls.get_redis().delete(*keys)
+        except Exception as e:
+            logger.warning(f"Ошибка очистки кэша пользователей: {str(e)}")
+
+
+# Смена пароля или email и удаление пользователя через ORM сбрасывают снимок
+@event.listens_for(Session, "after_flush")
+def collect_changed_users(session, flush_context):
+    changed = session.info.setdefault("user_cache_invalidate", set())
+    for obj in session.dirty:
+        if not isinstance(obj, User):
+            continue
+        state = inspect(obj)
+        password = state.attrs.hashed_password.history
+        email = state.attrs.email.history
+        if password.has_changes() or email.has_changes():
+            for old_email in email.deleted or [obj.email]:
+                changed.add((old_email, obj.id))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add((obj.email, obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_users(session):
+    changed = session.info.pop("user_cache_invalidate", None)
+    if not changed or not settings.USER_CACHE_ENABLED:
+        return
+    for email, user_id in changed:
+        UserCacheService.schedule_invalidate(email, user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_users(session):
+    session.info.pop("user_cache_invalidate", None)
@@ -19,10 +19,30 @@ document.addEventListener('DOMContentLoaded', () => {
     const clearButton = document.createElement('button');
     clearButton.textContent = 'Очистить чат';
     clearButton.classList.add('chat-btn');
-    clearButton.addEventListener('click', () => {
+    clearButton.addEventListener('click', async () => {
         chatMessages.innerHTML = '';
+        await resetConversation();
     });
 
+    // Очищает историю диалога на сервере, следующий вопрос начнет новый диалог
+    async function resetConversation() {
+        try {
+            const response = await fetch('/reset', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({}),
+            });
+            if (!response.ok) {
+                addMessage('error', 'Не удалось очистить историю диалога.');
+            }
+        } catch (error) {
+            console.error('Error:', error);
+            addMessage('error', 'Не удалось очистить историю диалога.');
+        }
+    }
+
     buttonContainer.appendChild(exitButton);
     buttonContainer.appendChild(clearButton);
     
@@ -32,7 +52,11 @@ document.addEventListener('DOMContentLoaded', () => {
     chatForm.addEventListener('submit', async (e) => {
         e.preventDefault();
         const message = userInput.value.trim();
-        if (message) {
+        if (message === '/reset') {
+            userInput.value = '';
+            chatMessages.innerHTML = '';
+            await resetConversation();
+        } else if (message) {
             addMessage('user', message);
             userInput.value = '';
             try {
@@ -41,14 +65,19 @@ document.addEventListener('DOMContentLoaded', () => {
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ message }),
+                    body: JSON.stringify({ message, stream: true }),
                 });
-                const data = await response.json();
-                if (data.error) {
-                    addMessage('error', data.response);
+                const contentType = response.headers.get('Content-Type') || '';
+                if (contentType.includes('application/x-ndjson')) {
+                    await readStream(response);
                 } else {
-                    addMessage('bot', data.response);
-                    tokenBalance.textContent = data.tokens_remaining;
+                    const data = await response.json();
+                    if (data.error) {
+                        addMessage('error', data.response);
+                    } else {
+                        addMessage('bot', data.response);
+                        tokenBalance.textContent = data.tokens_remaining;
+                    }
                 }
             } catch (error) {
                 console.error('Error:', error);
@@ -57,6 +86,53 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Ответ приходит построчно в формате NDJSON: {"queue_position"}, ..., {"delta"}, ..., {"done"} или {"error"}
+    async function readStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let textElement = null;
+        let queueElement = null;
+        let buffer = '';
+
+        const handleEvent = (event) => {
+            if (event.queue_position) {
+                if (!queueElement) {
+                    queueElement = addMessage('bot', '');
+                }
+                queueElement.textContent = `Ваш вопрос в очереди, позиция: ${event.queue_position}`;
+            } else if (event.delta) {
+                if (!textElement) {
+                    // Сообщение о позиции в очереди заменяется ответом
+                    textElement = queueElement || addMessage('bot', '');
+                    textElement.textContent = '';
+                }
+                textElement.textContent += event.delta;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event.error) {
+                if (queueElement && !textElement) {
+                    queueElement.parentElement.remove();
+                }
+                addMessage('error', event.error);
+            } else if (event.done) {
+                tokenBalance.textContent = event.tokens_remaining;
+            }
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter((line) => line.trim()).forEach((line) => handleEvent(JSON.parse(line)));
+        }
+        if (buffer.trim()) {
+            handleEvent(JSON.parse(buffer));
+        }
+    }
+
     function addMessage(sender, text) {
         const messageElement = document.createElement('div');
         messageElement.classList.add('message', sender);
@@ -65,5 +141,6 @@ document.addEventListener('DOMContentLoaded', () => {
         messageElement.appendChild(textElement);
         chatMessages.appendChild(messageElement);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return textElement;
     }
 });
@@ -0,0 +1,116 @@
+"""Время удержания соединений с базой во время запросов к OpenAI.
+
+Запуск (из корня репозитория, с заполненным .env):
+
+    python -m benchmarks.db_hold_bench --requests 200 --concurrency 100
+
+Каждый запрос повторяет путь /ask: чтение пользователя и резервирование
+токенов, ожидание ответа OpenAI (--upstream-delay секунд) и списание.
+В режиме hold сессия запроса держит транзакцию открытой во время ожидания,
+как до изменения; в режиме release сессия закрывается перед запросом
+к OpenAI. Для каждого режима выводятся пропускная способность, время
+удержания соединения из пула и наибольшее число занятых соединений.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from sqlalchemy import event, text
+
+from app.core.config import settings
+from app.db.init_db import AsyncSessionLocal, engine
+
+
+class PoolMonitor:
+    def __init__(self, pool):
+        self.holds = []
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self._started = {}
+        event.listen(pool, "checkout", self.on_checkout)
+        event.listen(pool, "checkin", self.on_checkin)
+
+    def reset(self):
+        self.holds = []
+        self.max_checked_out = self.checked_out
+
+    def on_checkout(self, dbapi_connection, record, proxy):
+        self._started[id(record)] = time.perf_counter()
+        self.checked_out += 1
+        self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, dbapi_connection, record):
+        started = self._started.pop(id(record), None)
+        if started is None:
+            return
+        self.checked_out -= 1
+        self.holds.append(time.perf_counter() - started)
+
+
+async def ask(release: bool, upstream_delay: float):
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+        if release:
+            await db.close()
+        await asyncio.sleep(upstream_delay)
+        await db.execute(text("SELECT 1"))
+        await db.commit()
+
+
+async def run(mode: str, monitor: PoolMonitor, args) -> dict:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited():
+        async with semaphore:
+            await ask(mode == "release", args.upstream_delay)
+
+    monitor.reset()
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(limited() for _ in range(args.requests)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+
+    holds_ms = sorted(hold * 1000 for hold in monitor.holds) or [0.0]
+    return {
+        "requests_per_sec": round(args.requests / elapsed, 1),
+        "errors": sum(isinstance(r, Exception) for r in results),
+        "max_checked_out": monitor.max_checked_out,
+        "hold_ms": {
+            "p50": round(statistics.median(holds_ms), 2),
+            "p99": round(holds_ms[int(len(holds_ms) * 0.99)], 2),
+            "max": round(holds_ms[-1], 2),
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--upstream-delay", type=float, default=0.5)
+    parser.add_argument(
+        "--mode", choices=["hold", "release", "both"], default="both"
+    )
+    args = parser.parse_args()
+
+    monitor = PoolMonitor(engine.sync_engine.pool)
+    modes = ["hold", "release"] if args.mode == "both" else [args.mode]
+    results = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "upstream_delay": args.upstream_delay,
+    }
+    for mode in modes:
+        results[mode] = await run(mode, monitor, args)
+    await engine.dispose()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
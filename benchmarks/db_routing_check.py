@@ -0,0 +1,127 @@
+"""Проверка маршрутизации чтений между основной базой и репликой.
+
+Запуск (из корня репозитория, с заполненным .env и доступным Redis):
+
+    python -m benchmarks.db_routing_check
+
+Скрипт подменяет DATABASE_URL и DATABASE_READ_URLS двумя файлами SQLite
+в --directory. В «реплике» баланс пользователя отстает от основной базы,
+поэтому по балансу видно, из какой базы пришел ответ. Проверяется, что
+поиск пользователя идет в реплику, запись токенов - в основную базу,
+после записи чтения на DB_READ_STICKY_SECONDS закрепляются за основной
+базой, а пользователь, которого еще нет в реплике, находится в основной.
+Результат выводится в JSON; при ошибке код выхода 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+PRIMARY_TOKENS = 100
+REPLICA_TOKENS = 50
+EMAIL = "routing-check@example.com"
+NEW_EMAIL = "routing-check-new@example.com"
+
+
+async def run(args) -> dict:
+    # Настройки читаются при импорте, поэтому адреса баз задаются до него
+    os.environ["DATABASE_URL"] = (
+        f"sqlite+aiosqlite:///{os.path.join(args.directory, 'primary.db')}"
+    )
+    os.environ["DATABASE_READ_URLS"] = (
+        f"sqlite+aiosqlite:///{os.path.join(args.directory, 'replica.db')}"
+    )
+    os.environ["TOKEN_LEDGER_ENABLED"] = "false"
+
+    from sqlalchemy import select
+
+    from app.core.config import settings
+    from app.db.init_db import (
+        AsyncSessionLocal, engine, get_read_db, init_db, read_engines
+    )
+    from app.db.models import Base, User
+    from app.services.auth import AuthService
+    from app.services.db_routing import DbRoutingService
+    from app.services.token_service import TokenService
+
+    await init_db()
+    async with read_engines[0].begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    # Реплика отстает: у пользователя старый баланс, нового еще нет
+    for database, users in (
+        (engine, [(1, EMAIL, PRIMARY_TOKENS), (2, NEW_EMAIL, 0)]),
+        (read_engines[0], [(1, EMAIL, REPLICA_TOKENS)]),
+    ):
+        async with database.begin() as conn:
+            for user_id, email, tokens in users:
+                await conn.execute(User.__table__.insert().values(
+                    id=user_id, email=email, hashed_password="-",
+                    tokens=tokens
+                ))
+
+    async def find_tokens(email: str):
+        async with AsyncSessionLocal() as db:
+            user = await AuthService.find_user(email, db)
+        return None if user is None else user.tokens
+
+    async def forget_write():
+        DbRoutingService._local.clear()
+        await DbRoutingService.get_redis().delete(
+            DbRoutingService.STICKY_KEY_PREFIX + "1"
+        )
+
+    await forget_write()
+    checks = {}
+    checks["lookup_uses_replica"] = await find_tokens(EMAIL) == REPLICA_TOKENS
+
+    async for read_db in get_read_db():
+        tokens = (await read_db.execute(
+            select(User.tokens).where(User.id == 1)
+        )).scalar_one()
+    checks["read_session_uses_replica"] = tokens == REPLICA_TOKENS
+
+    async with AsyncSessionLocal() as db:
+        balance = await TokenService.reserve_tokens(1, 10, db)
+    checks["write_goes_to_primary"] = balance == PRIMARY_TOKENS - 10
+    checks["read_after_write_uses_primary"] = (
+        await find_tokens(EMAIL) == PRIMARY_TOKENS - 10
+    )
+
+    await forget_write()
+    checks["replica_after_sticky_window"] = (
+        await find_tokens(EMAIL) == REPLICA_TOKENS
+    )
+    checks["missing_in_replica_uses_primary"] = (
+        await find_tokens(NEW_EMAIL) == 0
+    )
+
+    await forget_write()
+    for database in (engine, *read_engines):
+        await database.dispose()
+    return {
+        "sticky_seconds": settings.DB_READ_STICKY_SECONDS,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default=None)
+    args = parser.parse_args()
+    args.directory = args.directory or tempfile.mkdtemp(
+        prefix="db_routing_check_"
+    )
+
+    result = asyncio.run(run(args))
+    result["directory"] = args.directory
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not result["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""OpenAI-совместимый сервер-заглушка с управляемыми задержками и ошибками.
+
+Запуск:
+
+    python -m benchmarks.fake_openai --port 8101 --latency 0.2 \\
+        --slow-rate 0.05 --slow-latency 3 --error-rate 0.02 \\
+        --answer-tokens 60 --answer-tokens-jitter 40
+
+Отвечает на POST /v1/chat/completions обычным ответом или потоком SSE
+(stream=true). Перед ответом сервер ждет --latency ± --jitter секунд,
+с вероятностью --slow-rate ждет --slow-latency секунд, а с вероятностью
+--error-rate отвечает ошибкой --error-status (с заголовком Retry-After,
+если задан --retry-after). Длина ответа - --answer-tokens ±
+--answer-tokens-jitter токенов (слов), в потоке каждое слово приходит
+отдельной частью с паузой --chunk-delay. Сервер подключается как бэкенд
+через OPENAI_BACKENDS с base_url http://127.0.0.1:<port>/v1. Его можно
+запустить и из кода через start_server.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Optional
+
+from aiohttp import web
+
+ANSWER_WORDS = ["Это ", "ответ ", "тестового ", "сервера."]
+FILLER_WORDS = ["очень ", "подробный ", "и ", "полезный "]
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        latency: float = 0.1,
+        jitter: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 3.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        chunk_delay: float = 0.01,
+        retry_after: Optional[float] = None,
+        answer_tokens: int = len(ANSWER_WORDS),
+        answer_tokens_jitter: int = 0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.chunk_delay = chunk_delay
+        self.retry_after = retry_after
+        self.answer_tokens = answer_tokens
+        self.answer_tokens_jitter = answer_tokens_jitter
+        self.stats = {"requests": 0, "errors": 0, "slow": 0, "cancelled": 0}
+
+    def delay(self) -> float:
+        if random.random() < self.slow_rate:
+            self.stats["slow"] += 1
+            return self.slow_latency
+        return max(0.0, self.latency + random.uniform(-1, 1) * self.jitter)
+
+    def answer_words(self) -> list:
+        count = max(1, self.answer_tokens + random.randint(
+            -self.answer_tokens_jitter, self.answer_tokens_jitter
+        ))
+        fillers = [
+            FILLER_WORDS[number % len(FILLER_WORDS)]
+            for number in range(max(0, count - len(ANSWER_WORDS)))
+        ]
+        return (ANSWER_WORDS[:1] + fillers + ANSWER_WORDS[1:])[-count:]
+
+    def error_response(self) -> web.Response:
+        self.stats["errors"] += 1
+        code = (
+            "rate_limit_exceeded" if self.error_status == 429
+            else "server_error"
+        )
+        error = {"message": "Injected error", "type": code, "code": code}
+        headers = {}
+        if self.retry_after is not None:
+            headers["Retry-After"] = f"{self.retry_after:g}"
+        return web.json_response(
+            {"error": error}, status=self.error_status, headers=headers
+        )
+
+    @staticmethod
+    def chunk(model: str, created: int, delta: dict, usage=None) -> str:
+        payload = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [] if usage else [
+                {"index": 0, "delta": delta, "finish_reason": None}
+            ],
+        }
+        if usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def completions(self, request: web.Request):
+        self.stats["requests"] += 1
+        body = await request.json()
+        model = body.get("model", "fake")
+        prompt_tokens = sum(
+            len(message["content"].split()) for message in body["messages"]
+        )
+        words = self.answer_words()
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        }
+        created = int(time.time())
+
+        try:
+            await asyncio.sleep(self.delay())
+        except asyncio.CancelledError:
+            # Клиент отменил запрос, например проигравшую дублирующую попытку
+            self.stats["cancelled"] += 1
+            raise
+        if random.random() < self.error_rate:
+            return self.error_response()
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": "".join(words),
+                    },
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream"}
+        )
+        await response.prepare(request)
+        for word in words:
+            await response.write(
+                self.chunk(model, created, {"content": word}).encode()
+            )
+            await asyncio.sleep(self.chunk_delay)
+        await response.write(
+            self.chunk(model, created, {}, usage=usage).encode()
+        )
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        return app
+
+
+async def start_server(
+    fake: FakeOpenAI,
+    port: int,
+    host: str = "127.0.0.1"
+) -> web.AppRunner:
+    runner = web.AppRunner(
+        fake.create_app(), access_log=None, handler_cancellation=True
+    )
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--chunk-delay", type=float, default=0.01)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument(
+        "--answer-tokens", type=int, default=len(ANSWER_WORDS)
+    )
+    parser.add_argument("--answer-tokens-jitter", type=int, default=0)
+
+
+def from_arguments(args) -> FakeOpenAI:
+    return FakeOpenAI(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        chunk_delay=args.chunk_delay,
+        retry_after=args.retry_after,
+        answer_tokens=args.answer_tokens,
+        answer_tokens_jitter=args.answer_tokens_jitter
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(
+        from_arguments(args).create_app(), host=args.host, port=args.port,
+        handler_cancellation=True
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Сервер-заглушка Telegram Bot API для нагрузочных тестов бота.
+
+Использование из кода:
+
+    telegram = FakeTelegram()
+    runner = await start_server(telegram, 8102)
+    # бот запускается с BOT_TELEGRAM_API_URL=api_url(8102)
+    reply = await telegram.exchange(42, "/start", marker="Привет")
+
+Сервер отвечает на getMe, deleteWebhook, getUpdates (длинный опрос)
+и на методы, которыми бот отправляет и правит сообщения. Новые сообщения
+от пользователей добавляются через send_text, а все сообщения и правки
+бота складываются в очередь ответов своего чата. exchange отправляет
+сообщение и ждет ответа, содержащего marker.
+
+После setWebhook обновления не ждут getUpdates, а отправляются POST на
+адрес webhook с заголовком X-Telegram-Bot-Api-Secret-Token, как это
+делает Telegram; коды ответов бота считаются в stats как webhook_<код>.
+deliver с другим secret_token проверяет, что бот отклоняет чужие
+обновления.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {
+    "id": 1000000,
+    "is_bot": True,
+    "first_name": "LoadTestBot",
+    "username": "load_test_bot",
+}
+# Текст, с которым бот начинает потоковый ответ
+PLACEHOLDER = "…"
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class Reply(NamedTuple):
+    method: str
+    text: str
+    at: float
+
+
+class Exchange(NamedTuple):
+    ok: bool
+    text: str
+    seconds: float
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.updates = []
+        self.replies = defaultdict(asyncio.Queue)
+        self.stats = defaultdict(int)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        # Адрес и секрет из setWebhook; None - бот забирает getUpdates
+        self.webhook: Optional[dict] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._deliveries = set()
+
+    @staticmethod
+    def message(chat_id: int, message_id: int, text: str, sender: dict):
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": sender,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{
+                "type": "bot_command",
+                "offset": 0,
+                "length": len(text.split()[0]),
+            }]
+        return message
+
+    def send_text(self, chat_id: int, text: str):
+        sender = {"id": chat_id, "is_bot": False, "first_name": "Load"}
+        update = {
+            "update_id": next(self._update_ids),
+            "message": self.message(
+                chat_id, next(self._message_ids), text, sender
+            ),
+        }
+        self.stats["updates"] += 1
+        if self.webhook is not None:
+            task = asyncio.create_task(self.deliver(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+            return
+        self.updates.append(update)
+        self._new_updates.set()
+
+    async def deliver(
+        self, update: dict, secret_token: Optional[str] = None
+    ) -> Optional[int]:
+        # Код ответа webhook или None, если бот недоступен
+        if secret_token is None:
+            secret_token = self.webhook["secret_token"]
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        try:
+            async with self._session.post(
+                self.webhook["url"],
+                json=update,
+                headers={SECRET_TOKEN_HEADER: secret_token}
+            ) as response:
+                self.stats[f"webhook_{response.status}"] += 1
+                return response.status
+        except aiohttp.ClientError:
+            self.stats["webhook_errors"] += 1
+            return None
+
+    async def close(self, app: web.Application = None):
+        for task in list(self._deliveries):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def exchange(
+        self,
+        chat_id: int,
+        text: str,
+        marker: str,
+        timeout: float = 60.0,
+        settle: float = 2.0
+    ) -> Exchange:
+        # Ответ с marker - успех; любое другое новое сообщение, кроме
+        # заглушки потокового ответа, - ошибка; если после правок чат
+        # молчит settle секунд, поток оборвался без итоговой строки
+        replies = self.replies[chat_id]
+        while not replies.empty():
+            replies.get_nowait()
+        started = time.perf_counter()
+        self.send_text(chat_id, text)
+        last = None
+        while True:
+            wait = settle if last else (
+                timeout - (time.perf_counter() - started)
+            )
+            try:
+                reply = await asyncio.wait_for(replies.get(), max(wait, 0))
+            except asyncio.TimeoutError:
+                return Exchange(
+                    False,
+                    last.text if last else "timeout",
+                    time.perf_counter() - started
+                )
+            if marker in reply.text:
+                return Exchange(True, reply.text, reply.at - started)
+            if reply.method == "sendMessage" and reply.text != PLACEHOLDER:
+                return Exchange(False, reply.text, reply.at - started)
+            last = reply
+
+    async def get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(),
+                    float(params.get("timeout") or 0)
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get("limit") or 100)]
+
+    def record(self, method: str, chat_id: int, text: str):
+        self.replies[chat_id].put_nowait(
+            Reply(method, text, time.perf_counter())
+        )
+
+    async def call(self, request: web.Request):
+        method = request.match_info["method"]
+        self.stats[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self.get_updates(params)
+        elif method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            result = self.message(
+                chat_id, next(self._message_ids), params["text"], BOT_USER
+            )
+            self.record(method, chat_id, params["text"])
+        elif method == "editMessageText":
+            chat_id = int(params["chat_id"])
+            result = self.message(
+                chat_id, int(params["message_id"]), params["text"], BOT_USER
+            )
+            self.record(method, chat_id, params["text"])
+        elif method == "setWebhook":
+            self.webhook = {
+                "url": params["url"],
+                "secret_token": params.get("secret_token", ""),
+            }
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook = None
+            result = True
+        elif method in ("sendChatAction", "setMyCommands", "deleteMessage"):
+            result = True
+        else:
+            return web.json_response({
+                "ok": False,
+                "error_code": 400,
+                "description": f"Bad Request: method {method} is not faked",
+            }, status=400)
+        return web.Response(
+            text=json.dumps({"ok": True, "result": result}),
+            content_type="application/json"
+        )
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.call)
+        app.on_cleanup.append(self.close)
+        return app
+
+
+async def start_server(
+    telegram: FakeTelegram,
+    port: int,
+    host: str = "127.0.0.1"
+) -> web.AppRunner:
+    runner = web.AppRunner(telegram.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def api_url(port: int, host: str = "127.0.0.1") -> str:
+    # Значение для BOT_TELEGRAM_API_URL, токен бот добавит сам
+    return f"http://{host}:{port}/bot"
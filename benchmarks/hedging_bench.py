@@ -0,0 +1,119 @@
+"""Хвостовые задержки OpenAIService с дублирующими запросами и без них.
+
+Запуск (из корня репозитория, с заполненным .env):
+
+    python -m benchmarks.hedging_bench --requests 400 --concurrency 20
+
+Поднимает два локальных OpenAI-совместимых сервера (benchmarks.fake_openai):
+основной с редкими долгими ответами и резервный, который иногда отвечает
+ошибкой 503. Затем отправляет запросы через OpenAIService с выключенным
+и включенным дублированием и выводит процентили задержки, число ошибок
+и статистику бэкендов.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.core.config import settings
+from app.services.openai_backends import BackendRouter
+from app.services.openai_service import OpenAIService
+from benchmarks.fake_openai import FakeOpenAI, start_server
+
+
+async def request(stream: bool):
+    if stream:
+        async for _ in OpenAIService.stream_question("Сколько будет 2+2?"):
+            pass
+    else:
+        await OpenAIService.ask_question("Сколько будет 2+2?")
+
+
+async def run(hedge: bool, args) -> dict:
+    settings.OPENAI_HEDGE_ENABLED = hedge
+    await BackendRouter.close()
+    BackendRouter._backends = None
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def timed():
+        async with semaphore:
+            started = time.perf_counter()
+            await request(args.stream)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(timed() for _ in range(args.requests)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies) or [0.0]
+    return {
+        "requests_per_sec": round(args.requests / elapsed, 1),
+        "errors": sum(isinstance(r, Exception) for r in results),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies_ms), 1),
+            "p95": round(latencies_ms[int(len(latencies_ms) * 0.95)], 1),
+            "p99": round(latencies_ms[int(len(latencies_ms) * 0.99)], 1),
+            "max": round(latencies_ms[-1], 1),
+        },
+        "backends": BackendRouter.stats(),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.02)
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+
+    primary = FakeOpenAI(
+        latency=args.latency, jitter=args.latency / 2,
+        slow_rate=args.slow_rate, slow_latency=args.slow_latency
+    )
+    reserve = FakeOpenAI(
+        latency=args.latency * 1.5, jitter=args.latency / 2,
+        error_rate=args.error_rate
+    )
+    runners = [
+        await start_server(primary, args.port),
+        await start_server(reserve, args.port + 1),
+    ]
+    settings.OPENAI_BACKENDS = json.dumps([
+        {
+            "name": "primary", "weight": 3, "api_key": "fake",
+            "base_url": f"http://127.0.0.1:{args.port}/v1",
+        },
+        {
+            "name": "reserve", "weight": 1, "api_key": "fake",
+            "base_url": f"http://127.0.0.1:{args.port + 1}/v1",
+        },
+    ])
+
+    results = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "hedge_percentile": settings.OPENAI_HEDGE_PERCENTILE,
+    }
+    try:
+        for hedge in (False, True):
+            results["hedged" if hedge else "plain"] = await run(hedge, args)
+    finally:
+        await OpenAIService.close()
+        for runner in runners:
+            await runner.cleanup()
+    results["servers"] = {"primary": primary.stats, "reserve": reserve.stats}
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
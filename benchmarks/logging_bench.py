@@ -0,0 +1,170 @@
+"""Стоимость логирования вопросов для цикла событий.
+
+Запуск (из корня репозитория, с заполненным .env):
+
+    python -m benchmarks.logging_bench --questions 20000 --sink-delay 0.2
+
+--tasks корутин обрабатывают --questions вопросов и пишут те же записи,
+что и обработчики /ask и бота. Прежняя схема (StreamHandler с текстовым
+форматом, текст вопроса и email в сообщении) сравнивается с очередью
+app.core.logs: JSON, редактирование и, отдельно, выборка записей.
+Фоновая задача каждые --probe-interval мс измеряет задержку цикла.
+--sink-delay добавляет паузу в мс на каждую запись в приемник, как у
+медленного stdout под сборщиком логов.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from app.core import logs
+from app.core.config import settings
+
+QUESTION = "Как приготовить борщ, чтобы он получился ярко-красным? " * 4
+EMAIL = "user@example.com"
+
+
+class SlowFile:
+    def __init__(self, path: str, delay: float):
+        self.file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+
+    def write(self, text: str):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def log_before(logger: logging.Logger, number: int):
+    logger.info(f"Получен запрос на /ask: {QUESTION}")
+    logger.info(f"Пользователь аутентифицирован: {EMAIL}")
+    logger.info(f"Получен вопрос от chat_id {number}: {QUESTION}")
+
+
+def log_after(logger: logging.Logger, number: int):
+    logger.info("Получен запрос на /ask", extra={
+        "user_id": number,
+        "question_chars": len(QUESTION),
+        "stream": False,
+    })
+    logger.info("Получен вопрос", extra={
+        "chat_id": number,
+        "question_chars": len(QUESTION),
+    })
+
+
+async def probe_lag(interval: float, lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def questions(log, logger, first: int, count: int, blocked: list):
+    for number in range(first, first + count):
+        started = time.perf_counter()
+        log(logger, number)
+        blocked.append(time.perf_counter() - started)
+        await asyncio.sleep(0)
+
+
+async def measure(name: str, log, handler, listener, args) -> dict:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if listener is not None:
+        listener.start()
+
+    lags, blocked = [], []
+    stop = asyncio.Event()
+    interval = args.probe_interval / 1000
+    probe = asyncio.create_task(probe_lag(interval, lags, stop))
+    await asyncio.sleep(interval)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    per_task = args.questions // args.tasks
+    await asyncio.gather(*(
+        questions(log, logger, number * per_task, per_task, blocked)
+        for number in range(args.tasks)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    if listener is not None:
+        # Время дописывания очереди входит в CPU, но не в задержку цикла
+        listener.stop()
+    cpu = time.process_time() - cpu_started
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    blocked_us = sorted(seconds * 1e6 for seconds in blocked)
+    return {
+        "questions_per_sec": round(per_task * args.tasks / elapsed, 1),
+        "cpu_seconds": round(cpu, 3),
+        "blocked_per_question_us": {
+            "p50": round(statistics.median(blocked_us), 1),
+            "p99": round(blocked_us[int(len(blocked_us) * 0.99)], 1),
+        },
+        "loop_lag_ms": {
+            "p50": round(statistics.median(lags_ms), 2),
+            "p99": round(lags_ms[int(len(lags_ms) * 0.99)], 2),
+            "max": round(lags_ms[-1], 2),
+        },
+        **({"dropped": handler.dropped} if listener is not None else {}),
+    }
+
+
+async def run(args):
+    delay = args.sink_delay / 1000
+    directory = tempfile.mkdtemp(prefix="logging_bench_")
+    result = {"questions": args.questions, "sink_delay_ms": args.sink_delay}
+
+    sink = SlowFile(os.path.join(directory, "before.log"), delay)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(logs.TEXT_FORMAT))
+    result["before"] = await measure("before", log_before, handler, None, args)
+    sink.close()
+
+    for name, sampling in (
+        ("queue_json", ""),
+        ("queue_json_sampled", f"bench={args.sample_rate}"),
+    ):
+        sink = SlowFile(os.path.join(directory, f"{name}.log"), delay)
+        handler, listener = logs.create_pipeline(
+            stream=sink,
+            sampling=sampling,
+            redact_fields=settings.LOG_REDACT_FIELDS,
+            queue_size=settings.LOG_QUEUE_SIZE
+        )
+        result[name] = await measure(
+            name, log_after, handler, listener, args
+        )
+        sink.close()
+
+    result["log_files"] = directory
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=20000)
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--sink-delay", type=float, default=0.0)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--probe-interval", type=float, default=10.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
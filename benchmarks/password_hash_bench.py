@@ -0,0 +1,94 @@
+"""Задержка цикла событий во время волны входов пользователей.
+
+Запуск (из корня репозитория, с заполненным .env):
+
+    python -m benchmarks.password_hash_bench --logins 200
+
+Во время --logins одновременных проверок пароля фоновая задача каждые
+--probe-interval мс засыпает и измеряет, насколько позже она просыпается.
+Проверка пароля прямо в корутине сравнивается с PasswordHasher.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.core.config import settings
+from app.services.password_hasher import PasswordHasher
+
+PASSWORD = "correct horse battery staple"
+
+
+async def probe_lag(interval: float, lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def login_inline(hashed_password: str):
+    PasswordHasher.pwd_context.verify(PASSWORD, hashed_password)
+
+
+async def login_pool(hashed_password: str):
+    await PasswordHasher.verify_and_update(PASSWORD, hashed_password)
+
+
+async def storm(login, hashed_password: str, logins: int, interval: float):
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(interval, lags, stop))
+    await asyncio.sleep(interval)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(login(hashed_password) for _ in range(logins)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "logins_per_sec": round(logins / elapsed, 1),
+        "rejected": sum(isinstance(r, Exception) for r in results),
+        "loop_lag_ms": {
+            "p50": round(statistics.median(lags_ms), 2),
+            "p99": round(lags_ms[int(len(lags_ms) * 0.99)], 2),
+            "max": round(lags_ms[-1], 2),
+        },
+    }
+
+
+async def run(args):
+    hashed_password = PasswordHasher.pwd_context.hash(PASSWORD)
+    interval = args.probe_interval / 1000
+    result = {
+        "logins": args.logins,
+        "bcrypt_rounds": settings.PASSWORD_BCRYPT_ROUNDS,
+        "workers": settings.PASSWORD_HASH_WORKERS,
+        "max_queue": settings.PASSWORD_HASH_MAX_QUEUE,
+        "inline": await storm(
+            login_inline, hashed_password, args.logins, interval
+        ),
+        "pool": await storm(
+            login_pool, hashed_password, args.logins, interval
+        ),
+        "pool_stats": PasswordHasher.stats(),
+    }
+    PasswordHasher.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--probe-interval", type=float, default=10.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Прогон корпуса вопросов через индекс похожих вопросов.
+
+Запуск (из корня репозитория, с заполненным .env):
+
+    python -m benchmarks.similar_questions_bench --corpus questions.txt
+
+Файл корпуса содержит по одному вопросу в строке. Без --corpus
+генерируется синтетический корпус из перефразировок типовых вопросов.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from app.services.similar_questions import MinHashIndex
+
+BASE_QUESTIONS = [
+    "Как восстановить пароль от аккаунта?",
+    "Сколько токенов дается при регистрации?",
+    "Почему бот не отвечает на мои сообщения?",
+    "Как подключить Telegram бота к аккаунту на сайте?",
+    "Какой дневной лимит вопросов у бесплатного аккаунта?",
+    "Как написать функцию сортировки списка на Python?",
+    "Чем отличается список от кортежа в Python?",
+    "Как перевести текст с английского на русский?",
+    "Что такое асинхронное программирование?",
+    "Как сварить борщ в домашних условиях?",
+    "How do I reset my password?",
+    "What is the difference between TCP and UDP?",
+]
+
+
+def paraphrase(question: str, rng: random.Random) -> str:
+    words = question.rstrip("?").split()
+    action = rng.random()
+    if action < 0.25 and len(words) > 3:
+        words.pop(rng.randrange(1, len(words)))
+    elif action < 0.5 and len(words) > 2:
+        i = rng.randrange(len(words) - 1)
+        words[i], words[i + 1] = words[i + 1], words[i]
+    elif action < 0.75:
+        words = [w.lower() if rng.random() < 0.5 else w for w in words]
+    text = " ".join(words)
+    if rng.random() < 0.5:
+        text += "?"
+    if rng.random() < 0.3:
+        text = "Подскажите, " + text[0].lower() + text[1:]
+    return text
+
+
+def synthetic_corpus(size: int, seed: int):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        group = rng.randrange(len(BASE_QUESTIONS))
+        corpus.append((group, paraphrase(BASE_QUESTIONS[group], rng)))
+    return corpus
+
+
+def load_corpus(path: str):
+    with open(path, encoding="utf-8") as corpus_file:
+        return [
+            (None, line.strip()) for line in corpus_file if line.strip()
+        ]
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * fraction))
+    return ordered[index]
+
+
+def run(corpus, threshold: float, max_entries: int, num_perm: int,
+        bands: int):
+    index = MinHashIndex(
+        num_perm=num_perm, bands=bands, max_entries=max_entries
+    )
+    groups = {}
+    hits = correct = 0
+    lookups = []
+
+    for i, (group, question) in enumerate(corpus):
+        started = time.perf_counter()
+        key, _ = index.query(question, threshold)
+        lookups.append((time.perf_counter() - started) * 1000)
+
+        if key is None:
+            key = f"q{i}"
+            index.add(key, question)
+            groups[key] = group
+        else:
+            hits += 1
+            if group is not None and groups.get(key) == group:
+                correct += 1
+
+    result = {
+        "questions": len(corpus),
+        "threshold": threshold,
+        "num_perm": num_perm,
+        "bands": bands,
+        "index_size": len(index),
+        "hit_rate": round(hits / len(corpus), 4),
+        "lookup_ms_p50": round(statistics.median(lookups), 4),
+        "lookup_ms_p95": round(percentile(lookups, 0.95), 4),
+        "lookup_ms_p99": round(percentile(lookups, 0.99), 4),
+    }
+    if corpus[0][0] is not None:
+        result["hit_precision"] = round(correct / hits, 4) if hits else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus")
+    parser.add_argument("--size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--max-entries", type=int, default=10000)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = synthetic_corpus(args.size, args.seed)
+
+    result = run(
+        corpus, args.threshold, args.max_entries, args.num_perm, args.bands
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Сравнение приблизительной оценки токенов с BPE-токенизатором.
+
+Запуск (из корня репозитория, с заполненным .env):
+
+    TOKENIZER_VOCAB_PATH=cl100k_base.tiktoken \\
+        python -m benchmarks.token_count_bench --corpus questions.txt
+
+Точность оценки считается относительно BPE-токенизатора. Без --corpus
+используется небольшой набор русских и английских вопросов.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.services.token_service import TokenService
+from app.services.tokenizer import Tokenizer
+
+SAMPLE_TEXTS = [
+    "Привет! Как дела?",
+    "Объясни, пожалуйста, разницу между процессом и потоком в Linux.",
+    "Напиши функцию на Python, которая сортирует список словарей по ключу.",
+    "Сколько будет 1234 умножить на 5678?",
+    "Переведи на английский: «Завтра будет солнечно и тепло».",
+    "Какие книги Достоевского стоит прочитать в первую очередь и почему?",
+    "What is the capital of Australia?",
+    "Explain the CAP theorem in two sentences.",
+    "def fib(n): return n if n < 2 else fib(n - 1) + fib(n - 2)",
+    "Составь план тренировок на неделю для начинающего бегуна.",
+]
+
+
+def load_corpus(path: str):
+    with open(path, encoding="utf-8") as corpus_file:
+        return [line.strip() for line in corpus_file if line.strip()]
+
+
+def throughput(count_fn, texts, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        count_fn(texts)
+    elapsed = time.perf_counter() - started
+    return round(len(texts) * repeat / elapsed, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if not Tokenizer.available():
+        raise SystemExit(
+            "BPE-токенизатор недоступен: установите tiktoken "
+            "и задайте TOKENIZER_VOCAB_PATH"
+        )
+
+    texts = load_corpus(args.corpus) if args.corpus else SAMPLE_TEXTS
+    encoding = Tokenizer.get_encoding()
+
+    exact = [len(encoding.encode_ordinary(text)) for text in texts]
+    estimated = [TokenService.estimate_tokens(text) for text in texts]
+    errors = [e - x for e, x in zip(estimated, exact)]
+    relative = [abs(err) / x for err, x in zip(errors, exact) if x]
+
+    def count_uncached(batch):
+        return [len(encoding.encode_ordinary(text)) for text in batch]
+
+    def count_cached(batch):
+        return [Tokenizer.count(text) for text in batch]
+
+    result = {
+        "texts": len(texts),
+        "bpe_tokens_total": sum(exact),
+        "estimate_tokens_total": sum(estimated),
+        "estimate_mean_abs_error": round(
+            statistics.mean(abs(err) for err in errors), 2
+        ),
+        "estimate_mean_rel_error": round(statistics.mean(relative), 4),
+        "estimate_underbilled_share": round(
+            sum(err < 0 for err in errors) / len(errors), 4
+        ),
+        "texts_per_sec": {
+            "estimate": throughput(
+                lambda batch: [TokenService.estimate_tokens(t) for t in batch],
+                texts, args.repeat
+            ),
+            "bpe": throughput(count_uncached, texts, args.repeat),
+            "bpe_lru": throughput(count_cached, texts, args.repeat),
+            "bpe_batch": throughput(
+                encoding.encode_ordinary_batch, texts, args.repeat
+            ),
+        },
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+import pytest
+
+# Настройки читаются при импорте app, поэтому задаются до него. Тесты
+# работают с SQLite во временном каталоге и с fakeredis, а не с
+# настоящими базой и Redis
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(
+    tempfile.mkdtemp(prefix="tests_"), "app.db"
+)
+os.environ["DATABASE_READ_URLS"] = ""
+for name, value in {
+    "OPENAI_API_KEY": "test",
+    "TELEGRAM_TOKEN": "1:test",
+    "API_URL": "http://api",
+    "DAILY_MESSAGE_LIMIT": "3",
+    "SECRET_KEY": "test",
+    "REDIS_URL": "redis://localhost:6379",
+    "TELEGRAM_BOT_URL": "https://t.me/test_bot",
+}.items():
+    os.environ.setdefault(name, value)
+
+try:
+    import aioredis  # noqa: F401
+except TypeError:
+    # aioredis 2 не импортируется на Python 3.11+, тот же API есть
+    # в redis.asyncio
+    import redis.asyncio
+    sys.modules["aioredis"] = redis.asyncio
+
+import aioredis  # noqa: E402
+import fakeredis  # noqa: E402
+
+from app.db.init_db import engine, init_db  # noqa: E402
+from app.db.models import Base, User  # noqa: E402
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    # Сервисы создают клиентов сами через aioredis.from_url, поэтому
+    # все они получают клиентов одного сервера fakeredis
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    monkeypatch.setattr(aioredis, "from_url", from_url)
+
+    from app.services.ask_jobs import AskJobService
+    from app.services.db_routing import DbRoutingService
+    from app.services.message_limit import MessageLimitService
+    from app.services.token_ledger import TokenLedgerService
+    from app.services.user_cache import UserCacheService
+    for service in (
+        AskJobService, DbRoutingService, TokenLedgerService, UserCacheService
+    ):
+        monkeypatch.setattr(service, "_redis", None)
+    # Локальные кэши не должны переживать тест вместе с его сервером
+    monkeypatch.setattr(MessageLimitService, "_scripts", {})
+    monkeypatch.setattr(UserCacheService, "_local", OrderedDict())
+    monkeypatch.setattr(UserCacheService, "_local_ids", {})
+    return server
+
+
+@pytest.fixture
+def redis_client(redis_server):
+    return fakeredis.FakeAsyncRedis(
+        server=redis_server, decode_responses=True
+    )
+
+
+@pytest.fixture
+async def database():
+    await init_db()
+    yield engine
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    # Соединения aiosqlite привязаны к циклу событий теста
+    await engine.dispose()
+
+
+@pytest.fixture
+def create_user(database):
+    async def create(user_id: int, tokens: int = 100):
+        async with database.begin() as conn:
+            await conn.execute(User.__table__.insert().values(
+                id=user_id, email=f"user{user_id}@example.com",
+                hashed_password="-", tokens=tokens
+            ))
+    return create
@@ -0,0 +1,111 @@
+import pytest
+
+from app.core.config import settings
+from app.services.adaptive_limit import AdaptiveLimit
+from app.services.circuit_breaker import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def adaptive(monkeypatch, clock):
+    monkeypatch.setattr(settings, "OPENAI_AIMD_ENABLED", True)
+    monkeypatch.setattr(settings, "OPENAI_MAX_CONCURRENCY", 8)
+    monkeypatch.setattr(settings, "OPENAI_AIMD_MIN_LIMIT", 1)
+    monkeypatch.setattr(settings, "OPENAI_AIMD_DECREASE", 0.5)
+    monkeypatch.setattr(settings, "OPENAI_AIMD_DECREASE_INTERVAL", 1.0)
+    monkeypatch.setattr(AdaptiveLimit, "_limit", 8.0)
+    monkeypatch.setattr(AdaptiveLimit, "_last_decrease", 0.0)
+    monkeypatch.setattr(
+        AdaptiveLimit, "_stats", {"increases": 0, "decreases": 0}
+    )
+
+
+def test_overload_halves_limit_once_per_interval(adaptive, clock):
+    AdaptiveLimit.on_overload()
+    AdaptiveLimit.on_overload()
+    assert AdaptiveLimit.limit() == 4
+
+    clock[0] += 1.0
+    AdaptiveLimit.on_overload()
+    assert AdaptiveLimit.limit() == 2
+    assert AdaptiveLimit.stats()["decreases"] == 2
+
+
+def test_limit_does_not_fall_below_minimum(adaptive, clock):
+    for _ in range(10):
+        clock[0] += 1.0
+        AdaptiveLimit.on_overload()
+    assert AdaptiveLimit.limit() == 1
+
+
+def test_success_grows_limit_back_to_maximum(adaptive):
+    AdaptiveLimit.on_overload()
+    # Около одного запроса на лимит на каждую единицу роста
+    for _ in range(4):
+        AdaptiveLimit.on_success()
+    assert AdaptiveLimit.limit() == 4
+    for _ in range(100):
+        AdaptiveLimit.on_success()
+    assert AdaptiveLimit.limit() == 8
+
+
+def test_disabled_limit_is_fixed(adaptive, monkeypatch):
+    monkeypatch.setattr(settings, "OPENAI_AIMD_ENABLED", False)
+    AdaptiveLimit.on_overload()
+    assert AdaptiveLimit.limit() == 8
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.on_failure()
+    assert breaker.available()
+    breaker.on_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available()
+    assert breaker.retry_after() == 10
+
+
+def test_breaker_allows_single_probe_after_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.on_failure()
+    clock[0] += 10
+
+    assert breaker.available()
+    breaker.on_attempt()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.available()
+
+    breaker.on_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_failed_probe_reopens_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    for _ in range(3):
+        breaker.on_failure()
+    clock[0] += 10
+    breaker.on_attempt()
+    breaker.on_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 10
+    assert breaker.stats()["opened"] == 2
+
+
+def test_cancelled_probe_frees_half_open_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.on_failure()
+    clock[0] += 10
+    breaker.on_attempt()
+    breaker.on_cancel()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.available()
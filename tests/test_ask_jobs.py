@@ -0,0 +1,126 @@
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from app.api import endpoints
+from app.core.config import settings
+from app.services.answer_cache import AnswerCacheService
+from app.services.ask_jobs import AskJobService
+from app.services.ask_service import AskService, PreparedQuestion
+from app.services.auth import AuthService
+from app.services.message_limit import RateLimitResult
+from app.services.openai_service import ChatAnswer
+
+USER_ID = 1
+EMAIL = "user1@example.com"
+CHAT_ID = "555"
+
+
+@pytest.fixture
+def answered(monkeypatch):
+    calls = {"asked": 0, "settled": 0}
+
+    async def ask_question(redis_client, question, user_id, history):
+        calls["asked"] += 1
+        return ChatAnswer("Ответ", 5, 7), False
+
+    async def settle_answer(db, user_id, reserved, tokens_needed, answer,
+                            cached):
+        calls["settled"] += 1
+        return 88, 12
+
+    monkeypatch.setattr(AnswerCacheService, "ask_question", ask_question)
+    monkeypatch.setattr(AskService, "settle_answer", settle_answer)
+    return calls
+
+
+async def submit_job(chat_id=None) -> str:
+    prepared = PreparedQuestion(RateLimitResult(True, 3, 2, 60), 5, 100)
+    return await AskJobService.submit(
+        USER_ID, "Вопрос", prepared, chat_id=chat_id
+    )
+
+
+async def test_job_is_settled_once(redis_client, answered):
+    job_id = await submit_job()
+    key = AskJobService.job_key(job_id)
+    job = await redis_client.hgetall(key)
+
+    result = await AskJobService._answer(key, job)
+    assert result["tokens_remaining"] == 88
+
+    # Забранное другим воркером задание не списывает токены повторно
+    with pytest.raises(HTTPException) as error:
+        await AskJobService._answer(key, job)
+    assert error.value.status_code == 500
+    assert answered["settled"] == 1
+
+
+async def test_settled_job_is_not_answered_again(redis_client, answered):
+    job_id = await submit_job()
+    key = AskJobService.job_key(job_id)
+    await redis_client.hset(key, "settled", 1)
+
+    await AskJobService.process(job_id)
+
+    job = await redis_client.hgetall(key)
+    assert job["status"] == AskJobService.STATUS_ERROR
+    assert job["status_code"] == "500"
+    assert answered == {"asked": 0, "settled": 0}
+
+
+@pytest.fixture
+async def api(redis_client, create_user, monkeypatch):
+    await create_user(USER_ID)
+    monkeypatch.setattr(settings, "ASK_JOBS_ENABLED", True)
+    monkeypatch.setattr(endpoints, "redis_client", redis_client)
+
+    async def prepare(redis_client, user, question, db, conversation):
+        return PreparedQuestion(RateLimitResult(True, 3, 2, 60), 5, 100)
+
+    monkeypatch.setattr(AskService, "prepare", prepare)
+
+    app = FastAPI()
+    app.include_router(endpoints.router)
+    token = AuthService.create_access_token({"sub": EMAIL})
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://api",
+        headers={"Authorization": f"Bearer {token}"}
+    ) as client:
+        yield client
+
+
+async def test_push_to_unbound_chat_is_forbidden(api, redis_client):
+    response = await api.post("/jobs", json={
+        "user_id": CHAT_ID, "question": "Вопрос", "push": True
+    })
+    assert response.status_code == 403
+    assert await redis_client.xlen(AskJobService.STREAM_KEY) == 0
+
+
+async def test_push_to_chat_of_another_user_is_forbidden(api, redis_client):
+    await redis_client.set(
+        f"bot_session:{CHAT_ID}",
+        json.dumps({"e": "other@example.com", "t": "-"})
+    )
+    response = await api.post("/jobs", json={
+        "user_id": CHAT_ID, "question": "Вопрос", "push": True
+    })
+    assert response.status_code == 403
+
+
+async def test_push_to_bound_chat_is_queued(api, redis_client):
+    await redis_client.set(
+        f"bot_session:{CHAT_ID}", json.dumps({"e": EMAIL, "t": "-"})
+    )
+    response = await api.post("/jobs", json={
+        "user_id": CHAT_ID, "question": "Вопрос", "push": True
+    })
+    assert response.status_code == 202
+    job = await redis_client.hgetall(
+        AskJobService.job_key(response.json()["job_id"])
+    )
+    assert job["chat_id"] == CHAT_ID
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.services.conversation import ConversationService
+
+KEY = ConversationService.make_key(1, "chat")
+
+
+@pytest.fixture(autouse=True)
+def conversation(monkeypatch):
+    monkeypatch.setattr(settings, "CONVERSATION_ENABLED", True)
+    monkeypatch.setattr(settings, "CONVERSATION_MESSAGE_OVERHEAD", 0)
+    monkeypatch.setattr(settings, "CONVERSATION_CONTEXT_TOKENS", 100)
+    monkeypatch.setattr(settings, "CONVERSATION_MAX_MESSAGES", 50)
+
+
+async def stored(redis_client):
+    return [
+        json.loads(raw) for raw in await redis_client.lrange(KEY, 0, -1)
+    ]
+
+
+async def test_append_turn_keeps_token_total(redis_client):
+    await ConversationService.append_turn(
+        redis_client, KEY, "Вопрос", 10, "Ответ", 20
+    )
+
+    assert await stored(redis_client) == [
+        ["u", 10, "Вопрос"], ["a", 20, "Ответ"]
+    ]
+    assert await redis_client.get(f"{KEY}:tokens") == "30"
+    assert await redis_client.ttl(KEY) > 0
+
+
+async def test_old_turns_are_trimmed_to_budget(redis_client):
+    for number in range(4):
+        await ConversationService.append_turn(
+            redis_client, KEY, f"Вопрос {number}", 10, f"Ответ {number}", 20
+        )
+
+    messages = await stored(redis_client)
+    assert [text for _, _, text in messages] == [
+        "Вопрос 1", "Ответ 1", "Вопрос 2", "Ответ 2", "Вопрос 3", "Ответ 3"
+    ]
+    assert await redis_client.get(f"{KEY}:tokens") == "90"
+
+
+async def test_history_does_not_start_with_answer(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "CONVERSATION_MAX_MESSAGES", 3)
+    for number in range(2):
+        await ConversationService.append_turn(
+            redis_client, KEY, f"Вопрос {number}", 10, f"Ответ {number}", 20
+        )
+
+    # Лимит в 3 сообщения оставил бы ответ без вопроса, он тоже удаляется
+    assert [role for role, _, _ in await stored(redis_client)] == ["u", "a"]
+    assert await redis_client.get(f"{KEY}:tokens") == "30"
+
+
+async def test_get_history_fits_budget(redis_client):
+    for number in range(2):
+        await ConversationService.append_turn(
+            redis_client, KEY, f"Вопрос {number}", 10, f"Ответ {number}", 20
+        )
+
+    history = await ConversationService.get_history(redis_client, KEY, 50)
+    assert history.messages == [
+        {"role": "user", "content": "Вопрос 1"},
+        {"role": "assistant", "content": "Ответ 1"},
+    ]
+    assert history.tokens == 30
+
+    # В бюджет помещается только последний ответ, без вопроса он не нужен
+    history = await ConversationService.get_history(redis_client, KEY, 25)
+    assert history.messages == []
+    assert history.tokens == 0
+
+
+async def test_reset(redis_client):
+    await ConversationService.append_turn(
+        redis_client, KEY, "Вопрос", 10, "Ответ", 20
+    )
+    await ConversationService.reset(redis_client, KEY)
+    assert await redis_client.exists(KEY, f"{KEY}:tokens") == 0
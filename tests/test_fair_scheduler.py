@@ -0,0 +1,103 @@
+import itertools
+from collections import defaultdict
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.adaptive_limit import AdaptiveLimit
+from app.services.fair_scheduler import FairScheduler, parse_weights
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    monkeypatch.setattr(FairScheduler, "_weights", {"vip": 2.0})
+    monkeypatch.setattr(FairScheduler, "_sequence", itertools.count())
+    monkeypatch.setattr(FairScheduler, "_heap", [])
+    monkeypatch.setattr(FairScheduler, "_in_flight", 0)
+    monkeypatch.setattr(FairScheduler, "_virtual_time", 0.0)
+    monkeypatch.setattr(FairScheduler, "_last_tags", {})
+    monkeypatch.setattr(FairScheduler, "_queued", defaultdict(int))
+    monkeypatch.setattr(FairScheduler, "_stats", defaultdict(float))
+    monkeypatch.setattr(AdaptiveLimit, "limit", classmethod(lambda cls: 1))
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_QUEUED_PER_USER", 10)
+
+
+def test_parse_weights():
+    assert parse_weights("vip: 2, ,free:0.5") == {"vip": 2.0, "free": 0.5}
+
+
+def grant_order(tickets, count):
+    order = []
+    running = next(ticket for ticket in tickets if ticket.granted)
+    for _ in range(count):
+        FairScheduler.release(running)
+        running = next(
+            ticket for ticket in tickets
+            if ticket.granted and not ticket.released
+        )
+        order.append(running.key)
+    return order
+
+
+async def test_one_user_does_not_crowd_out_others():
+    tickets = [FairScheduler.enqueue("busy") for _ in range(4)]
+    tickets.append(FairScheduler.enqueue("quiet"))
+
+    assert tickets[0].granted
+    assert grant_order(tickets, 2) == ["busy", "quiet"]
+
+
+async def test_weight_gives_proportional_share():
+    tickets = [FairScheduler.enqueue("holder")]
+    for _ in range(4):
+        tickets.append(FairScheduler.enqueue("vip"))
+        tickets.append(FairScheduler.enqueue("free"))
+
+    order = grant_order(tickets, 6)
+    assert order.count("vip") == 4
+    assert order.count("free") == 2
+
+
+async def test_position_counts_tickets_ahead():
+    first = FairScheduler.enqueue("a")
+    second = FairScheduler.enqueue("b")
+    third = FairScheduler.enqueue("c")
+
+    assert first.position() == 0
+    assert second.position() == 1
+    assert third.position() == 2
+    FairScheduler.release(second)
+    assert third.position() == 1
+
+
+async def test_queue_per_user_is_limited(monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_QUEUED_PER_USER", 1)
+    FairScheduler.enqueue("a")
+    FairScheduler.enqueue("a")
+    with pytest.raises(HTTPException) as error:
+        FairScheduler.enqueue("a")
+    assert error.value.status_code == 429
+
+
+async def test_wait_past_deadline_raises_503(monkeypatch):
+    FairScheduler.enqueue("a")
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_QUEUE_TIME", 0.01)
+    waiting = FairScheduler.enqueue("b")
+
+    assert await waiting.wait(timeout=0.001) is False
+    with pytest.raises(HTTPException) as error:
+        await waiting.wait()
+    assert error.value.status_code == 503
+    FairScheduler.release(waiting)
+    assert FairScheduler.stats()["queued"] == 0
+
+
+async def test_extra_slot_only_when_idle():
+    assert FairScheduler.try_acquire_extra()
+    assert not FairScheduler.try_acquire_extra()
+    waiting = FairScheduler.enqueue("a")
+    assert not waiting.granted
+
+    FairScheduler.release_extra()
+    assert waiting.granted
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.message_limit import MessageLimitService
+
+USER_ID = 7
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    def use(name: str):
+        monkeypatch.setattr(settings, "RATE_LIMIT_POLICY", name)
+    monkeypatch.setattr(MessageLimitService, "daily_message_limit", 3)
+    return use
+
+
+async def ask(redis_client, times: int):
+    results = []
+    for _ in range(times):
+        try:
+            results.append(
+                await MessageLimitService.check_and_increment_question_count(
+                    redis_client, USER_ID
+                )
+            )
+        except HTTPException as e:
+            results.append(e)
+    return results
+
+
+async def test_fixed_day_counts_under_calendar_day_key(redis_client, policy):
+    policy(MessageLimitService.POLICY_FIXED_DAY)
+    *allowed, rejected = await ask(redis_client, 4)
+
+    assert [result.remaining for result in allowed] == [2, 1, 0]
+    assert rejected.status_code == 451
+    assert rejected.headers["X-RateLimit-Remaining"] == "0"
+    assert int(rejected.headers["Retry-After"]) > 0
+
+    # Ключ тот же, что до перехода на скрипт: счетчики переживают
+    # обновление, а сброс происходит в местную полночь
+    key = f"{USER_ID}:{datetime.now().strftime('%Y-%m-%d')}"
+    assert await redis_client.keys("*") == [key]
+    assert await redis_client.get(key) == "3"
+    assert 0 < await redis_client.ttl(key) <= MessageLimitService.DAY
+
+
+async def test_fixed_day_keeps_existing_counter(redis_client, policy):
+    policy(MessageLimitService.POLICY_FIXED_DAY)
+    key = f"{USER_ID}:{datetime.now().strftime('%Y-%m-%d')}"
+    await redis_client.set(key, 3, ex=60)
+
+    rejected, = await ask(redis_client, 1)
+    assert rejected.status_code == 451
+    assert await redis_client.get(key) == "3"
+
+
+async def test_sliding_window(redis_client, policy):
+    policy(MessageLimitService.POLICY_SLIDING_WINDOW)
+    *allowed, rejected = await ask(redis_client, 4)
+
+    assert [result.remaining for result in allowed] == [2, 1, 0]
+    assert rejected.status_code == 451
+    key = f"rate:{USER_ID}:sliding"
+    assert await redis_client.zcard(key) == 3
+    assert await redis_client.pttl(key) > 0
+
+
+async def test_token_bucket(redis_client, policy):
+    policy(MessageLimitService.POLICY_TOKEN_BUCKET)
+    *allowed, rejected = await ask(redis_client, 4)
+
+    assert [result.remaining for result in allowed] == [2, 1, 0]
+    assert rejected.status_code == 451
+    # Одна заявка пополняется за треть окна
+    reset_after = int(rejected.headers["Retry-After"])
+    assert 0 < reset_after <= settings.RATE_LIMIT_WINDOW // 3 + 1
+
+
+async def test_burst_limits_per_minute(redis_client, policy, monkeypatch):
+    policy(MessageLimitService.POLICY_BURST)
+    monkeypatch.setattr(settings, "RATE_LIMIT_BURST_PER_MINUTE", 2)
+    *allowed, rejected = await ask(redis_client, 3)
+
+    assert [result.allowed for result in allowed] == [True, True]
+    assert rejected.status_code == 451
+    assert int(rejected.headers["Retry-After"]) <= MessageLimitService.MINUTE
+    # Отклоненный запрос не увеличивает ни один счетчик
+    day_key = f"{USER_ID}:{datetime.now().strftime('%Y-%m-%d')}"
+    assert await redis_client.get(day_key) == "2"
@@ -0,0 +1,91 @@
+import pytest
+
+from app.core.config import settings
+from app.services.similar_questions import (
+    MinHashIndex, SimilarQuestionService
+)
+
+QUESTION = "Как приготовить борщ с говядиной дома?"
+PARAPHRASE = "Как приготовить борщ с говядиной дома"
+
+
+@pytest.fixture
+def index():
+    return MinHashIndex(num_perm=64, bands=16, ttl=60)
+
+
+def test_num_perm_must_split_into_bands():
+    with pytest.raises(ValueError):
+        MinHashIndex(num_perm=64, bands=10)
+
+
+def test_paraphrase_is_found(index):
+    index.add("borsch", QUESTION)
+
+    key, similarity = index.query(PARAPHRASE, 0.8)
+    assert key == "borsch"
+    assert similarity >= 0.8
+
+
+def test_unrelated_question_is_not_found(index):
+    index.add("borsch", QUESTION)
+    assert index.query("Какая погода в Лондоне завтра?", 0.8)[0] is None
+
+
+def test_numbers_and_negations_must_match(index):
+    index.add("hours", "Сколько длится поездка 2 часа на поезде")
+    index.add("works", "Почему работает ноутбук от батареи")
+
+    for question in (
+        "Сколько длится поездка 20 часа на поезде",
+        "Почему не работает ноутбук от батареи",
+    ):
+        assert index.query(question, 0.5)[0] is None
+
+
+def test_expired_entries_are_skipped_and_compacted(index, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    index.add("borsch", QUESTION)
+    now[0] += 61
+
+    assert index.query(QUESTION, 0.8)[0] is None
+    assert index.compact() == 1
+    assert len(index) == 0
+
+
+def test_oldest_entry_is_evicted(index):
+    index.max_entries = 2
+    index.add("first", "Первый вопрос про кошек")
+    index.add("second", "Второй вопрос про собак")
+    index.add("third", "Третий вопрос про птиц")
+
+    assert len(index) == 2
+    assert index.query("Первый вопрос про кошек", 0.8)[0] is None
+
+
+def test_remove(index):
+    index.add("borsch", QUESTION)
+    index.remove("borsch")
+    index.remove("borsch")
+    assert index.query(QUESTION, 0.8)[0] is None
+
+
+async def test_service_keeps_index_per_model(monkeypatch):
+    monkeypatch.setattr(settings, "SIMILAR_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "SIMILAR_CACHE_THRESHOLD", 0.8)
+    monkeypatch.setattr(SimilarQuestionService, "_indexes", {})
+
+    await SimilarQuestionService.remember("borsch", QUESTION, "model-a")
+
+    assert await SimilarQuestionService.find_key(
+        PARAPHRASE, "model-a"
+    ) == "borsch"
+    assert await SimilarQuestionService.find_key(
+        PARAPHRASE, "model-b"
+    ) is None
+
+    await SimilarQuestionService.forget("borsch", "model-a")
+    assert await SimilarQuestionService.find_key(
+        PARAPHRASE, "model-a"
+    ) is None
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from app.bot import telegram_bot
+from app.bot.sessions import BotSession, MemorySessionStore
+from app.core.status_codes import StatusMessages
+
+CHAT_ID = 555
+
+
+class Message:
+    def __init__(self, text: str):
+        self.chat_id = CHAT_ID
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text: str):
+        self.replies.append(text)
+
+
+@pytest.fixture
+async def api(monkeypatch):
+    # API отвечает статусом, заданным в тесте, на любой вопрос
+    state = {"status": 200}
+
+    async def ask(request):
+        return web.json_response(
+            {"detail": "Ошибка"}, status=state["status"]
+        )
+
+    app = web.Application()
+    app.router.add_post("/ask", ask)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    monkeypatch.setattr(telegram_bot, "api_url", f"http://127.0.0.1:{port}")
+
+    store = MemorySessionStore()
+    await store.set(CHAT_ID, BotSession("user@example.com", "token"))
+    monkeypatch.setattr(telegram_bot, "session_store", store)
+
+    async with aiohttp.ClientSession() as session:
+        state["context"] = SimpleNamespace(
+            bot_data={"api_session": session}
+        )
+        yield state
+    await runner.cleanup()
+
+
+async def ask(api, status: int) -> list:
+    api["status"] = status
+    message = Message("Вопрос")
+    await telegram_bot.answer_question(
+        SimpleNamespace(message=message), api["context"]
+    )
+    return message.replies
+
+
+@pytest.mark.parametrize("status, reply", [
+    (429, StatusMessages.TOO_MANY_REQUESTS),
+    (503, StatusMessages.SERVICE_UNAVAILABLE),
+    (500, StatusMessages.SERVER_ERROR),
+])
+async def test_api_errors_are_explained(api, status, reply):
+    assert await ask(api, status) == [reply]
+
+
+async def test_expired_session_is_dropped(api):
+    assert await ask(api, 401) == [StatusMessages.SESSION_EXPIRED]
+    assert await telegram_bot.session_store.get(CHAT_ID) is None
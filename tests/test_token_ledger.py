@@ -0,0 +1,138 @@
+import pytest
+from sqlalchemy import delete, func, select
+
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import TokenLedgerEntry, User
+from app.services.token_ledger import TokenLedgerService
+
+
+@pytest.fixture
+async def ledger(redis_client, create_user):
+    await create_user(1, tokens=100)
+    await create_user(2, tokens=100)
+    await TokenLedgerService._ensure_group()
+    return redis_client
+
+
+async def apply(user_id: int, delta: int):
+    async with AsyncSessionLocal() as db:
+        return await TokenLedgerService.apply_delta(user_id, delta, db)
+
+
+async def db_tokens(user_id: int):
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(User.tokens).where(User.id == user_id)
+        )).scalar_one_or_none()
+
+
+async def entry_count() -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.count()).select_from(TokenLedgerEntry)
+        )).scalar_one()
+
+
+async def read_batch(redis_client, consumer="flusher"):
+    response = await redis_client.xreadgroup(
+        TokenLedgerService.GROUP_NAME, consumer,
+        {TokenLedgerService.STREAM_KEY: ">"}
+    )
+    return response[0][1]
+
+
+async def test_apply_delta_loads_balance_from_database(ledger):
+    assert await apply(1, -30) == 70
+    assert await apply(1, -80) is None
+    assert await apply(3, -1) is None
+
+    assert await ledger.get(TokenLedgerService.balance_key(1)) == "70"
+    assert await ledger.xlen(TokenLedgerService.STREAM_KEY) == 1
+    assert await ledger.hgetall(TokenLedgerService.PENDING_KEY) == {
+        "1": "-30"
+    }
+
+
+async def test_flush_writes_entries_and_clears_pending(ledger):
+    await apply(1, -30)
+    await apply(1, 10)
+    await apply(2, -5)
+
+    assert await TokenLedgerService.flush_once() == 3
+
+    assert await db_tokens(1) == 80
+    assert await db_tokens(2) == 95
+    assert await entry_count() == 3
+    assert await ledger.xlen(TokenLedgerService.STREAM_KEY) == 0
+    assert await ledger.hgetall(TokenLedgerService.PENDING_KEY) == {}
+
+
+async def test_repeated_write_does_not_change_balance_twice(ledger):
+    await apply(1, -30)
+    messages = await read_batch(ledger)
+
+    await TokenLedgerService.write_entries(messages)
+    await TokenLedgerService.write_entries(messages)
+
+    assert await db_tokens(1) == 70
+    assert await entry_count() == 1
+
+
+async def test_entries_of_deleted_user_are_dead_lettered(ledger):
+    await apply(1, -30)
+    await apply(2, -5)
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(User).where(User.id == 2))
+        await db.commit()
+
+    assert await TokenLedgerService.flush_once() == 2
+
+    assert await db_tokens(1) == 70
+    assert await entry_count() == 1
+    assert await ledger.xlen(TokenLedgerService.STREAM_KEY) == 0
+    (_, fields), = await ledger.xrange(TokenLedgerService.DEAD_STREAM_KEY)
+    assert fields["user_id"] == "2"
+    assert fields["delta"] == "-5"
+    assert fields["reason"] == "user_not_found"
+
+
+async def test_reload_between_commit_and_ack_counts_entries_once(ledger):
+    await apply(1, -30)
+    await apply(1, -20)
+    messages = await read_batch(ledger)
+    # Первая запись уже в базе, но поток еще не подтвержден
+    await TokenLedgerService.write_entries(messages[:1])
+    await ledger.delete(TokenLedgerService.balance_key(1))
+
+    assert await apply(1, 0) == 50
+    assert await ledger.get(TokenLedgerService.balance_key(1)) == "50"
+
+    await TokenLedgerService._flush(messages)
+    assert await db_tokens(1) == 50
+    assert await ledger.get(TokenLedgerService.balance_key(1)) == "50"
+
+
+async def test_reconcile_fixes_drift_without_pending_entries(ledger):
+    await apply(1, -30)
+    await TokenLedgerService.flush_once()
+    await ledger.set(TokenLedgerService.balance_key(1), 999)
+
+    assert await TokenLedgerService.reconcile({1, 2}) == 1
+    assert await ledger.get(TokenLedgerService.balance_key(1)) == "70"
+
+
+async def test_reconcile_skips_users_with_pending_entries(ledger):
+    await apply(1, -30)
+    await ledger.set(TokenLedgerService.balance_key(1), 999)
+
+    assert await TokenLedgerService.reconcile({1}) == 0
+    assert await ledger.get(TokenLedgerService.balance_key(1)) == "999"
+
+
+async def test_recover_flushes_entries_of_crashed_consumer(ledger):
+    await apply(1, -30)
+    await read_batch(ledger, consumer="crashed")
+
+    assert await TokenLedgerService.recover() == 1
+    assert await db_tokens(1) == 70
+    assert await ledger.xlen(TokenLedgerService.STREAM_KEY) == 0
@@ -0,0 +1,80 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import User
+from app.services.user_cache import UserCacheService, UserSnapshot
+
+EMAIL = "user1@example.com"
+SNAPSHOT_KEY = UserCacheService.SNAPSHOT_KEY_PREFIX + EMAIL
+ID_KEY = UserCacheService.ID_KEY_PREFIX + "1"
+
+
+def forget_local(monkeypatch):
+    monkeypatch.setattr(UserCacheService, "_local", OrderedDict())
+    monkeypatch.setattr(UserCacheService, "_local_ids", {})
+
+
+async def test_store_and_get(redis_client, monkeypatch):
+    await UserCacheService.store(User(id=1, email=EMAIL, tokens=50))
+    assert json.loads(await redis_client.get(SNAPSHOT_KEY)) == {
+        "id": 1, "email": EMAIL, "tokens": 50
+    }
+    assert await redis_client.get(ID_KEY) == EMAIL
+
+    forget_local(monkeypatch)
+    assert await UserCacheService.get(EMAIL) == UserSnapshot(1, EMAIL, 50)
+    assert await UserCacheService.get("missing@example.com") is None
+
+
+async def test_update_balance_keeps_ttl(redis_client, monkeypatch):
+    await UserCacheService.store(User(id=1, email=EMAIL, tokens=50))
+    await redis_client.expire(SNAPSHOT_KEY, 100)
+
+    await UserCacheService.update_balance(1, 42)
+
+    assert json.loads(await redis_client.get(SNAPSHOT_KEY))["tokens"] == 42
+    assert 0 < await redis_client.ttl(SNAPSHOT_KEY) <= 100
+    assert (await UserCacheService.get(EMAIL)).tokens == 42
+    forget_local(monkeypatch)
+    assert (await UserCacheService.get(EMAIL)).tokens == 42
+
+
+async def test_update_balance_without_snapshot(redis_client):
+    await UserCacheService.update_balance(1, 42)
+    assert await redis_client.keys("*") == []
+
+
+async def test_password_change_invalidates_snapshot(
+    redis_client, create_user
+):
+    await create_user(1)
+    async with AsyncSessionLocal() as db:
+        user = (
+            await db.execute(select(User).where(User.id == 1))
+        ).scalar_one()
+        await UserCacheService.store(user)
+        user.hashed_password = "changed"
+        await db.commit()
+    # Сброс в Redis запускается задачей после коммита
+    await asyncio.gather(*UserCacheService._pending)
+
+    assert await UserCacheService.get(EMAIL) is None
+    assert await redis_client.exists(SNAPSHOT_KEY, ID_KEY) == 0
+
+
+async def test_balance_change_keeps_snapshot(redis_client, create_user):
+    await create_user(1)
+    async with AsyncSessionLocal() as db:
+        user = (
+            await db.execute(select(User).where(User.id == 1))
+        ).scalar_one()
+        await UserCacheService.store(user)
+        user.tokens = 10
+        await db.commit()
+    await asyncio.gather(*UserCacheService._pending)
+
+    assert await redis_client.exists(SNAPSHOT_KEY) == 1